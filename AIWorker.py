@@ -1,10 +1,10 @@
 # 利用AI批量生成训练集
-import json
 import os
 import random
 import time
-import re
+import threading
 from typing import List, Dict
+import httpx
 import ollama
 # from openai import OpenAI
 import logging
@@ -12,8 +12,13 @@ import backoff
 import pyarrow as pa
 import pyarrow.parquet as pq
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from JobJournal import chunk_hash
+from Dedup import NearDuplicateFilter
+import ReplyParser
+import LLMRouter
+import Metrics
 
-# 设置全局任务计数器
+# 设置全局任务计数器（以条目为单位）
 class Public:
     all_tasks = 0
     now_tasks = 0
@@ -26,47 +31,265 @@ logger = logging.getLogger(__name__)
 # 从环境变量中获取 API 密钥
 api_key = "？？？"
 
+# 默认使用的模型与生成参数
+DEFAULT_MODEL = "qwen3:30b-a3b"
+DEFAULT_OPTIONS = {
+    'temperature': 0.7,     # 适度的创造性
+    'num_ctx': 4096,        # 中等大小的上下文窗口
+    'top_k': 50,
+    'top_p': 0.7,
+}
+# 是否让推理模型（如qwen3）输出思考过程；思考内容不会进入数据集，关闭可省去大量无用的输出token
+DEFAULT_THINK = False
+# 请求结束后模型在内存中的保留时间，避免生成任务中途被卸载后重新加载
+DEFAULT_KEEP_ALIVE = "30m"
+# 每个条目的输出token上限，防止模型失控输出
+NUM_PREDICT_PER_ENTRY = 1024
+# 上下文窗口按该粒度向上取整；同一任务内使用固定的 num_ctx，避免Ollama因 num_ctx 变化而重新加载模型
+NUM_CTX_STEP = 512
+# 重新提示时附带的已生成问题所需的余量（token）
+AVOID_HINT_TOKENS = 512
+# 条目必须包含的字段
+REQUIRED_KEYS = ['instruction', 'input', 'output']
+
+# 共享的Ollama客户端配置：服务地址（None 表示使用 OLLAMA_HOST 环境变量或本地默认地址）与连接池大小
+OLLAMA_HOST = None
+CLIENT_POOL_SIZE = 16
+_client = None
+_client_lock = threading.Lock()
+# 异步引擎使用的多个推理后端（见 LLMRouter.create_backend），例如
+# [{'type': 'ollama', 'url': 'http://10.0.0.1:11434'}, {'type': 'openai', 'url': 'http://10.0.0.2:8000/v1'}]
+# 为空时只使用 OLLAMA_HOST 上的单个Ollama服务
+LLM_BACKENDS = []
+# 未配置 LLM_BACKENDS 时，整个进程发往 OLLAMA_HOST 的在途请求上限（同时运行的多个任务共享）
+OLLAMA_MAX_IN_FLIGHT = 16
+
+def _pool_limits(pool_size: int) -> httpx.Limits:
+    """连接池配置：保持长连接，避免每次请求重新建立连接"""
+    return httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size, keepalive_expiry=60)
+
+def configure_client(host: str = None, pool_size: int = CLIENT_POOL_SIZE) -> ollama.Client:
+    """按给定的服务地址和连接池大小（重新）创建共享客户端"""
+    global _client, OLLAMA_HOST, CLIENT_POOL_SIZE
+    with _client_lock:
+        OLLAMA_HOST = host
+        CLIENT_POOL_SIZE = pool_size
+        # 旧客户端上可能仍有进行中的请求，不主动关闭，由垃圾回收释放
+        _client = ollama.Client(host=host, limits=_pool_limits(pool_size))
+        return _client
+
+def get_client() -> ollama.Client:
+    """获取共享的Ollama客户端（底层httpx客户端线程安全，可在多个线程间复用）"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ollama.Client(host=OLLAMA_HOST, limits=_pool_limits(CLIENT_POOL_SIZE))
+    return _client
+
+def create_async_client(host: str = None, pool_size: int = None):
+    """
+    创建带连接池的异步客户端（异步客户端绑定事件循环，每个事件循环单独创建）
+    未指定 host 时返回进程内共享的 LLMRouter（调用方式与 ollama.AsyncClient 相同）：配置了 LLM_BACKENDS 时在多个后端间
+    负载均衡，否则只包含 OLLAMA_HOST 一个后端；同时运行的多个任务共用同一个路由，各后端的在途上限对整个进程生效
+    """
+    if host is None:
+        specs = LLM_BACKENDS or [{'type': 'ollama', 'url': OLLAMA_HOST, 'name': OLLAMA_HOST or 'ollama',
+                                  'max_in_flight': OLLAMA_MAX_IN_FLIGHT}]
+        return LLMRouter.get_shared_router(specs)
+    return ollama.AsyncClient(host=host or OLLAMA_HOST, limits=_pool_limits(pool_size or CLIENT_POOL_SIZE))
+
+# 生成阶段的指标
+LLM_REQUEST_SECONDS = Metrics.histogram('tdf_llm_request_seconds', '大模型请求耗时（秒）', ('model',))
+LLM_REQUESTS = Metrics.counter('tdf_llm_requests_total', '大模型请求次数', ('model', 'status'))
+LLM_TOKENS = Metrics.counter('tdf_llm_tokens_total', '大模型请求的token数（prompt为输入，completion为输出）',
+                             ('model', 'kind'))
+LLM_TOKENS_PER_SECOND = Metrics.gauge('tdf_llm_tokens_per_second', '最近一次请求的输出速度（token/秒）', ('model',))
+LLM_IN_FLIGHT = Metrics.gauge('tdf_llm_in_flight_requests', '在途的大模型请求数')
+RETRIES = Metrics.counter('tdf_retries_total', '请求出错后的重试次数', ('source',))
+
+def record_request(model: str, latency: float, timing: Dict = None):
+    """记录一次大模型请求的指标，timing 为None表示请求失败"""
+    LLM_REQUEST_SECONDS.observe(latency, model=model)
+    LLM_REQUESTS.inc(model=model, status='ok' if timing is not None else 'error')
+    if timing:
+        LLM_TOKENS.inc(timing['prompt_tokens'], model=model, kind='prompt')
+        LLM_TOKENS.inc(timing['eval_tokens'], model=model, kind='completion')
+        if timing['tokens_per_second']:
+            LLM_TOKENS_PER_SECOND.set(timing['tokens_per_second'], model=model)
+
+def _count_backoff(details):
+    """backoff 重试回调：计入重试次数"""
+    RETRIES.inc(source=details['target'].__name__)
+
+def _log_giveup(details):
+    """backoff 放弃回调：重试次数用尽后记录最后一次错误"""
+    logger.error(f"{details['target'].__name__} 重试 {details['tries']} 次后仍然失败: {str(details['exception'])}")
+
+# 在INFO级别记录完整模型回复的抽样比例（0 表示只在DEBUG级别记录）
+RESPONSE_LOG_SAMPLE_RATE = 0.0
+
+def log_response(response: str):
+    """记录模型回复：DEBUG级别全部记录，否则按 RESPONSE_LOG_SAMPLE_RATE 抽样记录"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"API 响应: {response}")
+    elif RESPONSE_LOG_SAMPLE_RATE > 0 and random.random() < RESPONSE_LOG_SAMPLE_RATE:
+        logger.info(f"API 响应（抽样）: {response}")
+
+def request_timing(response) -> Dict:
+    """从Ollama响应的元数据中提取本次请求的token数与耗时（秒）"""
+    eval_duration = (response.get('eval_duration') or 0) / 1e9
+    eval_tokens = response.get('eval_count') or 0
+    return {
+        'model': response.get('model'),
+        'prompt_tokens': response.get('prompt_eval_count') or 0,
+        'eval_tokens': eval_tokens,
+        'load_duration': (response.get('load_duration') or 0) / 1e9,
+        'prompt_eval_duration': (response.get('prompt_eval_duration') or 0) / 1e9,
+        'eval_duration': eval_duration,
+        'total_duration': (response.get('total_duration') or 0) / 1e9,
+        'tokens_per_second': eval_tokens / eval_duration if eval_duration > 0 else 0.0,
+    }
+
+def _collect_stream(response, echo: bool = False):
+    """
+    将流式响应收集到列表缓冲区后一次性拼接，echo 为 True 时同时输出到控制台
+    返回:
+        tuple: (完整回复, 最后一个分片中的请求耗时信息)
+    """
+    parts = []
+    last_chunk = None
+    for chunk in response:
+        content = chunk["message"]["content"]
+        parts.append(content)
+        last_chunk = chunk
+        if echo:
+            print(f"{content}", end="", flush=True)
+    if echo:
+        print("\n" + "-"*50)
+    return "".join(parts), request_timing(last_chunk) if last_chunk is not None else {}
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计文本的token数（偏保守）：中日韩字符按每字1个token，其余字符按每3个字符1个token
+    """
+    cjk = sum(1 for char in text if '\u2e80' <= char <= '\u9fff' or '\uf900' <= char <= '\uffef')
+    return cjk + (len(text) - cjk + 2) // 3
+
+def generation_options(texts: List[str], entries_per_request: int = 1, batch: bool = False, temperature: float = None,
+                       top_k: int = None, top_p: float = None, context_window: int = None,
+                       num_predict: int = None, max_text_tokens: int = None) -> Dict:
+    """
+    为一个生成任务计算Ollama请求参数
+    num_predict 默认为每个请求的条目数乘以 NUM_PREDICT_PER_ENTRY；num_ctx 按任务中最长的提示词加上输出上限计算，
+    按 NUM_CTX_STEP 向上取整且不超过 context_window（超过时把 num_predict 缩减到窗口中提示词之外的剩余部分），
+    整个任务使用同一个值；提示词本身超出 context_window 时抛出 ValueError，剩余部分不足以生成完整条目时记录警告
+    参数:
+        texts (list): 任务中的全部文本块
+        entries_per_request (int): 批量模式下每个请求生成的条目数
+        batch (bool): 是否为批量模式
+        temperature, top_k, top_p: 采样参数，为None时使用 DEFAULT_OPTIONS
+        context_window (int): 上下文窗口上限，为None时不限制
+        num_predict (int): 每个请求的输出token上限
+        max_text_tokens (int): 文本块的最大token数；流水线模式下文本块尚未全部生成，用切分的最大长度代替最长文本块
+    返回:
+        dict: 可直接传给 ollama 的 options
+    异常:
+        ValueError: 最长的提示词超出 context_window
+    """
+    count = entries_per_request if batch else 1
+    num_predict = num_predict or NUM_PREDICT_PER_ENTRY * count
+    longest = "" if max_text_tokens else max(texts, key=len, default="")
+    prompt = build_batch_prompt(longest, count) if batch else build_entry_prompt(longest)
+    prompt_tokens = estimate_tokens(prompt) + AVOID_HINT_TOKENS + (max_text_tokens or 0)
+    num_ctx = -(-(prompt_tokens + num_predict) // NUM_CTX_STEP) * NUM_CTX_STEP
+    if context_window and num_ctx > int(context_window):
+        # 上下文窗口不足时优先保证提示词完整，缩减输出上限；输出上限不能超过窗口中提示词之外的部分，否则提示词会被截断
+        num_ctx = int(context_window)
+        remaining = num_ctx - prompt_tokens
+        if remaining <= 0:
+            raise ValueError(f"提示词约 {prompt_tokens} 个token，超出上下文窗口 {num_ctx}，"
+                             f"请减小切分的最大长度或增大上下文窗口")
+        if remaining < NUM_PREDICT_PER_ENTRY * count:
+            logger.warning(f"上下文窗口 {num_ctx} 中提示词约占 {prompt_tokens} 个token，输出上限只剩 {remaining}，"
+                           f"生成的条目可能被截断")
+        num_predict = min(num_predict, remaining)
+    options = dict(DEFAULT_OPTIONS, num_ctx=num_ctx, num_predict=num_predict)
+    for name, value in (('temperature', temperature), ('top_k', top_k), ('top_p', top_p)):
+        if value is not None:
+            options[name] = value
+    return options
+
+def chat_once(prompt: str, model: str = DEFAULT_MODEL, client: ollama.Client = None, format: Dict = None,
+              options: Dict = None, think: bool = DEFAULT_THINK, keep_alive: str = DEFAULT_KEEP_ALIVE):
+    """
+    无状态的单轮对话：使用共享客户端发送一条非流式请求，不保存对话历史；format 为JSON Schema时约束输出结构
+    options 为None时使用 DEFAULT_OPTIONS；think 控制推理模型是否输出思考过程
+    返回:
+        tuple: (模型回复, 请求耗时信息)
+    """
+    client = client or get_client()
+    start = time.monotonic()
+    timing = None
+    LLM_IN_FLIGHT.inc()
+    try:
+        response = client.chat(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            stream=False,
+            format=format,
+            options=ollama.Options(**(options or DEFAULT_OPTIONS)),
+            think=think,
+            keep_alive=keep_alive,
+        )
+        timing = request_timing(response)
+    finally:
+        LLM_IN_FLIGHT.dec()
+        record_request(model, time.monotonic() - start, timing)
+    return response["message"]["content"], timing
+
 # 初始化 ollama
 class OllamaMultiTurn:
-    def __init__(self, model="qwen3:30b-a3b"):
+    def __init__(self, model=DEFAULT_MODEL, client=None):
         self.model = model
+        self.client = client or get_client()
         self.chat_history = []
+        self.last_timing = {}     # 最近一次请求的token数与耗时
 
     def get_models(self):
         """获取Ollama支持的模型列表"""
         try:
-            models = ollama.list()
-            return [model['name'] for model in models['models']]
+            models = self.client.list()
+            return [model['model'] for model in models['models']]
         except Exception as e:
             logger.error(f"获取模型列表时出错: {str(e)}\n请检查本地ollama服务！")
             # 返回默认模型列表
             return []
 
-    def send_message(self, message, temperature=0.7, num_ctx=4096, top_k=50, top_p=0.7):
-        """发送消息并获取响应"""
+    def send_message(self, message, temperature=0.7, num_ctx=4096, top_k=50, top_p=0.7, echo=True,
+                     num_predict=None, think=DEFAULT_THINK, keep_alive=DEFAULT_KEEP_ALIVE):
+        """发送消息并获取响应，echo 为 True 时将流式回复实时输出到控制台"""
         # 添加用户消息到历史记录
         self.chat_history.append({"role": "user", "content": message})
 
         # 调用Ollama API
-        response = ollama.chat(
+        response = self.client.chat(
             model=self.model,
             messages=self.chat_history,
             stream=True,
             options=ollama.Options(
-                temperature=0.7,    # 适度的创造性
-                num_ctx=4096,       # 中等大小的上下文窗口
-                top_k=50,
-                top_p=0.7,
+                temperature=temperature,
+                num_ctx=num_ctx,
+                top_k=top_k,
+                top_p=top_p,
+                num_predict=num_predict,
             ),
+            think=think,
+            keep_alive=keep_alive,
         )
 
         # 处理流式响应
-        full_response = ""
-        for chunk in response:
-            content = chunk["message"]["content"]
-            full_response += content
-            print(f"{content}", end="", flush=True)
-        print("\n" + "-"*50)
+        full_response, self.last_timing = _collect_stream(response, echo)
 
         # 添加模型回复到历史记录
         self.chat_history.append({"role": "assistant", "content": full_response})
@@ -81,9 +304,19 @@ def read_file(file_path: str) -> str:
     with open(file_path, 'r', encoding='utf-8') as file:
         return file.read()
 
-@backoff.on_exception(backoff.expo, Exception, max_tries=3)
-def generate_single_entry(text: str) -> Dict:
-    prompt = f"""
+def avoid_prompt(avoid: List[str] = None) -> str:
+    """要求模型避开已生成问题的提示（重新提示近似重复的文本块时使用）"""
+    if not avoid:
+        return ""
+    questions = "\n".join(f"    - {question}" for question in avoid)
+    return f"""
+    以下问题已经生成过，请不要生成与它们相同或相似的问题：
+{questions}
+"""
+
+def build_entry_prompt(text: str, avoid: List[str] = None) -> str:
+    """根据文本块构建生成单个条目的提示词，avoid 为需要避开的已生成问题"""
+    return f"""
     基于以下文本，生成1个用于指令数据集的高质量条目。条目应该直接关联到给定的文本内容，提出相关的问题或任务。
     请确保生成多样化的指令类型，例如：
     - 分析类："分析..."
@@ -94,7 +327,7 @@ def generate_single_entry(text: str) -> Dict:
 
     文本内容：
     {text}
-
+    {avoid_prompt(avoid)}
     请以下面的格式生成条目，确保所有字段都有适当的内容：
     {{
         "instruction": "使用上述多样化的指令类型之一，提出一个具体的、与文本相关的问题或任务",
@@ -104,107 +337,398 @@ def generate_single_entry(text: str) -> Dict:
     确保所有生成的内容都与给定的文本直接相关，生成的是有效的JSON格式，并且内容高质量、准确、详细。
     """
 
-    # 实例化ollama会话
-    Chat = OllamaMultiTurn()
-    try:
-        response = Chat.send_message(prompt)
-        # 使用ollama
-        logger.info(f"API 响应: {response}")
-        json_match = re.search(r'\{.*\}', response, re.DOTALL)
-        # 使用OpenAI
-        # logger.info(f"API 响应: {response.choices[0].message.content}")
-        # json_match = re.search(r'\{.*\}', response.choices[0].message.content, re.DOTALL)
-        if json_match:
-            entry = json.loads(json_match.group())
-            required_keys = ['instruction', 'input', 'output']
-            if isinstance(entry, dict) and all(key in entry for key in required_keys):
-                # 根据 input 是否为空来设置 text 字段
-                if entry['input'].strip():
-                    entry['text'] = f"Below is an instruction that describes a task, paired with an input that provides further context. Write a response that appropriately completes the request.### Instruction: {entry['instruction']}\n### Input: {entry['input']}\n### Response: {entry['output']}"
-                else:
-                    entry['text'] = f"Below is an instruction that describes a task. Write a response that appropriately completes the request.### Instruction: {entry['instruction']}\n### Input: {entry['input']}\n### Response: {entry['output']}"
-
-                logger.info("成功生成完整条目")
-                return entry
-            else:
-                logger.warning("JSON 解析成功，但缺少必要字段")
-                return {}
-        else:
-            logger.error("无法从API响应中提取有效的JSON")
-            return {}
+def build_entry(entry: Dict) -> Dict:
+    """校验条目字段并补充 text 字段，字段不完整时返回空字典"""
+    if not (isinstance(entry, dict) and all(key in entry for key in REQUIRED_KEYS)):
+        logger.warning("JSON 解析成功，但缺少必要字段")
+        return {}
+    # 根据 input 是否为空来设置 text 字段
+    if entry['input'].strip():
+        entry['text'] = f"Below is an instruction that describes a task, paired with an input that provides further context. Write a response that appropriately completes the request.### Instruction: {entry['instruction']}\n### Input: {entry['input']}\n### Response: {entry['output']}"
+    else:
+        entry['text'] = f"Below is an instruction that describes a task. Write a response that appropriately completes the request.### Instruction: {entry['instruction']}\n### Input: {entry['input']}\n### Response: {entry['output']}"
+    return entry
 
-    except Exception as e:
-        logger.error(f"生成条目时发生错误: {str(e)}")
+def parse_entry_response(response: str, model: str = DEFAULT_MODEL) -> Dict:
+    """从模型回复中提取条目，失败时返回空字典（解析结果计入该模型的解析失败率）"""
+    # 使用OpenAI
+    # logger.info(f"API 响应: {response.choices[0].message.content}")
+    entries = ReplyParser.extract_entries(response, REQUIRED_KEYS, model)
+    if not entries:
         return {}
+    logger.info("成功生成完整条目")
+    return build_entry(entries[0])
+
+@backoff.on_exception(backoff.expo, Exception, max_tries=3, on_backoff=_count_backoff, on_giveup=_log_giveup,
+                      raise_on_giveup=False)
+def generate_single_entry(text: str, avoid: List[str] = None, model: str = DEFAULT_MODEL, options: Dict = None) -> Dict:
+    """
+    生成一个条目：请求出错（连接失败、服务端错误等）时由 backoff 指数退避重试，重试用尽后返回None；
+    回复无法解析为完整条目时不重试，返回空字典
+    """
+    prompt = build_entry_prompt(text, avoid)
+
+    # 使用共享客户端发送无状态请求，无需为每个条目创建会话
+    response, timing = chat_once(prompt, model, options=options)
+    # 使用ollama
+    log_response(response)
+    logger.debug(f"请求耗时: {timing}")
+    return parse_entry_response(response, model)
+
+def build_batch_prompt(text: str, count: int, avoid: List[str] = None) -> str:
+    """根据文本块构建一次生成多个条目的提示词，avoid 为需要避开的已生成问题"""
+    return f"""
+    基于以下文本，生成{count}个用于指令数据集的高质量条目。条目应该直接关联到给定的文本内容，提出相关的问题或任务。
+    请确保各条目之间互不重复，并尽量使用不同的指令类型，例如：
+    - 分析类："分析..."
+    - 比较类："比较..."
+    - 解释类："解释..."
+    - 评价类："评价..."
+    - 问答类："为什么..."
 
-def process_file(file_path: str, entries_per_file: int, progress_callback=None) -> List[Dict]:
+    文本内容：
+    {text}
+    {avoid_prompt(avoid)}
+    请以下面的JSON格式输出，entries 数组中恰好包含{count}个条目，确保所有字段都有适当的内容：
+    {{
+        "entries": [
+            {{
+                "instruction": "使用上述多样化的指令类型之一，提出一个具体的、与文本相关的问题或任务",
+                "input": "如果需要额外的上下文信息，请在这里提供，否则留空",
+                "output": "对instruction的详细回答或任务的完成结果"
+            }}
+        ]
+    }}
+    确保所有生成的内容都与给定的文本直接相关，生成的是有效的JSON格式，并且内容高质量、准确、详细。
+    """
+
+def entries_schema(count: int) -> Dict:
+    """批量生成时传给Ollama format 参数的JSON Schema"""
+    return {
+        "type": "object",
+        "properties": {
+            "entries": {
+                "type": "array",
+                "minItems": count,
+                "maxItems": count,
+                "items": {
+                    "type": "object",
+                    "properties": {key: {"type": "string"} for key in REQUIRED_KEYS},
+                    "required": REQUIRED_KEYS,
+                },
+            },
+        },
+        "required": ["entries"],
+    }
+
+def parse_batch_response(response: str, model: str = DEFAULT_MODEL) -> List[Dict]:
+    """从批量生成的回复中提取条目，只保留字段完整的条目（解析结果计入该模型的解析失败率）"""
+    return [build_entry(entry) for entry in ReplyParser.extract_entries(response, REQUIRED_KEYS, model)]
+
+def generate_entries_batch(text: str, count: int, model: str = DEFAULT_MODEL, max_rounds: int = 3,
+                           avoid: List[str] = None, options: Dict = None) -> List[Dict]:
+    """
+    一次请求生成多个条目，文本块只需预填充一次
+    保留格式正确的条目，缺少的数量在后续轮次中补充请求，最多请求 max_rounds 轮
+    """
+    entries = []
+    for round_index in range(max_rounds):
+        missing = count - len(entries)
+        if missing <= 0:
+            break
+        if round_index > 0:
+            RETRIES.inc(source='generate_entries_batch')
+        try:
+            response, timing = chat_once(build_batch_prompt(text, missing, avoid), model, format=entries_schema(missing),
+                                         options=options)
+            log_response(response)
+            logger.debug(f"请求耗时: {timing}")
+        except Exception as e:
+            logger.error(f"批量生成条目时发生错误: {str(e)}")
+            continue
+        entries.extend(parse_batch_response(response, model)[:missing])
+    return entries
+
+def record_entry(entry: Dict, journal=None, key: str = None, index: int = 0, sink=None):
+    """将新生成的条目写入任务日志和流式输出（均为可选）"""
+    if journal is not None:
+        journal.record_entry(key, index, entry)
+    if sink is not None:
+        sink.write(entry)
+
+def process_text(text: str, entries_per_file: int, progress_callback=None, batch: bool = False,
+                 journal=None, key: str = None, sink=None, dedup=None, model: str = DEFAULT_MODEL,
+                 options: Dict = None) -> List[Dict]:
+    """
+    为一个文本块生成条目，model 与 options 为请求使用的模型和Ollama参数
+    指定任务日志 journal 及文本块哈希 key 时，跳过日志中已完成的条目序号，每生成一个条目立即写入日志；
+    指定 sink 时每个条目生成后立即写入 sink；
+    指定近似去重过滤器 dedup（Dedup.NearDuplicateFilter）时，丢弃与已有条目近似重复的条目并携带已有问题重新提示，
+    文本块的重复次数达到上限后提前停止
+    """
     dataset = []
+    indices = journal.missing_indices(key, entries_per_file) if journal is not None else list(range(entries_per_file))
+    # 已完成的条目直接计入进度
+    Public.now_tasks += entries_per_file - len(indices)
+    if not indices:
+        return dataset
+
+    if batch:
+        # 批量模式：一次请求生成本文本块的全部（缺少的）条目
+        dataset = generate_entries_batch(text, len(indices), model, options=options)
+        if dedup is not None:
+            dataset = dedup.filter(dataset, key)
+            retries = 0
+            while len(dataset) < len(indices) and retries < dedup.max_retries and not dedup.exhausted(key):
+                retries += 1
+                missing = len(indices) - len(dataset)
+                dataset += dedup.filter(generate_entries_batch(text, missing, model, avoid=dedup.hints(key),
+                                                               options=options), key)
+        for index, entry in zip(indices, dataset):
+            record_entry(entry, journal, key, index, sink)
+        logger.info(f"  成功生成 {len(dataset)}/{len(indices)} 个完整条目")
+        Public.now_tasks += len(indices)
+        if progress_callback:
+            progress_callback(Public.now_tasks, Public.all_tasks, "AI")
+        return dataset
+    for position, j in enumerate(indices):
+        if dedup is not None and dedup.exhausted(key):
+            logger.warning(f"  文本块生成的条目重复过多，跳过剩余的 {len(indices) - position} 个条目")
+            Public.now_tasks += len(indices) - position
+            break
+        logger.info(f"  生成第 {j + 1}/{entries_per_file} 个条目")
+        # 报告进度
+        if progress_callback:
+            progress_callback(Public.now_tasks, Public.all_tasks, "AI")
+        entry = generate_single_entry(text, model=model, options=options) or {}
+        retries = 0
+        while entry and dedup is not None and not dedup.check(entry, key):
+            if retries >= dedup.max_retries or dedup.exhausted(key):
+                logger.warning(f"  条目与已有条目近似重复，已丢弃")
+                entry = {}
+                break
+            retries += 1
+            entry = generate_single_entry(text, dedup.hints(key), model, options) or {}
+        if entry and all(key_name in entry for key_name in ['instruction', 'input', 'output', 'text']):
+            dataset.append(entry)
+            record_entry(entry, journal, key, j, sink)
+            logger.info(f"  成功生成 1 个完整条目")
+        else:
+            logger.warning(f"  跳过不完整的条目")
+        Public.now_tasks += 1
+        time.sleep(1)  # 在请求之间增加延迟到2秒
+    return dataset
 
+def process_file(file_path: str, entries_per_file: int, progress_callback=None, batch: bool = False) -> List[Dict]:
     try:
-        text = read_file(file_path)
-        for j in range(entries_per_file):
-            logger.info(f"  生成第 {j + 1}/{entries_per_file} 个条目")
-            # 报告进度
-            if progress_callback:
-                progress_callback(Public.now_tasks, Public.all_tasks * entries_per_file, "AI")
-            entry = generate_single_entry(text)
-            if entry and all(key in entry for key in ['instruction', 'input', 'output', 'text']):
-                dataset.append(entry)
-                logger.info(f"  成功生成 1 个完整条目")
-            else:
-                logger.warning(f"  跳过不完整的条目")
-            Public.now_tasks += 1
-            time.sleep(1)  # 在请求之间增加延迟到2秒
+        return process_text(read_file(file_path), entries_per_file, progress_callback, batch)
     except Exception as e:
         logger.error(f"处理文件 {file_path} 时发生未知异常: {str(e)}")
-    return dataset
+        return []
 
-def generate_dataset(folder_path: str, entries_per_file: int = 2, progress_callback=None) -> List[Dict]:
-    dataset = []
+def collect_chunk_files(folder_path: str) -> List[str]:
+    """收集文件夹（含子文件夹）中的全部文本块文件"""
     all_files = []
     for root, dirs, files in os.walk(folder_path):
         # 获取当前文件夹中的所有文件
         for file in files:
             file_path = os.path.join(root, file)
             all_files.append(file_path)
-    files = [filename for filename in all_files if filename.endswith(".txt")]
-    Public.all_tasks = len(files)
-    with ThreadPoolExecutor(max_workers=4) as executor:  # 调整 max_workers 数量以适应你的硬件资源
-        futures = [executor.submit(process_file, file_path, entries_per_file, progress_callback) for file_path in files]
-        for future in as_completed(futures):
-            try:
-                dataset.extend(future.result())
-            except Exception as e:
-                logger.error(f"处理未来任务时发生未知异常: {str(e)}")
-    Public.all_tasks = 0
-    Public.now_tasks = 0
-    return dataset
+    return [filename for filename in all_files if filename.endswith(".txt")]
 
-def save_dataset_as_parquet(dataset: List[Dict], output_file: str):
-    schema = pa.schema([
-        ('instruction', pa.string()),
-        ('input', pa.string()),
-        ('output', pa.string()),
-        ('text', pa.string())
-    ])
-
-    arrays = [
-        pa.array([entry['instruction'] for entry in dataset]),
-        pa.array([entry['input'] for entry in dataset]),
-        pa.array([entry['output'] for entry in dataset]),
-        pa.array([entry['text'] for entry in dataset])
-    ]
-    '''
-    # 添加元数据信息
-    metadata = {
-        'dataset_description': 'Instruction dataset generated by AI',
-        'creation_date': time.strftime('%Y-%m-%d %H:%M:%S'),
-        'num_entries': str(len(dataset)),
-        'generator_version': '1.0'
-    }
-    '''
-    table = pa.Table.from_arrays(arrays=arrays, schema=schema)
-    pq.write_table(table, output_file)
+def read_chunk_texts(folder_path: str) -> List[str]:
+    """读取文件夹中的全部文本块"""
+    texts = []
+    for file_path in collect_chunk_files(folder_path):
+        try:
+            texts.append(read_file(file_path))
+        except Exception as e:
+            logger.error(f"处理文件 {file_path} 时发生未知异常: {str(e)}")
+    return texts
+
+def generate_dataset_from_texts(texts: List[str], entries_per_file: int = 2, progress_callback=None, engine: str = "thread",
+                                max_in_flight: int = 16, model_limits: Dict[str, int] = None, batch: bool = False,
+                                journal=None, sink=None, dedup=None, entry_counts: List[int] = None,
+                                model: str = DEFAULT_MODEL, options: Dict = None) -> List[Dict]:
+    """
+    为每个文本块生成训练条目
+    engine 为 "thread" 时使用线程池逐条生成；为 "async" 时使用 GenerationEngine 的异步高并发引擎，
+    max_in_flight 和 model_limits 分别为其全局与按模型的在途请求上限；
+    batch 为 True 时每个文本块只发送一次请求，以JSON数组的形式生成全部条目；
+    指定任务日志 journal（JobJournal）时，已完成的条目不再重复生成，返回值包含日志中的全部已完成条目；
+    指定 sink（ParquetSink）时条目边生成边写入 sink，内存中不再累积条目，返回空列表；
+    指定 dedup（Dedup.NearDuplicateFilter）时在生成过程中在线去重，去重统计见 dedup.report()；
+    指定 entry_counts 时按其中与文本块一一对应的条目数生成，代替统一的 entries_per_file；
+    model 为生成使用的模型，options 为Ollama请求参数，为None时由 generation_options 按本任务的文本块计算
+    """
+    keys = journal.add_chunks(texts, entry_counts) if journal is not None else [chunk_hash(text) for text in texts]
+    counts = entry_counts if entry_counts is not None else [entries_per_file] * len(texts)
+    if options is None:
+        options = generation_options(texts, max(counts, default=1), batch)
+    replay_journal(journal, sink, dedup)
+    if engine == "async":
+        import GenerationEngine
+        dataset = GenerationEngine.generate_texts_async(texts, entries_per_file, progress_callback,
+                                                        max_in_flight=max_in_flight, model_limits=model_limits,
+                                                        batch=batch, journal=journal, keys=keys, sink=sink,
+                                                        dedup=dedup, counts=counts, model=model, options=options)
+    else:
+        dataset = []
+        Public.all_tasks = sum(counts)
+        with ThreadPoolExecutor(max_workers=4) as executor:  # 调整 max_workers 数量以适应你的硬件资源
+            futures = [executor.submit(process_text, text, count, progress_callback, batch, journal, key, sink, dedup,
+                                       model, options)
+                       for text, key, count in zip(texts, keys, counts)]
+            for future in as_completed(futures):
+                try:
+                    entries = future.result()
+                    if sink is None:
+                        dataset.extend(entries)
+                except Exception as e:
+                    logger.error(f"处理未来任务时发生未知异常: {str(e)}")
+        Public.all_tasks = 0
+        Public.now_tasks = 0
+    if sink is not None:
+        return []
+    return list(journal.entries()) if journal is not None else dataset
+
+def replay_journal(journal=None, sink=None, dedup=None):
+    """恢复任务时先把日志中已完成的条目写入 sink，并登记到去重过滤器"""
+    if journal is not None and (sink is not None or dedup is not None):
+        for entry in journal.entries():
+            if dedup is not None:
+                dedup.add(entry)
+            if sink is not None:
+                sink.write(entry)
+
+def generate_dataset_from_stream(chunk_queue, progress_callback=None, max_in_flight: int = 16,
+                                 model_limits: Dict[str, int] = None, batch: bool = False, journal=None, sink=None,
+                                 dedup=None, model: str = DEFAULT_MODEL, options: Dict = None, stop=None) -> List[Dict]:
+    """
+    流水线模式：为线程队列 chunk_queue 中陆续到达的 (文本块, 哈希, 条目数) 生成训练条目，队列中放入 None 表示结束；
+    stop (threading.Event) 与上游共享，任一方失败时设置，另一方随即停止
+    生成与上游的切分同时进行，使用 GenerationEngine 的异步引擎；文本块由上游登记到任务日志，其余参数含义见 generate_dataset_from_texts
+    """
+    import GenerationEngine
+    replay_journal(journal, sink, dedup)
+    dataset = GenerationEngine.generate_stream_async(chunk_queue, progress_callback, max_in_flight=max_in_flight,
+                                                     model_limits=model_limits, model=model, batch=batch,
+                                                     journal=journal, sink=sink, dedup=dedup,
+                                                     options=options or DEFAULT_OPTIONS, stop=stop)
+    if sink is not None:
+        return []
+    return list(journal.entries()) if journal is not None else dataset
+
+def generate_dataset(folder_path: str, entries_per_file: int = 2, progress_callback=None, engine: str = "thread",
+                     max_in_flight: int = 16, model_limits: Dict[str, int] = None, batch: bool = False,
+                     journal=None, sink=None, dedup=None, model: str = DEFAULT_MODEL, options: Dict = None) -> List[Dict]:
+    """为文件夹中的每个文本块生成训练条目，参数含义见 generate_dataset_from_texts"""
+    return generate_dataset_from_texts(read_chunk_texts(folder_path), entries_per_file, progress_callback, engine,
+                                       max_in_flight, model_limits, batch, journal, sink, dedup, model=model,
+                                       options=options)
+
+# 训练条目的Parquet表结构
+DATASET_SCHEMA = pa.schema([
+    ('instruction', pa.string()),
+    ('input', pa.string()),
+    ('output', pa.string()),
+    ('text', pa.string())
+])
+
+class ParquetSink:
+    """
+    流式写入Parquet文件
+    条目先按列缓存在内存中，每满 row_group_size 条或距上次写出超过 flush_interval 秒时写出一个行组，
+    内存占用与条目总数无关；先写入临时文件，关闭时写入数据集元数据并替换为目标文件
+    """
+
+    def __init__(self, output_file: str, row_group_size: int = 1000, flush_interval: float = 30.0,
+                 compression: str = 'zstd', use_dictionary: bool = True, metadata: Dict[str, str] = None):
+        """
+        参数:
+            output_file (str): 输出文件路径
+            row_group_size (int): 每个行组的条目数
+            flush_interval (float): 两次写出之间的最长间隔（秒）
+            compression (str): 压缩算法，如 zstd、snappy、gzip 或 none
+            use_dictionary (bool): 是否启用字典编码
+            metadata (dict): 写入文件尾部的额外元数据
+        """
+        self.output_file = output_file
+        self.row_group_size = row_group_size
+        self.flush_interval = flush_interval
+        self.num_rows = 0
+        self._tmp_file = output_file + '.tmp'
+        self._columns = {name: [] for name in DATASET_SCHEMA.names}
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._metadata = {
+            'dataset_description': 'Instruction dataset generated by AI',
+            'creation_date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'generator_version': '1.0',
+            **(metadata or {}),
+        }
+        os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+        self._writer = pq.ParquetWriter(self._tmp_file, DATASET_SCHEMA, compression=compression,
+                                        use_dictionary=use_dictionary)
+
+    def write(self, entry: Dict):
+        """写入一个条目"""
+        with self._lock:
+            for name, column in self._columns.items():
+                column.append(entry[name])
+            self._buffered += 1
+            if self._buffered >= self.row_group_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def write_many(self, entries):
+        """写入多个条目"""
+        for entry in entries:
+            self.write(entry)
+
+    def _flush(self):
+        if self._buffered:
+            table = pa.Table.from_pydict(self._columns, schema=DATASET_SCHEMA)
+            self._writer.write_table(table, row_group_size=self._buffered)
+            self.num_rows += self._buffered
+            self._columns = {name: [] for name in DATASET_SCHEMA.names}
+            self._buffered = 0
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        """立即写出缓存中的条目"""
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """写出剩余条目和元数据，并替换为目标文件"""
+        with self._lock:
+            self._flush()
+            self._writer.add_key_value_metadata({**self._metadata, 'num_entries': str(self.num_rows)})
+            self._writer.close()
+            os.replace(self._tmp_file, self.output_file)
+
+    def abort(self):
+        """放弃写入：关闭并删除临时文件，保留原有的目标文件"""
+        with self._lock:
+            self._writer.close()
+            if os.path.exists(self._tmp_file):
+                os.remove(self._tmp_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def save_dataset_as_parquet(dataset: List[Dict], output_file: str, compression: str = 'zstd',
+                            row_group_size: int = 1000):
+    """将条目列表（或任意条目迭代器）按行组流式写入Parquet文件"""
+    with ParquetSink(output_file, row_group_size=row_group_size, compression=compression) as sink:
+        sink.write_many(dataset)
 
 def get_ollama_models():
     """获取Ollama模型列表的便捷函数"""
@@ -216,7 +740,12 @@ if __name__ == "__main__":
     output_file = "mnt/instruction_dataset.parquet"
 
     logger.info("开始生成数据集")
-    dataset = generate_dataset(input_folder, entries_per_file=5)
-    save_dataset_as_parquet(dataset, output_file)
+    # 写入Parquet之前在线去重，近似重复的条目不会进入数据集
+    dedup = NearDuplicateFilter()
+    with ParquetSink(output_file) as sink:
+        generate_dataset(input_folder, entries_per_file=5, sink=sink, dedup=dedup)
+    report = dedup.report()
     logger.info(f"数据集已生成并保存到 {output_file}")
-    logger.info(f"共生成 {len(dataset)} 个有效条目")
+    logger.info(f"共生成 {sink.num_rows} 个有效条目，丢弃 {report['duplicates']} 个近似重复条目（重复率 {report['rate']:.1%}）")
+    for model, rate in ReplyParser.parse_stats.failure_rates().items():
+        logger.info(f"模型 {model} 的回复解析失败率: {rate:.1%}")
@@ -0,0 +1,267 @@
+# 数据集导出：读取一次生成的Parquet文件，在同一遍遍历中写出多种格式
+import json
+import math
+import os
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import Metrics
+
+# Alpaca格式条目包含的字段
+ALPACA_COLUMNS = ['instruction', 'input', 'output']
+# 支持的导出格式
+EXPORT_FORMATS = ('alpaca', 'jsonl', 'sharegpt')
+# 支持的压缩算法及对应的文件后缀
+COMPRESSION_SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+# 导出阶段的指标
+EXPORT_SECONDS = Metrics.histogram('tdf_export_seconds', '导出一个数据集（全部格式与划分）的耗时（秒）')
+EXPORT_ROWS = Metrics.counter('tdf_export_rows_total', '写出的数据集行数', ('format',))
+
+
+def split_indices(num_rows, test_size=0.2, seed=42):
+    """
+    基于固定随机种子的行号置换划分训练集和测试集，相同种子得到相同的划分
+    参数:
+        num_rows (int): 数据集行数
+        test_size (float): 测试集比例
+        seed (int): 随机种子
+    返回:
+        tuple: (训练集行号, 测试集行号)，均为打乱后的顺序
+    """
+    permutation = np.random.default_rng(seed).permutation(num_rows)
+    num_test = int(math.ceil(num_rows * test_size))
+    return permutation[num_test:], permutation[:num_test]
+
+
+def iter_batches(table, indices=None, batch_size=10000, columns=ALPACA_COLUMNS):
+    """
+    按行号分批从Arrow表中取出行，每次只把一批行转换为Python对象
+    参数:
+        table (pyarrow.Table): 数据表
+        indices (numpy.ndarray): 行号，为None时按原顺序遍历全部行
+        batch_size (int): 每批的行数
+        columns (list): 输出的字段
+    返回:
+        generator: 每次产出一批行（字典列表）
+    """
+    total = table.num_rows if indices is None else len(indices)
+    for start in range(0, total, batch_size):
+        if indices is None:
+            batch = table.slice(start, batch_size)
+        else:
+            batch = table.take(indices[start:start + batch_size])
+        values = [batch.column(name).to_pylist() for name in columns]
+        yield [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def iter_rows(table, indices=None, batch_size=10000, columns=ALPACA_COLUMNS):
+    """按行号分批从Arrow表中取出行并逐行产出"""
+    for rows in iter_batches(table, indices, batch_size, columns):
+        yield from rows
+
+
+class _OutputStream:
+    """以UTF-8写文本的输出流，可选gzip/zstd压缩"""
+
+    def __init__(self, file_path, compression=None):
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"不支持的压缩算法: {compression}")
+        self._stream = pa.CompressedOutputStream(file_path, compression) if compression else open(file_path, 'wb')
+
+    def write(self, text):
+        self._stream.write(text.encode('utf-8'))
+
+    def close(self):
+        self._stream.close()
+
+
+class JsonArrayWriter:
+    """流式写出JSON数组，格式与 json.dump(list, indent=indent) 相同，但不需要在内存中保存整个列表"""
+
+    def __init__(self, file_path, compression=None, indent=4, ensure_ascii=True):
+        self.count = 0
+        self.indent = indent
+        self.ensure_ascii = ensure_ascii
+        self._stream = _OutputStream(file_path, compression)
+
+    def convert(self, row):
+        return row
+
+    def write(self, rows):
+        for row in rows:
+            text = json.dumps(self.convert(row), indent=self.indent, ensure_ascii=self.ensure_ascii)
+            self._stream.write("[\n" if self.count == 0 else ",\n")
+            self._stream.write("\n".join(" " * self.indent + line for line in text.split("\n")))
+            self.count += 1
+
+    def close(self):
+        self._stream.write("\n]" if self.count else "[]")
+        self._stream.close()
+
+
+class JsonLinesWriter(JsonArrayWriter):
+    """流式写出JSONL文件，每行一个条目"""
+
+    def __init__(self, file_path, compression=None, ensure_ascii=False):
+        super().__init__(file_path, compression, indent=None, ensure_ascii=ensure_ascii)
+
+    def write(self, rows):
+        for row in rows:
+            self._stream.write(json.dumps(self.convert(row), ensure_ascii=self.ensure_ascii) + "\n")
+            self.count += 1
+
+    def close(self):
+        self._stream.close()
+
+
+class ShareGPTWriter(JsonArrayWriter):
+    """流式写出ShareGPT格式（多轮对话）的JSON数组"""
+
+    def __init__(self, file_path, compression=None, indent=4, ensure_ascii=False):
+        super().__init__(file_path, compression, indent=indent, ensure_ascii=ensure_ascii)
+
+    def convert(self, row):
+        question = row['instruction'] if not row['input'] else f"{row['instruction']}\n{row['input']}"
+        return {
+            "conversations": [
+                {"from": "human", "value": question},
+                {"from": "gpt", "value": row['output']},
+            ]
+        }
+
+
+def write_json_array(rows, file_path, indent=4, ensure_ascii=True):
+    """
+    流式写出JSON数组文件
+    返回:
+        int: 写出的行数
+    """
+    writer = JsonArrayWriter(file_path, indent=indent, ensure_ascii=ensure_ascii)
+    writer.write(rows)
+    writer.close()
+    return writer.count
+
+
+def write_jsonl(rows, file_path, ensure_ascii=False):
+    """
+    流式写出JSONL文件
+    返回:
+        int: 写出的行数
+    """
+    writer = JsonLinesWriter(file_path, ensure_ascii=ensure_ascii)
+    writer.write(rows)
+    writer.close()
+    return writer.count
+
+
+def output_file_name(export_format, split, compression=None):
+    """
+    导出文件名，例如 alpaca_train_dataset.json、alpaca_dataset.jsonl、sharegpt_test_dataset.json.gz
+    """
+    prefix = 'sharegpt' if export_format == 'sharegpt' else 'alpaca'
+    extension = 'jsonl' if export_format == 'jsonl' else 'json'
+    split_part = '' if split == 'all' else f'_{split}'
+    return f"{prefix}{split_part}_dataset.{extension}{COMPRESSION_SUFFIXES[compression]}"
+
+
+def dataset_info_entry(export_format, file_name):
+    """LlamaFactory dataset_info.json 中对应导出文件的配置"""
+    if export_format == 'sharegpt':
+        return {
+            "file_name": file_name,
+            "formatting": "sharegpt",
+            "columns": {"messages": "conversations"},
+            "tags": {"role_tag": "from", "content_tag": "value", "user_tag": "human", "assistant_tag": "gpt"},
+        }
+    return {
+        "file_name": file_name,
+        "columns": {"prompt": "instruction", "query": "input", "response": "output"},
+    }
+
+
+def update_dataset_info(output_dir, entries):
+    """将导出文件登记到输出目录的 dataset_info.json（保留其中已有的其他数据集）"""
+    info_path = os.path.join(output_dir, 'dataset_info.json')
+    info = {}
+    if os.path.exists(info_path):
+        with open(info_path, 'r', encoding='utf-8') as file:
+            info = json.load(file)
+    info.update(entries)
+    with open(info_path, 'w', encoding='utf-8') as file:
+        json.dump(info, file, indent=4, ensure_ascii=False)
+    return info_path
+
+
+_WRITERS = {
+    'alpaca': JsonArrayWriter,
+    'jsonl': JsonLinesWriter,
+    'sharegpt': ShareGPTWriter,
+}
+
+
+def export_dataset(parquet_file_path='./mnt/instruction_dataset.parquet', output_dir='./generated_data',
+                   formats=('alpaca',), splits=('train', 'test'), test_size=0.2, seed=42, compression=None,
+                   batch_size=10000, dataset_name='tdf_instruction', write_dataset_info=True):
+    """
+    读取一次Parquet数据集，在同一遍遍历中写出全部格式和划分
+    参数:
+        parquet_file_path (str): 输入的Parquet文件
+        output_dir (str): 输出目录
+        formats (tuple): 导出格式，可选 alpaca（JSON数组）、jsonl、sharegpt
+        splits (tuple): 导出的划分，可选 train、test、all（全部数据；只导出 all 时按原顺序写出，否则与训练集、测试集同序）
+        test_size (float): 测试集比例
+        seed (int): 随机种子，相同种子得到相同的划分
+        compression (str): 输出压缩算法，可选 None、gzip、zstd
+        batch_size (int): 每批转换的行数
+        dataset_name (str): 登记到 dataset_info.json 的数据集名前缀
+        write_dataset_info (bool): 是否更新输出目录中的 LlamaFactory dataset_info.json（只登记未压缩的文件）
+    返回:
+        dict: (格式, 划分) -> 导出文件名
+    """
+    for export_format in formats:
+        if export_format not in _WRITERS:
+            raise ValueError(f"不支持的导出格式: {export_format}")
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+
+    # 加载本地Parquet数据集（内存映射，只读取需要的字段）
+    table = pq.read_table(parquet_file_path, columns=ALPACA_COLUMNS, memory_map=True)
+    train_indices, test_indices = split_indices(table.num_rows, test_size, seed)
+
+    files = {}
+    writers = {}
+    for export_format in formats:
+        for split in splits:
+            file_name = output_file_name(export_format, split, compression)
+            files[(export_format, split)] = file_name
+            writers[(export_format, split)] = _WRITERS[export_format](os.path.join(output_dir, file_name), compression)
+
+    if set(splits) == {'all'}:
+        # 只导出全部数据时不需要划分，按原顺序遍历一次
+        passes = (('all', None),)
+    else:
+        passes = (('train', train_indices), ('test', test_indices))
+    try:
+        # 训练集与测试集各遍历一次，每批行同时写入该划分和 all 的全部格式
+        for split, indices in passes:
+            targets = [writer for (_, target_split), writer in writers.items() if target_split in (split, 'all')]
+            if not targets:
+                continue
+            for rows in iter_batches(table, indices, batch_size):
+                for writer in targets:
+                    writer.write(rows)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    for (export_format, _), writer in writers.items():
+        EXPORT_ROWS.inc(writer.count, format=export_format)
+    EXPORT_SECONDS.observe(time.perf_counter() - start)
+
+    if write_dataset_info and compression is None:
+        update_dataset_info(output_dir, {
+            f"{dataset_name}_{export_format}_{split}": dataset_info_entry(export_format, file_name)
+            for (export_format, split), file_name in files.items()
+        })
+    return files
@@ -0,0 +1,416 @@
+# 近似去重：生成条目基于字符n-gram的MinHash签名与LSH分桶，文本块基于BERT嵌入的向量索引
+import logging
+import re
+import threading
+import zlib
+from typing import List, Dict, Iterable
+
+import numpy as np
+
+# MinHash使用的梅森素数 2^61-1 与32位哈希上限
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# 归一化时去掉的空白与标点（中文汉字属于 \w，会被保留）
+_NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+
+logger = logging.getLogger(__name__)
+
+
+def char_ngrams(text: str, n: int = 2) -> set:
+    """
+    提取文本的字符n-gram集合，先去掉空白与标点并转为小写；中文没有空格分词，按字符切分更稳定
+    参数:
+        text (str): 文本
+        n (int): n-gram长度
+    返回:
+        set: n-gram集合，文本短于n时返回整个文本
+    """
+    text = _NON_WORD.sub('', text.lower())
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class MinHasher:
+    """使用 num_perm 个随机线性哈希 (a*x+b) mod p 计算集合的MinHash签名"""
+
+    def __init__(self, num_perm: int = 128, ngram: int = 2, seed: int = 1):
+        """
+        参数:
+            num_perm (int): 签名长度（哈希函数个数），越大Jaccard估计越准确
+            ngram (int): 字符n-gram长度
+            seed (int): 随机种子，同一任务中的签名必须使用相同的种子计算
+        """
+        self.num_perm = num_perm
+        self.ngram = ngram
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        计算文本的MinHash签名
+        返回:
+            numpy.ndarray: 长度为 num_perm 的 uint64 数组；空文本返回全为最大值的签名
+        """
+        shingles = char_ngrams(text, self.ngram)
+        if not shingles:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+        # uint64 乘法溢出时按 2^64 回绕，对哈希的均匀性没有影响
+        with np.errstate(over='ignore'):
+            values = (self.a[:, None] * hashes[None, :] + self.b[:, None]) % _MERSENNE_PRIME
+        return (values & _MAX_HASH).min(axis=1)
+
+
+def estimate_jaccard(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    """由两个MinHash签名估计Jaccard相似度"""
+    return float(np.count_nonzero(sig_a == sig_b)) / len(sig_a)
+
+
+def lsh_bands(threshold: float, num_perm: int):
+    """
+    选择LSH的分段数 b 与每段行数 r（b*r <= num_perm），使候选阈值 (1/b)^(1/r) 最接近目标阈值
+    返回:
+        tuple: (b, r)
+    """
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class MinHashLSH:
+    """MinHash签名的LSH索引：签名按段分桶，任一段完全相同即为候选，再用完整签名校验相似度"""
+
+    def __init__(self, threshold: float = 0.7, num_perm: int = 128):
+        self.threshold = threshold
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures = []
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def query(self, signature: np.ndarray) -> List[int]:
+        """
+        返回与签名估计相似度不低于阈值的已登记条目编号
+        """
+        candidates = set()
+        for band, key in self._band_keys(signature):
+            candidates.update(self._buckets[band].get(key, ()))
+        return [item for item in sorted(candidates)
+                if estimate_jaccard(signature, self._signatures[item]) >= self.threshold]
+
+    def insert(self, signature: np.ndarray) -> int:
+        """登记签名，返回条目编号"""
+        item = len(self._signatures)
+        self._signatures.append(signature)
+        for band, key in self._band_keys(signature):
+            self._buckets[band].setdefault(key, []).append(item)
+        return item
+
+
+def entry_text(entry: Dict, fields=('instruction', 'input')) -> str:
+    """参与去重比较的条目文本"""
+    return "\n".join(entry.get(field) or '' for field in fields)
+
+
+class NearDuplicateFilter:
+    """
+    生成条目的在线近似去重
+    每个新条目先与已接受的全部条目比较，近似重复时拒绝；按文本块统计重复率，
+    某个文本块累计重复次数达到 max_collisions 后视为已"耗尽"，生成引擎据此提前停止该文本块，
+    未耗尽时可携带已接受的问题重新提示模型（最多 max_retries 次）
+    """
+
+    def __init__(self, threshold: float = 0.7, num_perm: int = 128, ngram: int = 2, max_retries: int = 2,
+                 max_collisions: int = 5, fields=('instruction', 'input')):
+        """
+        参数:
+            threshold (float): 估计Jaccard相似度不低于该值视为近似重复
+            num_perm (int): MinHash签名长度
+            ngram (int): 字符n-gram长度
+            max_retries (int): 单个条目与已有条目重复时重新生成的最大次数
+            max_collisions (int): 单个文本块累计重复达到该次数后不再为其生成条目
+            fields (tuple): 参与比较的条目字段
+        """
+        self.hasher = MinHasher(num_perm, ngram)
+        self.index = MinHashLSH(threshold, num_perm)
+        self.max_retries = max_retries
+        self.max_collisions = max_collisions
+        self.fields = fields
+        self.chunk_stats = {}       # 文本块哈希 -> [检查的条目数, 重复条目数]
+        self._instructions = {}     # 文本块哈希 -> 已接受的问题，用于重新提示
+        self._lock = threading.Lock()
+
+    def add(self, entry: Dict, key: str = None):
+        """登记一个已接受的条目（例如恢复任务时日志中已完成的条目），不计入重复率统计"""
+        signature = self.hasher.signature(entry_text(entry, self.fields))
+        with self._lock:
+            self.index.insert(signature)
+            if key is not None:
+                self._instructions.setdefault(key, []).append(entry.get('instruction', ''))
+
+    def check(self, entry: Dict, key: str = None) -> bool:
+        """
+        检查条目是否与已接受的条目近似重复，不重复时登记该条目
+        参数:
+            entry (dict): 新生成的条目
+            key (str): 条目所属文本块的哈希，用于按文本块统计重复率
+        返回:
+            bool: 条目不重复（已接受）时为True
+        """
+        signature = self.hasher.signature(entry_text(entry, self.fields))
+        with self._lock:
+            stats = self.chunk_stats.setdefault(key, [0, 0])
+            stats[0] += 1
+            if self.index.query(signature):
+                stats[1] += 1
+                return False
+            self.index.insert(signature)
+            self._instructions.setdefault(key, []).append(entry.get('instruction', ''))
+            return True
+
+    def filter(self, entries: Iterable[Dict], key: str = None) -> List[Dict]:
+        """返回不重复的条目，重复条目直接丢弃"""
+        return [entry for entry in entries if self.check(entry, key)]
+
+    def exhausted(self, key: str) -> bool:
+        """文本块的重复次数是否已达到上限"""
+        with self._lock:
+            return self.chunk_stats.get(key, [0, 0])[1] >= self.max_collisions
+
+    def hints(self, key: str, limit: int = 10) -> List[str]:
+        """返回文本块已接受的问题（最多 limit 个），重新提示时要求模型避开"""
+        with self._lock:
+            return list(self._instructions.get(key, [])[-limit:])
+
+    def duplicate_rates(self) -> Dict[str, float]:
+        """各文本块的重复率（重复条目数 / 检查的条目数）"""
+        with self._lock:
+            return {key: duplicates / checked for key, (checked, duplicates) in self.chunk_stats.items() if checked}
+
+    def report(self) -> Dict:
+        """
+        去重统计
+        返回:
+            dict: 检查的条目总数、重复条目总数、总体重复率、按文本块的统计
+        """
+        with self._lock:
+            checked = sum(stats[0] for stats in self.chunk_stats.values())
+            duplicates = sum(stats[1] for stats in self.chunk_stats.values())
+            per_chunk = {key: {'checked': c, 'duplicates': d, 'rate': d / c if c else 0.0}
+                         for key, (c, d) in self.chunk_stats.items()}
+        return {
+            'checked': checked,
+            'duplicates': duplicates,
+            'rate': duplicates / checked if checked else 0.0,
+            'chunks': per_chunk,
+        }
+
+
+def deduplicate_entries(entries: Iterable[Dict], threshold: float = 0.7, num_perm: int = 128, ngram: int = 2):
+    """
+    离线去重：按顺序保留每组近似重复条目中的第一条
+    返回:
+        tuple: (去重后的条目, 去重统计)
+    """
+    dedup = NearDuplicateFilter(threshold, num_perm, ngram)
+    kept = dedup.filter(entries)
+    return kept, dedup.report()
+
+
+class ExactVectorIndex:
+    """精确向量索引：向量归一化后存入连续矩阵，查询时与全部向量做一次矩阵乘法，适合小规模任务"""
+
+    def __init__(self, dim: int, capacity: int = 1024):
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, vector: np.ndarray) -> int:
+        """登记向量，返回编号"""
+        if self._size == len(self._vectors):
+            self._vectors = np.concatenate([self._vectors, np.zeros_like(self._vectors)])
+        self._vectors[self._size] = _normalize(vector)
+        self._size += 1
+        return self._size - 1
+
+    def nearest(self, vector: np.ndarray):
+        """
+        查询与向量余弦相似度最高的已登记向量
+        返回:
+            tuple: (编号, 余弦相似度)，索引为空时返回 (-1, 0.0)
+        """
+        if self._size == 0:
+            return -1, 0.0
+        similarities = self._vectors[:self._size] @ _normalize(vector)
+        best = int(np.argmax(similarities))
+        return best, float(similarities[best])
+
+    def vectors(self) -> np.ndarray:
+        """按编号顺序返回已登记的（归一化后的）向量"""
+        return self._vectors[:self._size]
+
+
+class HyperplaneLSHIndex:
+    """
+    近似向量索引：随机超平面LSH（SimHash），每张表以向量落在各超平面哪一侧的比特作为桶号，
+    只对同桶的候选向量计算精确余弦相似度，适合大规模任务；相似度很高的向量几乎总会在某张表中同桶
+    """
+
+    def __init__(self, dim: int, num_tables: int = 8, num_bits: int = 12, seed: int = 1):
+        """
+        参数:
+            dim (int): 向量维度
+            num_tables (int): 哈希表数量，越多召回率越高
+            num_bits (int): 每张表的比特数，越多桶越细、候选越少
+            seed (int): 随机种子
+        """
+        rng = np.random.default_rng(seed)
+        self._planes = rng.standard_normal((num_tables, dim, num_bits)).astype(np.float32)
+        self._weights = (1 << np.arange(num_bits)).astype(np.int64)
+        self._tables = [{} for _ in range(num_tables)]
+        self._vectors = []
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def _bucket_keys(self, vector: np.ndarray):
+        bits = np.einsum('d,tdb->tb', vector, self._planes) > 0
+        return (bits.astype(np.int64) @ self._weights).tolist()
+
+    def add(self, vector: np.ndarray) -> int:
+        """登记向量，返回编号"""
+        vector = _normalize(vector)
+        item = len(self._vectors)
+        self._vectors.append(vector)
+        for table, key in zip(self._tables, self._bucket_keys(vector)):
+            table.setdefault(key, []).append(item)
+        return item
+
+    def nearest(self, vector: np.ndarray):
+        """
+        在同桶候选中查询余弦相似度最高的向量
+        返回:
+            tuple: (编号, 余弦相似度)，没有候选时返回 (-1, 0.0)
+        """
+        vector = _normalize(vector)
+        candidates = set()
+        for table, key in zip(self._tables, self._bucket_keys(vector)):
+            candidates.update(table.get(key, ()))
+        if not candidates:
+            return -1, 0.0
+        candidates = sorted(candidates)
+        similarities = np.stack([self._vectors[item] for item in candidates]) @ vector
+        best = int(np.argmax(similarities))
+        return candidates[best], float(similarities[best])
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm > 0 else vector
+
+
+def create_vector_index(dim: int, expected_size: int, exact_limit: int = 20000):
+    """任务规模不超过 exact_limit 时使用精确索引，否则使用超平面LSH近似索引"""
+    if expected_size <= exact_limit:
+        return ExactVectorIndex(dim, capacity=max(1, expected_size))
+    return HyperplaneLSHIndex(dim)
+
+
+class SimilarChunkFilter:
+    """
+    生成前的文本块语义去重：按顺序把文本块嵌入登记到向量索引，与更早的文本块余弦相似度不低于阈值的视为重复
+    可分多次输入文本块（流式切分时每产出一批文本块过滤一次），结果与一次性输入全部文本块相同
+    """
+
+    def __init__(self, threshold: float = 0.95, mode: str = 'drop', entries_per_chunk: int = 5,
+                 duplicate_entries: int = 1, expected_size: int = 0, exact_limit: int = 20000):
+        """
+        参数:
+            threshold (float): 余弦相似度阈值
+            mode (str): "drop" 丢弃重复文本块；"downweight" 保留重复文本块，但只生成 duplicate_entries 个条目
+            entries_per_chunk (int): 非重复文本块生成的条目数
+            duplicate_entries (int): downweight 模式下重复文本块生成的条目数
+            expected_size (int): 预计的文本块数，超过 exact_limit 时直接使用近似索引；
+                                 流式输入时通常未知，先使用精确索引，登记的文本块超过 exact_limit 后转换为近似索引
+            exact_limit (int): 精确索引的规模上限
+        """
+        if mode not in ('drop', 'downweight'):
+            raise ValueError(f"不支持的文本块去重模式: {mode}")
+        self.threshold = threshold
+        self.mode = mode
+        self.entries_per_chunk = entries_per_chunk
+        self.duplicate_entries = duplicate_entries
+        self.expected_size = expected_size
+        self.exact_limit = exact_limit
+        self.index = None
+        self.checked = 0
+        self.duplicates = 0
+
+    def filter(self, chunks: List[str], embeddings: np.ndarray):
+        """
+        过滤一批文本块
+        返回:
+            tuple: (保留的文本块, 对应的条目数)
+        """
+        texts, counts = [], []
+        for chunk, embedding in zip(chunks, embeddings):
+            if self.index is None:
+                self.index = create_vector_index(len(embedding), self.expected_size, self.exact_limit)
+            self.checked += 1
+            nearest, similarity = self.index.nearest(embedding)
+            if similarity >= self.threshold:
+                self.duplicates += 1
+                # 逐个记录被判为重复的文本块，便于核对阈值是否过低
+                logger.info(f"文本块与第 {nearest + 1} 个保留的文本块相似度 {similarity:.4f}，"
+                            f"{'已丢弃' if self.mode == 'drop' else '已降权'}: {chunk[:40]!r}")
+                if self.mode == 'downweight' and self.duplicate_entries > 0:
+                    texts.append(chunk)
+                    counts.append(self.duplicate_entries)
+                continue
+            # 只登记非重复文本块，重复文本块之间不会互相传递相似关系
+            self.index.add(embedding)
+            if isinstance(self.index, ExactVectorIndex) and len(self.index) > self.exact_limit:
+                self.index = self._to_approximate(self.index)
+            texts.append(chunk)
+            counts.append(self.entries_per_chunk)
+        return texts, counts
+
+    @staticmethod
+    def _to_approximate(index: ExactVectorIndex) -> 'HyperplaneLSHIndex':
+        """精确索引的规模超过上限时按原编号顺序转换为近似索引，之后每次查询不再与全部文本块比较"""
+        vectors = index.vectors()
+        approximate = HyperplaneLSHIndex(vectors.shape[1])
+        for vector in vectors:
+            approximate.add(vector)
+        logger.info(f"文本块数超过 {len(vectors) - 1}，语义去重改用近似向量索引")
+        return approximate
+
+    def stats(self) -> Dict:
+        return {'chunks': self.checked, 'duplicates': self.duplicates, 'mode': self.mode,
+                'index': type(self.index).__name__ if self.index is not None else None}
+
+
+def filter_similar_chunks(chunks: List[str], embeddings: np.ndarray, threshold: float = 0.95, mode: str = 'drop',
+                          entries_per_chunk: int = 5, duplicate_entries: int = 1, exact_limit: int = 20000):
+    """
+    一次性过滤全部文本块，参数含义见 SimilarChunkFilter
+    返回:
+        tuple: (保留的文本块, 对应的条目数, 统计信息)
+    """
+    chunk_filter = SimilarChunkFilter(threshold, mode, entries_per_chunk, duplicate_entries, len(chunks), exact_limit)
+    texts, counts = chunk_filter.filter(chunks, embeddings)
+    return texts, counts, chunk_filter.stats()
@@ -0,0 +1,382 @@
+# 基于asyncio的高并发训练数据生成引擎
+import asyncio
+import logging
+import queue
+import time
+from typing import List, Dict
+
+import AIWorker
+import LLMRouter
+
+logger = logging.getLogger(__name__)
+
+# 等待线程队列时每次阻塞的最长时间（秒），超时后检查停止标志
+QUEUE_POLL_INTERVAL = 0.5
+
+
+class AdaptiveLimiter:
+    """
+    自适应并发上限（AIMD）
+    请求成功且延迟正常时加性增长上限；出现错误，或延迟明显高于观测到的基线时乘性减小上限，
+    以此代替固定的 sleep 来给Ollama服务施加背压
+    """
+
+    def __init__(self, limit: int, minimum: int = 1, maximum: int = None, latency_tolerance: float = 2.0,
+                 decrease_factor: float = 0.7):
+        """
+        参数:
+            limit (int): 初始并发上限
+            minimum (int): 并发上限的下限
+            maximum (int): 并发上限的上限，默认等于初始值
+            latency_tolerance (float): 延迟超过基线的多少倍视为过载
+            decrease_factor (float): 过载或出错时并发上限的缩减系数
+        """
+        self.minimum = max(1, minimum)
+        self.maximum = maximum or limit
+        self.limit = float(min(max(limit, self.minimum), self.maximum))
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.baseline_latency = None  # 观测到的最低平滑延迟
+        self.latency_ewma = None
+        self.errors = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency: float, ok: bool):
+        """
+        释放一个在途名额，并根据本次请求的延迟和结果调整并发上限
+        """
+        async with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if ok:
+                self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+                if self.baseline_latency is None or self.latency_ewma < self.baseline_latency:
+                    self.baseline_latency = self.latency_ewma
+                overloaded = self.latency_ewma > self.baseline_latency * self.latency_tolerance
+            else:
+                self.errors += 1
+                overloaded = True
+            # 同一时间窗口内只缩减一次，避免一批慢请求把上限压到最低
+            if overloaded and now - self._last_decrease > (self.latency_ewma or 1.0):
+                self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                self._last_decrease = now
+            elif not overloaded:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+
+class AsyncGenerationEngine:
+    """
+    异步生成引擎
+    使用Ollama的异步客户端并发发送请求，同时受全局在途请求上限、按模型的并发上限和自适应背压约束
+    """
+
+    def __init__(self, max_in_flight: int = 16, model_limits: Dict[str, int] = None, model: str = AIWorker.DEFAULT_MODEL,
+                 host: str = None, max_tries: int = 3, adaptive: bool = True, options: Dict = None,
+                 think: bool = AIWorker.DEFAULT_THINK, keep_alive: str = AIWorker.DEFAULT_KEEP_ALIVE):
+        """
+        参数:
+            max_in_flight (int): 全局在途请求上限
+            model_limits (dict): 按模型名设置的并发上限，未列出的模型只受全局上限约束
+            model (str): 默认使用的模型
+            host (str): Ollama服务地址，默认使用 AIWorker 共享客户端的配置（配置了 AIWorker.LLM_BACKENDS 时使用多后端路由）
+            max_tries (int): 单个条目请求出错时的最大尝试次数
+            adaptive (bool): 是否根据延迟和错误自适应调整在途请求上限
+            options (dict): Ollama请求参数，默认使用 AIWorker.DEFAULT_OPTIONS
+            think (bool): 推理模型是否输出思考过程
+            keep_alive (str): 请求结束后模型在内存中的保留时间
+        """
+        self.max_in_flight = max_in_flight
+        self.model_limits = model_limits or {}
+        self.model = model
+        self.host = host
+        self.max_tries = max_tries
+        self.adaptive = adaptive
+        self.options = options or AIWorker.DEFAULT_OPTIONS
+        self.think = think
+        self.keep_alive = keep_alive
+        self.client = None
+        self.limiter = None
+        self.timings = []         # 每次请求的token数与耗时记录
+        self._model_semaphores = {}
+
+    def _model_semaphore(self, model: str):
+        if model not in self._model_semaphores:
+            self._model_semaphores[model] = asyncio.Semaphore(self.model_limits.get(model, self.max_in_flight))
+        return self._model_semaphores[model]
+
+    async def _chat(self, model: str, prompt: str, format: Dict = None):
+        """
+        发送一次非流式请求，受按模型并发上限和自适应背压约束
+        返回:
+            tuple: (模型回复, 请求耗时信息)
+        """
+        async with self._model_semaphore(model):
+            await self.limiter.acquire()
+            start = time.monotonic()
+            ok = False
+            timing = None
+            AIWorker.LLM_IN_FLIGHT.inc()
+            try:
+                response = await self.client.chat(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    format=format,
+                    options=self.options,
+                    think=self.think,
+                    keep_alive=self.keep_alive,
+                )
+                ok = True
+                timing = AIWorker.request_timing(response)
+                # 客户端观测到的延迟，包含排队与网络耗时
+                timing['latency'] = time.monotonic() - start
+                self.timings.append(timing)
+                return response["message"]["content"], timing
+            finally:
+                latency = time.monotonic() - start
+                AIWorker.LLM_IN_FLIGHT.dec()
+                AIWorker.record_request(model, latency, timing)
+                await self.limiter.release(latency, ok)
+
+    async def generate_entry(self, text: str, model: str = None, avoid: List[str] = None) -> Dict:
+        """为一个文本块生成一个条目，请求出错时按指数退避重试，最终失败时返回空字典"""
+        model = model or self.model
+        prompt = AIWorker.build_entry_prompt(text, avoid)
+        for attempt in range(1, self.max_tries + 1):
+            try:
+                response, _ = await self._chat(model, prompt)
+                AIWorker.log_response(response)
+                return AIWorker.parse_entry_response(response, model)
+            except ValueError as e:
+                # 回复无法解析，与同步实现一致直接放弃该条目
+                logger.error(f"解析条目时发生错误: {str(e)}")
+                return {}
+            except LLMRouter.NoBackendAvailable as e:
+                # 路由已经等待过后端恢复，不再计入重试
+                logger.error(f"生成条目时没有可用的推理后端: {str(e)}")
+                return {}
+            except Exception as e:
+                logger.warning(f"生成条目时发生错误（第 {attempt}/{self.max_tries} 次）: {str(e)}")
+                if attempt < self.max_tries:
+                    AIWorker.RETRIES.inc(source='generate_entry')
+                    await asyncio.sleep(2 ** (attempt - 1))
+        return {}
+
+    async def generate_entries(self, text: str, count: int, model: str = None, max_rounds: int = 3,
+                               avoid: List[str] = None) -> List[Dict]:
+        """一次请求生成多个条目，保留格式正确的条目，缺少的数量在后续轮次中补充请求"""
+        model = model or self.model
+        entries = []
+        for round_index in range(1, max_rounds + 1):
+            missing = count - len(entries)
+            if missing <= 0:
+                break
+            if round_index > 1:
+                AIWorker.RETRIES.inc(source='generate_entries')
+            try:
+                response, _ = await self._chat(model, AIWorker.build_batch_prompt(text, missing, avoid),
+                                               format=AIWorker.entries_schema(missing))
+            except LLMRouter.NoBackendAvailable as e:
+                # 路由已经等待过后端恢复，不再计入重试
+                logger.error(f"批量生成条目时没有可用的推理后端: {str(e)}")
+                break
+            except Exception as e:
+                logger.warning(f"批量生成条目时发生错误（第 {round_index}/{max_rounds} 轮）: {str(e)}")
+                await asyncio.sleep(2 ** (round_index - 1))
+                continue
+            AIWorker.log_response(response)
+            entries.extend(AIWorker.parse_batch_response(response, model)[:missing])
+        return entries
+
+    def _prepare(self):
+        if self.client is None:
+            # 连接池大小与全局在途上限一致，保证每个在途请求都能复用长连接
+            self.client = AIWorker.create_async_client(self.host, pool_size=self.max_in_flight)
+            # 多后端路由时全局在途上限不低于各后端上限之和，吞吐随推理主机数增长
+            self.max_in_flight = max(self.max_in_flight, getattr(self.client, 'capacity', 0))
+        if self.limiter is None:
+            initial = self.max_in_flight if not self.adaptive else max(1, self.max_in_flight // 2)
+            self.limiter = AdaptiveLimiter(initial, maximum=self.max_in_flight) if self.adaptive \
+                else AdaptiveLimiter(self.max_in_flight, minimum=self.max_in_flight)
+
+    async def run(self, texts: List[str], entries_per_file: int, progress_callback=None, model: str = None,
+                  batch: bool = False, journal=None, keys: List[str] = None, sink=None, dedup=None,
+                  counts: List[int] = None) -> List[Dict]:
+        """
+        为全部文本块生成条目
+        batch 为 True 时每个文本块只发送一次请求生成全部条目，缺少的条目再补充请求；
+        指定任务日志 journal 及与文本块对应的哈希 keys 时，跳过已完成的条目，每生成一个条目立即写入日志；
+        指定 sink 时条目生成后立即写入 sink，不再在内存中累积（返回空列表）；
+        指定 dedup（Dedup.NearDuplicateFilter）时丢弃近似重复的条目并重新提示，文本块重复过多时提前停止；
+        指定 counts 时按其中与文本块一一对应的条目数生成，代替统一的 entries_per_file；
+        同一个引擎可在一个事件循环中并发运行多个 run（例如不同模型），共享全局在途上限
+        返回:
+            list: 本次新生成的条目，结构与 AIWorker.generate_dataset 相同
+        """
+        keys = keys or [None] * len(texts)
+        counts = counts or [entries_per_file] * len(texts)
+
+        async def _items():
+            for item in zip(texts, keys, counts):
+                yield item
+
+        return await self.run_stream(_items(), progress_callback, model, batch, journal, sink, dedup, total=sum(counts))
+
+    async def run_stream(self, items, progress_callback=None, model: str = None, batch: bool = False, journal=None,
+                         sink=None, dedup=None, total: int = None) -> List[Dict]:
+        """
+        为异步迭代器 items 产出的 (文本块, 哈希, 条目数) 生成条目，每收到一个文本块立即开始发送请求，
+        不必等待全部文本块就绪（例如与切分阶段组成流水线）；其余参数含义见 run
+        参数:
+            total (int): 条目总数，未知时为None，此时进度总数随收到的文本块增长
+        返回:
+            list: 本次新生成的条目
+        """
+        self._prepare()
+        known_total = 0
+        done = 0
+
+        def _report(count: int):
+            nonlocal done
+            done += count
+            if progress_callback:
+                progress_callback(done, total if total is not None else known_total, "AI")
+
+        async def _one(text: str, key: str, index: int) -> Dict:
+            if dedup is not None and dedup.exhausted(key):
+                _report(1)
+                return {}
+            entry = await self.generate_entry(text, model)
+            retries = 0
+            while entry and dedup is not None and not dedup.check(entry, key):
+                if retries >= dedup.max_retries or dedup.exhausted(key):
+                    logger.warning("  条目与已有条目近似重复，已丢弃")
+                    entry = {}
+                    break
+                retries += 1
+                entry = await self.generate_entry(text, model, dedup.hints(key))
+            _report(1)
+            if entry and all(key_name in entry for key_name in ['instruction', 'input', 'output', 'text']):
+                AIWorker.record_entry(entry, journal, key, index, sink)
+                return entry if sink is None else {}
+            logger.warning("  跳过不完整的条目")
+            return {}
+
+        async def _batch(text: str, key: str, indices: List[int]) -> List[Dict]:
+            entries = await self.generate_entries(text, len(indices), model)
+            if dedup is not None:
+                entries = dedup.filter(entries, key)
+                retries = 0
+                while len(entries) < len(indices) and retries < dedup.max_retries and not dedup.exhausted(key):
+                    retries += 1
+                    extra = await self.generate_entries(text, len(indices) - len(entries), model,
+                                                        avoid=dedup.hints(key))
+                    entries += dedup.filter(extra, key)
+            for index, entry in zip(indices, entries):
+                AIWorker.record_entry(entry, journal, key, index, sink)
+            _report(len(indices))
+            return entries if sink is None else []
+
+        tasks = []
+        # 尚未完成的请求数达到上限时暂停读取 items，使上游（例如流水线的有界队列）感受到背压
+        pending = set()
+        max_pending = self.max_in_flight * 2
+        async for text, key, count in items:
+            known_total += count
+            indices = journal.missing_indices(key, count) if journal is not None else list(range(count))
+            # 已完成的条目直接计入进度
+            done += count - len(indices)
+            if not indices:
+                continue
+            if batch:
+                new_tasks = [asyncio.ensure_future(_batch(text, key, indices))]
+            else:
+                new_tasks = [asyncio.ensure_future(_one(text, key, index)) for index in indices]
+            for task in new_tasks:
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            tasks.extend(new_tasks)
+            while len(pending) >= max_pending:
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+        results = await asyncio.gather(*tasks)
+        if batch:
+            return [entry for entries in results for entry in entries]
+        return [entry for entry in results if entry]
+
+
+# iter_queue 中表示等待超时、队列暂时为空
+_EMPTY = object()
+
+
+async def iter_queue(chunk_queue, stop=None):
+    """
+    把线程队列转换为异步迭代器：在线程池中等待队列元素，收到 None 或 stop 被设置时结束
+    每次最多阻塞 QUEUE_POLL_INTERVAL 秒，线程池中的等待不会在上游停止产出后一直挂起，事件循环可以正常关闭
+    """
+    loop = asyncio.get_running_loop()
+
+    def _get():
+        try:
+            return chunk_queue.get(timeout=QUEUE_POLL_INTERVAL)
+        except queue.Empty:
+            return _EMPTY
+
+    while stop is None or not stop.is_set():
+        item = await loop.run_in_executor(None, _get)
+        if item is _EMPTY:
+            continue
+        if item is None:
+            return
+        yield item
+
+
+def generate_texts_async(texts: List[str], entries_per_file: int = 2, progress_callback=None,
+                         max_in_flight: int = 16, model_limits: Dict[str, int] = None,
+                         model: str = AIWorker.DEFAULT_MODEL, batch: bool = False,
+                         journal=None, keys: List[str] = None, sink=None, dedup=None,
+                         counts: List[int] = None, options: Dict = None) -> List[Dict]:
+    """
+    使用异步引擎为每个文本块生成训练条目，返回本次新生成的条目
+    """
+    engine = AsyncGenerationEngine(max_in_flight=max_in_flight, model_limits=model_limits, model=model, options=options)
+    return asyncio.run(engine.run(texts, entries_per_file, progress_callback, batch=batch, journal=journal, keys=keys,
+                                  sink=sink, dedup=dedup, counts=counts))
+
+
+def generate_stream_async(chunk_queue, progress_callback=None, max_in_flight: int = 16,
+                          model_limits: Dict[str, int] = None, model: str = AIWorker.DEFAULT_MODEL, batch: bool = False,
+                          journal=None, sink=None, dedup=None, options: Dict = None, stop=None) -> List[Dict]:
+    """
+    使用异步引擎为线程队列 chunk_queue 中陆续到达的 (文本块, 哈希, 条目数) 生成训练条目，队列中放入 None 表示结束
+    stop (threading.Event) 与上游共享：上游设置时停止读取队列；生成失败时立即设置，通知上游不再产出
+    """
+    engine = AsyncGenerationEngine(max_in_flight=max_in_flight, model_limits=model_limits, model=model, options=options)
+
+    async def _run():
+        try:
+            return await engine.run_stream(iter_queue(chunk_queue, stop), progress_callback, batch=batch,
+                                           journal=journal, sink=sink, dedup=dedup)
+        except BaseException:
+            if stop is not None:
+                stop.set()
+            raise
+
+    return asyncio.run(_run())
+
+
+def generate_dataset_async(folder_path: str, entries_per_file: int = 2, progress_callback=None,
+                           max_in_flight: int = 16, model_limits: Dict[str, int] = None,
+                           model: str = AIWorker.DEFAULT_MODEL, batch: bool = False) -> List[Dict]:
+    """
+    使用异步引擎为文件夹中的每个文本块生成训练条目，返回结构与 AIWorker.generate_dataset 相同
+    """
+    return generate_texts_async(AIWorker.read_chunk_texts(folder_path), entries_per_file, progress_callback,
+                                max_in_flight=max_in_flight, model_limits=model_limits, model=model, batch=batch)
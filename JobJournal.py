@@ -0,0 +1,184 @@
+# 生成任务的持久化日志：按 (文本块哈希, 条目序号) 记录已完成的条目，任务中断后可从断点继续
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import List, Dict, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+def chunk_hash(text: str) -> str:
+    """计算文本块的内容哈希"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+class JobJournal:
+    """
+    仅追加写入的JSONL任务日志，每行一条记录：
+    - meta:  任务参数（只写一次）
+    - chunk: 文本块哈希与原文（以及该文本块单独指定的条目数），切分产生文本块时写入，恢复任务时无需依赖 chunked_data 目录
+    - chunked: 切分已全部完成（流水线任务在切分途中中断时没有这条记录，恢复时需要重新切分）
+    - entry: 某个文本块第 index 个条目的生成结果
+    - done:  任务已全部完成
+    重新打开已有日志时回放全部记录，跳过进程崩溃时写了一半的最后一行
+    """
+
+    def __init__(self, path: str, fsync: bool = False):
+        """
+        参数:
+            path (str): 日志文件路径
+            fsync (bool): 每条记录写入后是否强制刷盘（可防止系统崩溃丢失数据，但写入更慢）
+        """
+        self.path = path
+        self.fsync = fsync
+        self.job_id = os.path.splitext(os.path.basename(path))[0]
+        self.meta = {}
+        self.chunks = {}          # 哈希 -> 文本，保持写入顺序
+        self.entry_counts = {}    # 哈希 -> 单独指定的条目数（例如语义重复而被降权的文本块）
+        self.completed = set()    # 已完成的 (哈希, 序号)；条目内容只保存在日志文件中，不常驻内存
+        self.chunking_done = False
+        self.finished = False
+        self._lock = threading.Lock()
+
+        needs_newline = False
+        if os.path.exists(path):
+            self._replay()
+            with open(path, 'rb') as file:
+                file.seek(0, os.SEEK_END)
+                if file.tell() > 0:
+                    file.seek(-1, os.SEEK_END)
+                    needs_newline = file.read(1) != b'\n'
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+        if needs_newline:
+            # 上次写了一半的行单独成行，避免与新记录粘连
+            self._file.write('\n')
+
+    def _replay(self):
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line_no, line in enumerate(file, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"任务日志 {self.path} 第 {line_no} 行不完整，已跳过")
+                    continue
+                kind = record.get('type')
+                if kind == 'meta':
+                    self.meta = record.get('meta', {})
+                elif kind == 'chunk':
+                    self.chunks.setdefault(record['hash'], record['text'])
+                    if 'entries' in record:
+                        self.entry_counts.setdefault(record['hash'], record['entries'])
+                elif kind == 'entry':
+                    self.completed.add((record['chunk'], record['index']))
+                elif kind == 'chunked':
+                    self.chunking_done = True
+                elif kind == 'done':
+                    self.finished = True
+
+    def _write(self, record: Dict):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def start(self, **meta):
+        """记录任务参数（恢复已有任务时保留原参数）"""
+        if not self.meta:
+            self.meta = meta
+            self._write({'type': 'meta', 'meta': meta})
+
+    def add_chunks(self, texts: List[str], counts: List[int] = None) -> List[str]:
+        """
+        登记本任务的文本块（流水线任务中可分多次登记）
+        参数:
+            texts (list): 文本块列表
+            counts (list): 与文本块一一对应的条目数，为None时全部使用任务参数中的 entries_per_file
+        返回:
+            list: 与 texts 一一对应的文本块哈希
+        """
+        hashes = []
+        for i, text in enumerate(texts):
+            key = chunk_hash(text)
+            if key not in self.chunks:
+                self.chunks[key] = text
+                record = {'type': 'chunk', 'hash': key, 'text': text}
+                if counts is not None:
+                    self.entry_counts[key] = record['entries'] = counts[i]
+                self._write(record)
+            hashes.append(key)
+        return hashes
+
+    def mark_chunked(self):
+        """标记全部文本块已登记"""
+        if not self.chunking_done:
+            self._write({'type': 'chunked'})
+            self.chunking_done = True
+
+    def chunk_texts(self) -> List[str]:
+        """按登记顺序返回全部文本块"""
+        return list(self.chunks.values())
+
+    def chunk_entry_counts(self, default: int) -> List[int]:
+        """按登记顺序返回每个文本块的条目数，未单独指定的文本块使用 default"""
+        return [self.entry_counts.get(key, default) for key in self.chunks]
+
+    def missing_indices(self, key: str, count: int) -> List[int]:
+        """返回某个文本块尚未完成的条目序号"""
+        return [index for index in range(count) if (key, index) not in self.completed]
+
+    def record_entry(self, key: str, index: int, entry: Dict):
+        """记录一个已完成的条目"""
+        self._write({'type': 'entry', 'chunk': key, 'index': index, 'entry': entry})
+        self.completed.add((key, index))
+
+    def entries(self) -> Iterator[Dict]:
+        """按写入顺序逐条读取日志中全部已完成的条目（同一序号重复记录时只取第一条）"""
+        with self._lock:
+            self._file.flush()
+        seen = set()
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('type') != 'entry':
+                    continue
+                key = (record['chunk'], record['index'])
+                if key not in seen:
+                    seen.add(key)
+                    yield record['entry']
+
+    def finish(self):
+        """标记任务已全部完成"""
+        if not self.finished:
+            self._write({'type': 'done'})
+            self.finished = True
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def list_unfinished(journal_dir: str) -> List[str]:
+    """列出目录中尚未完成的任务日志"""
+    if not os.path.isdir(journal_dir):
+        return []
+    paths = []
+    for name in sorted(os.listdir(journal_dir)):
+        if not name.endswith('.jsonl'):
+            continue
+        path = os.path.join(journal_dir, name)
+        journal = JobJournal(path)
+        if not journal.finished and journal.meta:
+            paths.append(path)
+        journal.close()
+    return paths
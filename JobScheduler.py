@@ -0,0 +1,164 @@
+# 多任务调度：每个任务有独立的任务ID与工作目录，由固定大小的工作线程池按优先级（同优先级先进先出）执行
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+def new_job_id() -> str:
+    """生成任务ID：时间戳加随机后缀，同一秒内提交的任务也不会冲突"""
+    return time.strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:6]
+
+
+class Job:
+    """
+    一个处理任务的状态
+    status 取值：queued（排队中）、running（运行中）、done（已完成）、failed（失败）、cancelled（已取消）
+    """
+
+    def __init__(self, job_id: str, params: Dict, work_dir: str, priority: int = 0):
+        self.job_id = job_id
+        self.params = params
+        self.work_dir = work_dir
+        self.priority = priority
+        self.status = 'queued'
+        self.stage = None
+        self.progress = 0
+        self.rate = None          # 当前阶段的吞吐量（单位/秒）
+        self.eta = None           # 当前阶段的预计剩余时间（秒）
+        self.message = '排队中...'
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def update(self, **fields):
+        """更新进度、阶段、消息等字段"""
+        with self._lock:
+            for key, value in fields.items():
+                setattr(self, key, value)
+
+    def transition(self, expected: str, **fields) -> bool:
+        """当前状态为 expected 时原子地更新字段，返回是否更新成功"""
+        with self._lock:
+            if self.status != expected:
+                return False
+            for key, value in fields.items():
+                setattr(self, key, value)
+            return True
+
+    def path(self, *parts) -> str:
+        """任务工作目录下的路径"""
+        return os.path.join(self.work_dir, *parts)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'job_id': self.job_id,
+                'status': self.status,
+                'priority': self.priority,
+                'stage': self.stage,
+                'progress': self.progress,
+                'rate': self.rate,
+                'eta': self.eta,
+                'message': self.message,
+                'result': self.result,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+            }
+
+
+class JobScheduler:
+    """
+    任务调度器
+    任务按优先级从高到低执行，同优先级按提交顺序执行；同时运行的任务数不超过工作线程数
+    """
+
+    def __init__(self, runner: Callable[[Job], Dict], workers: int = 2, max_history: int = 200):
+        """
+        参数:
+            runner (callable): 执行任务的函数，参数为 Job，返回值保存为任务结果；抛出异常时任务标记为失败
+            workers (int): 工作线程数（同时运行的任务数）
+            max_history (int): 保留的已结束任务数，超出时丢弃最早提交的已结束任务
+        """
+        self.runner = runner
+        self.workers = workers
+        self.max_history = max_history
+        self.jobs = {}            # 任务ID -> Job，保持提交顺序
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        """启动工作线程"""
+        for _ in range(self.workers - len(self._threads)):
+            thread = threading.Thread(target=self._work, name=f'job-worker-{len(self._threads)}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, job: Job) -> Job:
+        """提交任务，返回该任务"""
+        with self._lock:
+            self.jobs[job.job_id] = job
+        self._queue.put((-job.priority, next(self._sequence), job.job_id))
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return list(self.jobs.values())
+
+    def queue_position(self, job_id: str) -> int:
+        """排队中的任务前面还有几个任务等待执行，不在排队中时返回None"""
+        with self._lock:
+            queued = [job for job in self.jobs.values() if job.status == 'queued']
+        queued.sort(key=lambda job: (-job.priority, job.created_at))
+        for position, job in enumerate(queued):
+            if job.job_id == job_id:
+                return position
+        return None
+
+    def cancel(self, job_id: str) -> bool:
+        """取消排队中的任务；运行中的任务无法取消"""
+        job = self.get(job_id)
+        if job is None:
+            return False
+        return job.transition('queued', status='cancelled', message='任务已取消', finished_at=time.time())
+
+    def running(self) -> List[Job]:
+        return [job for job in self.list() if job.status == 'running']
+
+    def _work(self):
+        while True:
+            _, _, job_id = self._queue.get()
+            job = self.get(job_id)
+            if job is None or not job.transition('queued', status='running', started_at=time.time(),
+                                                 message='开始处理...'):
+                continue
+            try:
+                result = self.runner(job)
+                job.update(status='done', result=result, progress=100, finished_at=time.time())
+            except Exception as e:
+                logger.exception(f"任务 {job_id} 失败")
+                job.update(status='failed', error=str(e), finished_at=time.time())
+            self._trim_history()
+
+    def _trim_history(self):
+        with self._lock:
+            finished = [job for job in self.jobs.values() if job.finished_at is not None]
+            for job in finished[:max(0, len(finished) - self.max_history)]:
+                del self.jobs[job.job_id]
@@ -0,0 +1,451 @@
+# 多后端推理路由：在多台Ollama主机和OpenAI兼容服务（vLLM、llama.cpp server）之间做负载均衡、健康检查与熔断
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from typing import List, Dict
+
+import httpx
+import ollama
+
+logger = logging.getLogger(__name__)
+
+# 单个后端默认的在途请求上限
+DEFAULT_BACKEND_IN_FLIGHT = 8
+# 单次请求的超时时间（秒），本地大模型生成较慢，默认较宽松
+DEFAULT_TIMEOUT = 600
+# 后台健康检查的间隔（秒）
+HEALTH_CHECK_INTERVAL = 15
+# 全部后端都熔断时，单个请求等待后端恢复（熔断半开或健康检查恢复）的最长时间（秒）
+DEFAULT_WAIT_TIMEOUT = 120
+
+
+class NoBackendAvailable(RuntimeError):
+    """全部后端都处于熔断状态或请求均失败"""
+
+
+def _pool_limits(pool_size: int) -> httpx.Limits:
+    return httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size, keepalive_expiry=60)
+
+
+def is_backend_failure(error: Exception) -> bool:
+    """
+    判断请求失败是否应归咎于后端（计入熔断并换用其他后端重试）：连接错误、超时、5xx、429，
+    以及 404（该主机上没有所需模型）；其余 4xx 是请求本身的问题，换后端也无济于事
+    """
+    if isinstance(error, httpx.TransportError):
+        return True
+    status = None
+    if isinstance(error, ollama.ResponseError):
+        status = error.status_code
+    elif isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+    if status is None:
+        return isinstance(error, (ConnectionError, TimeoutError))
+    return status >= 500 or status in (404, 429) or status < 0
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败 failure_threshold 次后断开（不再向该后端转发请求），
+    经过 reset_timeout 秒后半开，放行一个试探请求，成功则恢复，失败则重新断开
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        """是否可以向该后端发送请求；半开状态下同一时间只放行一个试探请求"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probing:
+            return True
+        return False
+
+    def retry_at(self) -> float:
+        """断开状态下转为半开、可以再次试探的时间（time.monotonic），未断开时为None"""
+        return self.opened_at + self.reset_timeout if self.opened_at is not None else None
+
+    def on_start(self):
+        if self.state == self.HALF_OPEN:
+            self._probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+
+class Backend:
+    """
+    推理后端的公共部分：在途请求计数、熔断器与统计信息
+    子类实现 _new_client（创建绑定当前事件循环的客户端）、_chat（返回与Ollama非流式响应结构相同的字典）与 _ping；
+    计数与熔断状态由路由加锁维护，可在多个事件循环（多个任务线程）之间共享，客户端按事件循环分别创建
+    """
+
+    kind = None
+
+    def __init__(self, url: str, name: str = None, max_in_flight: int = DEFAULT_BACKEND_IN_FLIGHT, model: str = None,
+                 timeout: float = DEFAULT_TIMEOUT, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        """
+        参数:
+            url (str): 服务地址
+            name (str): 后端名称，用于日志与统计，默认使用服务地址
+            max_in_flight (int): 该后端的在途请求上限
+            model (str): 该后端上使用的模型名，为None时使用请求中的模型名（不同服务上同一模型的名称可能不同）
+            timeout (float): 单次请求的超时时间（秒）
+            failure_threshold (int): 连续失败多少次后熔断
+            reset_timeout (float): 熔断后多少秒放行试探请求
+        """
+        self.url = url
+        self.name = name or url
+        self.max_in_flight = max_in_flight
+        self.model = model
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.healthy = True
+        self._clients = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self):
+        """当前事件循环中的客户端（异步客户端绑定事件循环，每个事件循环单独创建）"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = self._new_client()
+        return client
+
+    def _new_client(self):
+        raise NotImplementedError
+
+    @property
+    def load(self) -> float:
+        """在途请求数占上限的比例，用于最少在途请求负载均衡"""
+        return self.in_flight / self.max_in_flight
+
+    def available(self) -> bool:
+        return self.in_flight < self.max_in_flight and self.breaker.allow()
+
+    async def chat(self, model: str, messages: List[Dict], format: Dict = None, options: Dict = None,
+                   think: bool = None, keep_alive: str = None) -> Dict:
+        return await self._chat(self.model or model, messages, format, options, think, keep_alive)
+
+    async def ping(self) -> bool:
+        """健康检查，服务可访问时返回True"""
+        try:
+            await self._ping()
+            return True
+        except Exception as e:
+            logger.warning(f"后端 {self.name} 健康检查失败: {str(e)}")
+            return False
+
+    async def _chat(self, model, messages, format, options, think, keep_alive) -> Dict:
+        raise NotImplementedError
+
+    async def _ping(self):
+        raise NotImplementedError
+
+    def stats(self) -> Dict:
+        return {'name': self.name, 'kind': self.kind, 'url': self.url, 'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight, 'requests': self.requests, 'failures': self.failures,
+                'state': self.breaker.state, 'healthy': self.healthy}
+
+
+class OllamaBackend(Backend):
+    """Ollama服务（/api/chat）"""
+
+    kind = 'ollama'
+
+    def _new_client(self):
+        return ollama.AsyncClient(host=self.url, limits=_pool_limits(self.max_in_flight), timeout=self.timeout)
+
+    async def _chat(self, model, messages, format, options, think, keep_alive) -> Dict:
+        return await self.client.chat(model=model, messages=messages, format=format, options=options, think=think,
+                                      keep_alive=keep_alive)
+
+    async def _ping(self):
+        await self.client.list()
+
+
+class OpenAIBackend(Backend):
+    """
+    OpenAI兼容服务（/v1/chat/completions），例如 vLLM、llama.cpp server
+    Ollama的采样参数映射为对应字段，format 中的JSON Schema通过 response_format 传递；
+    返回值转换为与Ollama响应相同的结构，token数取自 usage
+    """
+
+    kind = 'openai'
+
+    def __init__(self, url: str, api_key: str = None, **kwargs):
+        """
+        参数:
+            url (str): 服务地址，包含 /v1 前缀，例如 http://10.0.0.2:8000/v1
+            api_key (str): API密钥，本地服务通常不需要
+        """
+        super().__init__(url.rstrip('/'), **kwargs)
+        self.headers = {'Authorization': f'Bearer {api_key}'} if api_key else None
+
+    def _new_client(self):
+        return httpx.AsyncClient(base_url=self.url, headers=self.headers, timeout=self.timeout,
+                                 limits=_pool_limits(self.max_in_flight))
+
+    @staticmethod
+    def request_body(model: str, messages: List[Dict], format: Dict = None, options: Dict = None) -> Dict:
+        """把Ollama风格的请求参数转换为OpenAI chat completions 请求体"""
+        options = options or {}
+        body = {'model': model, 'messages': messages, 'stream': False}
+        for source, target in (('temperature', 'temperature'), ('top_p', 'top_p'), ('top_k', 'top_k'),
+                               ('num_predict', 'max_tokens'), ('seed', 'seed')):
+            if options.get(source) is not None:
+                body[target] = options[source]
+        if isinstance(format, dict):
+            body['response_format'] = {'type': 'json_schema', 'json_schema': {'name': 'entries', 'schema': format}}
+        elif format == 'json':
+            body['response_format'] = {'type': 'json_object'}
+        return body
+
+    async def _chat(self, model, messages, format, options, think, keep_alive) -> Dict:
+        start = time.monotonic()
+        response = await self.client.post('/chat/completions', json=self.request_body(model, messages, format, options))
+        response.raise_for_status()
+        data = response.json()
+        usage = data.get('usage') or {}
+        return {
+            'model': data.get('model', model),
+            'message': {'role': 'assistant', 'content': data['choices'][0]['message'].get('content') or ''},
+            'prompt_eval_count': usage.get('prompt_tokens', 0),
+            'eval_count': usage.get('completion_tokens', 0),
+            'total_duration': int((time.monotonic() - start) * 1e9),
+        }
+
+    async def _ping(self):
+        response = await self.client.get('/models')
+        response.raise_for_status()
+
+
+_BACKEND_TYPES = {
+    'ollama': OllamaBackend,
+    'openai': OpenAIBackend,
+}
+
+
+def create_backend(spec: Dict) -> Backend:
+    """
+    按配置创建后端，例如 {'type': 'ollama', 'url': 'http://10.0.0.1:11434', 'max_in_flight': 8}、
+    {'type': 'openai', 'url': 'http://10.0.0.2:8000/v1', 'model': 'Qwen/Qwen3-30B-A3B'}
+    """
+    spec = dict(spec)
+    kind = spec.pop('type', 'ollama')
+    if kind not in _BACKEND_TYPES:
+        raise ValueError(f"不支持的后端类型: {kind}")
+    return _BACKEND_TYPES[kind](spec.pop('url'), **spec)
+
+
+class LLMRouter:
+    """
+    多后端路由，提供与 ollama.AsyncClient.chat 相同的调用方式：
+    - 负载均衡：每个请求发往在途请求占比最低的可用后端，全部后端已满时等待
+    - 熔断：后端连续失败后暂停转发，恢复时间到达后放行试探请求
+    - 故障转移：后端失败的请求立即换用其他后端重试；全部后端都熔断时等待最早恢复的后端，最长 wait_timeout 秒
+    - 健康检查：后台定期探测各后端，恢复的后端提前结束熔断
+    在途计数与熔断状态加锁维护，同一个路由可被多个事件循环（例如同时运行的多个任务）共享，
+    各后端的在途上限对整个进程生效（见 get_shared_router）
+    """
+
+    def __init__(self, backends: List[Backend], health_interval: float = HEALTH_CHECK_INTERVAL,
+                 wait_timeout: float = DEFAULT_WAIT_TIMEOUT):
+        """
+        参数:
+            backends (list): 后端列表
+            health_interval (float): 健康检查间隔（秒），为None或0时不做后台检查
+            wait_timeout (float): 全部后端都熔断时，单个请求等待后端恢复的最长时间（秒）
+        """
+        if not backends:
+            raise ValueError("至少需要一个后端")
+        self.backends = backends
+        self.health_interval = health_interval
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._waiters = []            # 等待后端空闲或恢复的 (事件循环, asyncio.Event)
+        self._health_task = None
+
+    @property
+    def capacity(self) -> int:
+        """各后端在途请求上限之和"""
+        return sum(backend.max_in_flight for backend in self.backends)
+
+    def _ensure_started(self):
+        """在当前事件循环中启动健康检查（启动它的事件循环结束后，由下一个使用路由的事件循环重新启动）"""
+        if not self.health_interval:
+            return
+        with self._lock:
+            if self._health_task is None or self._health_task.done():
+                self._health_task = asyncio.ensure_future(self._health_loop())
+
+    def _pick(self, exclude) -> Backend:
+        candidates = [backend for backend in self.backends if backend not in exclude and backend.available()]
+        return min(candidates, key=lambda backend: backend.load) if candidates else None
+
+    def _next_retry(self, exclude, now: float) -> float:
+        """
+        没有可用后端时下一次重新检查的时间：有未熔断（只是满载或正在试探）的后端时，请求完成会发出通知，
+        同时每秒重新检查一次；全部熔断时等到最早转为半开的时间
+        返回:
+            float: 重新检查的时间（time.monotonic），全部后端都已尝试过时为None
+        """
+        candidates = [backend for backend in self.backends if backend not in exclude]
+        if not candidates:
+            return None
+        if any(backend.breaker.state != CircuitBreaker.OPEN for backend in candidates):
+            return now + 1.0
+        return min(backend.breaker.retry_at() for backend in candidates)
+
+    def _notify(self):
+        """唤醒所有等待中的请求（可能位于其他线程的事件循环中）"""
+        with self._lock:
+            waiters, self._waiters = self._waiters, []
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # 等待者所在的事件循环已经结束
+                pass
+
+    async def _acquire(self, exclude, deadline: float) -> Backend:
+        loop = asyncio.get_running_loop()
+        while True:
+            event = asyncio.Event()
+            with self._lock:
+                backend = self._pick(exclude)
+                if backend is not None:
+                    backend.in_flight += 1
+                    backend.breaker.on_start()
+                    return backend
+                now = time.monotonic()
+                retry_at = self._next_retry(exclude, now)
+                if retry_at is None or now >= deadline:
+                    return None
+                self._waiters.append((loop, event))
+            try:
+                await asyncio.wait_for(event.wait(), timeout=max(0.0, min(retry_at, deadline) - now))
+            except asyncio.TimeoutError:
+                pass
+
+    def _release(self, backend: Backend, ok: bool):
+        with self._lock:
+            backend.in_flight -= 1
+            backend.requests += 1
+            if ok:
+                backend.breaker.record_success()
+            else:
+                backend.failures += 1
+                backend.breaker.record_failure()
+        self._notify()
+
+    async def chat(self, model: str, messages: List[Dict], format: Dict = None, options: Dict = None,
+                   think: bool = None, keep_alive: str = None) -> Dict:
+        """
+        发送一次非流式请求
+        先依次换用尚未尝试过的后端；每个后端都失败后不立即放弃，而是等待熔断半开或健康检查恢复后再试，
+        直到等待超过 wait_timeout 秒
+        异常:
+            NoBackendAvailable: 等待 wait_timeout 秒后仍没有可用的后端
+        """
+        self._ensure_started()
+        deadline = time.monotonic() + self.wait_timeout
+        tried = set()
+        last_error = None
+        while True:
+            if len(tried) >= len(self.backends):
+                # 每个后端都试过一次，之后只受熔断器约束（连续失败的后端熔断后等待半开）
+                tried = set()
+            backend = await self._acquire(tried, deadline)
+            if backend is None:
+                raise NoBackendAvailable(f"{self.wait_timeout} 秒内没有可用的推理后端（最后一次错误: {last_error}）")
+            tried.add(backend)
+            ok = True
+            try:
+                return await backend.chat(model, messages, format, options, think, keep_alive)
+            except Exception as e:
+                if not is_backend_failure(e):
+                    raise
+                ok = False
+                last_error = e
+                logger.warning(f"后端 {backend.name} 请求失败，尝试其他后端: {str(e)}")
+            finally:
+                self._release(backend, ok)
+
+    async def check_health(self) -> Dict[str, bool]:
+        """探测全部后端；熔断中的后端探测成功时恢复，健康后端探测失败时计入一次失败"""
+        results = await asyncio.gather(*(backend.ping() for backend in self.backends))
+        with self._lock:
+            for backend, healthy in zip(self.backends, results):
+                backend.healthy = healthy
+                if healthy and backend.breaker.state != CircuitBreaker.CLOSED:
+                    logger.info(f"后端 {backend.name} 已恢复")
+                    backend.breaker.record_success()
+                elif not healthy:
+                    backend.breaker.record_failure()
+        self._notify()
+        return {backend.name: healthy for backend, healthy in zip(self.backends, results)}
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.warning(f"健康检查出错: {str(e)}")
+
+    def stats(self) -> List[Dict]:
+        return [backend.stats() for backend in self.backends]
+
+
+def create_router(specs: List[Dict], health_interval: float = HEALTH_CHECK_INTERVAL) -> LLMRouter:
+    """按后端配置列表创建路由"""
+    return LLMRouter([create_backend(spec) for spec in specs], health_interval)
+
+
+# 进程内共享的路由，按后端配置区分
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_shared_router(specs: List[Dict], health_interval: float = HEALTH_CHECK_INTERVAL) -> LLMRouter:
+    """
+    获取进程内共享的路由（相同的后端配置只创建一个实例），同时运行的多个任务共用各后端的在途计数与熔断状态，
+    负载均衡看到的是整个进程的负载，各后端的在途请求不会超过其 max_in_flight
+    """
+    key = tuple(tuple(sorted(spec.items())) for spec in specs)
+    with _routers_lock:
+        router = _routers.get(key)
+        if router is None:
+            router = _routers[key] = create_router(specs, health_interval)
+        return router
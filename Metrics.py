@@ -0,0 +1,259 @@
+# 进程内指标：计数器、仪表与直方图，按Prometheus文本格式导出，供 /metrics 接口抓取
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+import psutil
+
+# 直方图默认的分桶上界（秒），覆盖从毫秒级的嵌入批次到分钟级的大模型请求
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 的标签应为 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _label_text(self, key: Tuple, extra: Dict = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def exposition(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{self._label_text(key)} {_format_value(value)}' for key, value in items]
+
+
+class Gauge(_Metric):
+    """可增可减的仪表；也可以登记取值函数，在导出时读取当前值（例如队列长度、内存占用）"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def remove(self, **labels):
+        """移除一组标签的取值（例如任务结束后移除该任务的队列长度）"""
+        key = self._key(labels)
+        with self._lock:
+            self._values.pop(key, None)
+            self._functions.pop(key, None)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                values[key] = function()
+            except Exception:
+                continue
+        return [f'{self.name}{self._label_text(key)} {_format_value(value)}' for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    """按分桶统计观测值（例如延迟）的分布，同时记录总和与次数"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """记录代码块的耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{self._label_text(key, {"le": _format_value(float(bound))})} {cumulative}')
+            lines.append(f'{self.name}_bucket{self._label_text(key, {"le": "+Inf"})} {count}')
+            lines.append(f'{self.name}_sum{self._label_text(key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{self._label_text(key)} {count}')
+        return lines
+
+
+class Registry:
+    """指标注册表，同名指标只创建一次"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为 {metric.kind}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._get(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._get(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def exposition(self) -> str:
+        """Prometheus文本格式（text/plain; version=0.0.4）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.exposition() for metric in metrics) + '\n'
+
+    def drain(self) -> Dict:
+        """
+        取出并清零全部计数器与直方图的值，用于把子进程中的指标合并到主进程（见 merge）
+        返回:
+            dict: 指标名 -> {标签元组: 值}
+        """
+        snapshot = {}
+        with self._lock:
+            metrics = [metric for metric in self._metrics.values() if isinstance(metric, (Counter, Histogram))]
+        for metric in metrics:
+            with metric._lock:
+                if metric._values:
+                    snapshot[metric.name] = metric._values
+                    metric._values = {}
+        return snapshot
+
+    def merge(self, snapshot: Dict):
+        """把 drain 取出的指标值累加到本进程的同名指标"""
+        for name, values in snapshot.items():
+            with self._lock:
+                metric = self._metrics.get(name)
+            if metric is None:
+                continue
+            with metric._lock:
+                for key, value in values.items():
+                    if isinstance(metric, Counter):
+                        metric._values[key] = metric._values.get(key, 0) + value
+                        continue
+                    state = metric._values.get(key)
+                    if state is None:
+                        metric._values[key] = [list(value[0]), value[1], value[2]]
+                    else:
+                        state[0] = [a + b for a, b in zip(state[0], value[0])]
+                        state[1] += value[1]
+                        state[2] += value[2]
+
+
+# 进程内共享的注册表
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+def process_resident_memory() -> int:
+    """当前进程的常驻内存（字节）"""
+    return psutil.Process().memory_info().rss
+
+
+def child_processes_resident_memory() -> int:
+    """全部子进程（例如多进程切分的工作进程）的常驻内存之和（字节）"""
+    total = 0
+    for child in psutil.Process().children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            # 子进程可能在遍历期间退出
+            continue
+    return total
+
+
+gauge('tdf_process_resident_memory_bytes', '当前进程的常驻内存（字节）').set_function(process_resident_memory)
+gauge('tdf_child_processes_resident_memory_bytes', '全部子进程的常驻内存之和（字节）').set_function(
+    child_processes_resident_memory)
@@ -0,0 +1,203 @@
+# 进度汇总：工作线程只记录计数，后台线程按固定节奏合并各任务、各阶段的进度，计算吞吐量与剩余时间后统一发送
+import logging
+import threading
+import time
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# 默认的发送间隔（秒）
+DEFAULT_INTERVAL = 0.5
+# 吞吐量指数平滑系数
+RATE_SMOOTHING = 0.3
+
+
+class StageProgress:
+    """单个阶段的计数与吞吐量估计"""
+
+    __slots__ = ('processed', 'total', 'started_at', 'sample_processed', 'sample_time', 'rate')
+
+    def __init__(self, now: float):
+        self.processed = 0
+        self.total = 0
+        self.started_at = now
+        self.sample_processed = 0
+        self.sample_time = now
+        self.rate = None
+
+    def sample(self, now: float):
+        """按两次采样之间的增量更新平滑吞吐量；计数回退（例如切换到下一个文件）时重新开始估计"""
+        processed = self.processed
+        elapsed = now - self.sample_time
+        if processed < self.sample_processed:
+            self.sample_processed, self.sample_time, self.rate = processed, now, None
+            return
+        if elapsed <= 0:
+            return
+        instant = (processed - self.sample_processed) / elapsed
+        if self.rate is None:
+            # 第一个估计值使用阶段开始以来的平均速度
+            overall = now - self.started_at
+            self.rate = processed / overall if overall > 0 else instant
+        else:
+            self.rate = (1 - RATE_SMOOTHING) * self.rate + RATE_SMOOTHING * instant
+        self.sample_processed, self.sample_time = processed, now
+
+    def report(self, total: int = None, final: bool = True) -> Dict:
+        """
+        参数:
+            total (int): 已知的最终总数，为None时使用最近一次更新的总数
+            final (bool): 总数是否已经确定，未确定时剩余时间未知
+        """
+        total = max(total, self.total) if total is not None else self.total
+        processed = min(self.processed, total) if total else self.processed
+        rate = self.rate or 0.0
+        eta = (total - processed) / rate if rate > 0 and total and final else None
+        return {
+            'processed': processed,
+            'total': total,
+            'progress': int(processed / total * 100) if total else 0,
+            'rate': round(rate, 2),
+            'eta': round(eta, 1) if eta is not None else None,
+        }
+
+
+class ProgressTracker:
+    """
+    一个任务的进度计数
+    update 只做几次属性赋值，可在任意工作线程（包括事件循环）中高频调用，不加锁、不做I/O
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.stages = {}
+        self.stage = None
+        self.primary = None
+        self.feeder = None
+        self.final_totals = {}
+        self.version = 0
+        self.reported_version = 0
+        self._lock = threading.Lock()
+
+    def combine(self, primary: str, feeder: str):
+        """
+        流水线任务：primary 阶段（生成）的总数由 feeder 阶段（切分）逐步产生，两个阶段同时更新
+        之后的报告始终以 primary 为准、feeder 作为子状态，进度条不会在两个阶段之间来回跳动；
+        finalize(primary) 之前 primary 的总数未定，进度按 feeder 的完成比例折算，剩余时间未知
+        """
+        self.primary = primary
+        self.feeder = feeder
+
+    def finalize(self, stage: str, total: int):
+        """登记阶段的最终总数（例如全部文本块已登记后的条目总数）"""
+        self.final_totals[stage] = total
+        self.version += 1
+
+    def update(self, processed: int, total: int, stage: str):
+        state = self.stages.get(stage)
+        if state is None:
+            with self._lock:
+                state = self.stages.setdefault(stage, StageProgress(time.monotonic()))
+        state.processed = processed
+        state.total = total
+        self.stage = stage
+        self.version += 1
+
+    def callback(self) -> Callable:
+        """返回与 progress_callback(processed, total, process_type) 约定相同的回调函数"""
+        def progress_callback(processed, total, process_type):
+            self.update(processed, total, process_type)
+        return progress_callback
+
+    def report(self, now: float) -> Dict:
+        """
+        各阶段的进度、吞吐量（单位/秒）与预计剩余时间（秒），stage 为最近更新的阶段；
+        合并阶段（见 combine）后 stage 固定为 primary，primary 总数未定时附带 feeder 阶段的进度
+        """
+        stages = {}
+        for name, state in list(self.stages.items()):
+            state.sample(now)
+            final = name != self.primary or name in self.final_totals
+            stages[name] = state.report(self.final_totals.get(name), final)
+        if self.primary is None:
+            report = dict(stages.get(self.stage, {}), stage=self.stage, stages=stages)
+        else:
+            primary = stages.get(self.primary) or StageProgress(now).report(self.final_totals.get(self.primary))
+            report = dict(primary, stage=self.primary, stages=stages)
+            if self.primary not in self.final_totals:
+                feeder = stages.get(self.feeder)
+                fraction = feeder['processed'] / feeder['total'] if feeder and feeder['total'] else 0.0
+                report['progress'] = int(primary['processed'] / primary['total'] * fraction * 100) \
+                    if primary['total'] else 0
+                report['feeder'] = feeder
+        report['key'] = self.key
+        return report
+
+
+class ProgressAggregator:
+    """
+    进度汇总器：后台线程每 interval 秒检查一次全部任务，只为有新进度的任务调用一次 emit(key, report)，
+    同一间隔内的多次进度更新合并为一次发送
+    """
+
+    def __init__(self, emit: Callable[[str, Dict], None], interval: float = DEFAULT_INTERVAL):
+        """
+        参数:
+            emit (callable): 发送函数，参数为 (任务键, 进度报告)
+            interval (float): 发送间隔（秒）
+        """
+        self.emit = emit
+        self.interval = interval
+        self._trackers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def track(self, key: str) -> ProgressTracker:
+        """获取（不存在时创建）某个任务的进度计数"""
+        with self._lock:
+            tracker = self._trackers.get(key)
+            if tracker is None:
+                tracker = self._trackers[key] = ProgressTracker(key)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='progress-aggregator', daemon=True)
+                self._thread.start()
+            return tracker
+
+    def untrack(self, key: str):
+        """任务结束时发送最后一次进度并移除"""
+        with self._lock:
+            tracker = self._trackers.pop(key, None)
+        if tracker is not None:
+            self._flush(tracker, time.monotonic())
+
+    def _flush(self, tracker: ProgressTracker, now: float):
+        version = tracker.version
+        if version == tracker.reported_version:
+            return
+        tracker.reported_version = version
+        self.emit(tracker.key, tracker.report(now))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            with self._lock:
+                trackers = list(self._trackers.values())
+            for tracker in trackers:
+                try:
+                    self._flush(tracker, now)
+                except Exception as e:
+                    # 发送失败（例如客户端断开）不影响其他任务的进度
+                    logger.warning(f"发送任务 {tracker.key} 的进度时发生错误: {str(e)}")
+
+
+def format_eta(seconds: float) -> str:
+    """把剩余秒数格式化为 1小时2分、3分4秒、5秒"""
+    if seconds is None:
+        return '未知'
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f'{seconds // 3600}小时{seconds % 3600 // 60}分'
+    if seconds >= 60:
+        return f'{seconds // 60}分{seconds % 60}秒'
+    return f'{seconds}秒'
@@ -0,0 +1,263 @@
+# 模型回复的JSON提取与修复：去掉推理过程，逐字符扫描配平的JSON片段，修复常见格式错误
+import json
+import logging
+import re
+import threading
+from typing import List, Dict
+
+import Metrics
+
+logger = logging.getLogger(__name__)
+
+# 回复解析结果的指标：ok 直接解析成功，repaired 修复后成功，failed 失败
+PARSE_RESULTS = Metrics.counter('tdf_reply_parse_total', '模型回复的解析结果', ('model', 'result'))
+
+# qwen3 等推理模型在回复开头输出的推理过程
+_THINK_BLOCK = re.compile(r'<think>.*?</think>', re.DOTALL)
+# Markdown代码块标记
+_CODE_FENCE = re.compile(r'```[a-zA-Z]*')
+# 作为JSON分隔符使用的中文引号：紧跟在 { [ , : 之后或紧挨 : , } ] 之前
+_SMART_QUOTE_OPEN = re.compile(r'([{\[,:]\s*)[“”]')
+_SMART_QUOTE_CLOSE = re.compile(r'[“”](\s*[:,}\]])')
+_CLOSING = {'{': '}', '[': ']'}
+
+
+def strip_reasoning(text: str) -> str:
+    """去掉 <think>...</think> 推理过程；推理过程未闭合（回复被截断）时去掉 <think> 之后的全部内容"""
+    text = _THINK_BLOCK.sub('', text)
+    start = text.find('<think>')
+    if start != -1:
+        text = text[:start]
+    return text.replace('</think>', '')
+
+
+def scan_json_candidates(text: str, pos: int = 0):
+    """
+    从 pos 开始单遍扫描文本，按出现顺序找出顶层配平的JSON对象/数组片段
+    扫描时跟踪字符串与转义，字符串内的括号不计入配平；文本结束时仍未闭合的片段单独返回，
+    同时记录截断到其中最后一个完整元素（已闭合的内层对象/数组）处的回退片段，供修复失败时使用
+    返回:
+        tuple: (完整片段列表, 未闭合片段)，未闭合片段为 (起始位置, 片段, 缺少的闭合括号, 回退片段) 或 None，
+               回退片段为 (片段, 缺少的闭合括号)，没有已闭合的内层元素时为 None
+    """
+    complete = []
+    stack = []
+    start = None
+    last_element = None
+    in_string = False
+    escaped = False
+    for i in range(pos, len(text)):
+        char = text[i]
+        if start is None:
+            if char in _CLOSING:
+                start = i
+                stack = [char]
+                last_element = None
+                in_string = escaped = False
+            continue
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in _CLOSING:
+            stack.append(char)
+        elif char in '}]':
+            if _CLOSING[stack[-1]] != char:
+                # 括号不匹配，放弃该片段，从下一个字符重新寻找
+                start = None
+                continue
+            stack.pop()
+            if not stack:
+                complete.append(text[start:i + 1])
+                start = None
+            else:
+                last_element = (i + 1, ''.join(_CLOSING[bracket] for bracket in reversed(stack)))
+    if start is None:
+        return complete, None
+    suffix = '"' if in_string else ''
+    missing = ''.join(_CLOSING[bracket] for bracket in reversed(stack))
+    fallback = (text[start:last_element[0]], last_element[1]) if last_element else None
+    return complete, (start, text[start:] + suffix, missing, fallback)
+
+
+def _remove_trailing_commas(text: str) -> str:
+    """去掉字符串之外、紧挨 } 或 ] 之前的多余逗号"""
+    result = []
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '}]':
+            while result and result[-1].isspace():
+                result.pop()
+            if result and result[-1] == ',':
+                result.pop()
+        result.append(char)
+    return ''.join(result)
+
+
+def repair_json(fragment: str, missing: str = '') -> str:
+    """
+    修复常见的JSON格式错误：用作分隔符的中文引号、多余的尾逗号、被截断时缺少的闭合括号
+    """
+    fragment = _SMART_QUOTE_OPEN.sub(r'\1"', fragment)
+    fragment = _SMART_QUOTE_CLOSE.sub(r'"\1', fragment)
+    fragment = fragment.rstrip().rstrip(',') + missing
+    return _remove_trailing_commas(fragment)
+
+
+def iter_json_values(response: str):
+    """
+    按优先顺序产出模型回复中可解析的JSON值：整段回复、各个配平的JSON片段、修复后的片段、
+    截断片段补全括号后的结果（补全失败时截断到最后一个完整元素）；
+    末尾片段始终未闭合时（例如正文中夹带一个未配对的花括号），从其后的下一个括号处重新扫描
+    字符串中未转义的换行等控制字符按宽松模式接受
+    返回:
+        generator: (解析结果, 是否经过修复, 截断时补全的闭合括号数)
+    """
+    text = _CODE_FENCE.sub('', strip_reasoning(response)).strip()
+    try:
+        yield json.loads(text, strict=False), False, 0
+        return
+    except ValueError:
+        pass
+    pos = 0
+    while True:
+        complete, unclosed = scan_json_candidates(text, pos)
+        for fragment in complete:
+            try:
+                yield json.loads(fragment, strict=False), False, 0
+            except ValueError:
+                continue
+        for fragment in complete:
+            try:
+                yield json.loads(repair_json(fragment), strict=False), True, 0
+            except ValueError:
+                continue
+        if unclosed is None:
+            return
+        start, fragment, missing, fallback = unclosed
+        try:
+            yield json.loads(repair_json(fragment, missing), strict=False), True, len(missing)
+        except ValueError:
+            if fallback is not None:
+                try:
+                    yield json.loads(repair_json(*fallback), strict=False), True, len(fallback[1])
+                except ValueError:
+                    pass
+        pos = start + 1
+
+
+def parse_json_reply(response: str):
+    """
+    从模型回复中解析出第一个JSON值
+    返回:
+        tuple: (解析结果, 是否经过修复)
+    异常:
+        ValueError: 回复中没有可解析的JSON
+    """
+    for value, repaired, _ in iter_json_values(response):
+        return value, repaired
+    raise ValueError("回复中没有可解析的JSON")
+
+
+class ParseStats:
+    """按模型统计回复解析结果：解析次数、失败次数、经过修复才成功的次数"""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, ok: bool, repaired: bool = False):
+        PARSE_RESULTS.inc(model=model, result='failed' if not ok else 'repaired' if repaired else 'ok')
+        with self._lock:
+            counts = self._counts.setdefault(model, {'parsed': 0, 'failed': 0, 'repaired': 0})
+            counts['parsed'] += 1
+            if not ok:
+                counts['failed'] += 1
+            elif repaired:
+                counts['repaired'] += 1
+
+    def failure_rates(self) -> Dict[str, float]:
+        """各模型的解析失败率"""
+        with self._lock:
+            return {model: counts['failed'] / counts['parsed'] for model, counts in self._counts.items() if counts['parsed']}
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """各模型的统计副本"""
+        with self._lock:
+            return {model: dict(counts) for model, counts in self._counts.items()}
+
+
+# 进程内共享的解析统计
+parse_stats = ParseStats()
+
+
+def _unwrap(data, required_keys: List[str]):
+    """
+    把解析结果统一为条目列表：接受单个条目、条目数组，或 {"entries": [...]} 形式
+    返回:
+        tuple: (条目列表, 条目外层的容器层数)
+    """
+    if isinstance(data, dict):
+        if all(key in data for key in required_keys):
+            return [data], 0
+        for value in data.values():
+            if isinstance(value, list):
+                return value, 2
+        return [data], 0
+    return (data, 1) if isinstance(data, list) else ([], 0)
+
+
+def _valid_entries(items: List, required_keys: List[str]) -> List[Dict]:
+    entries = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        if 'input' in required_keys and item.get('input') is None:
+            item['input'] = ''
+        if all(isinstance(item.get(key), str) for key in required_keys):
+            entries.append(item)
+    return entries
+
+
+def extract_entries(response: str, required_keys: List[str], model: str = None) -> List[Dict]:
+    """
+    从模型回复中提取字段为字符串的条目（input 为 null 或缺失时按空字符串处理）
+    回复中有多个JSON片段时（例如正文中夹带的花括号），使用第一个包含有效条目的片段；
+    回复被截断时丢弃最后一个（内容不完整的）条目；提取失败时返回空列表，并计入该模型的解析失败率
+    """
+    parsed = False
+    for data, repaired, missing in iter_json_values(response):
+        parsed = True
+        items, depth = _unwrap(data, required_keys)
+        if missing > depth:
+            # 截断发生在最后一个条目内部
+            items = items[:-1]
+        entries = _valid_entries(items, required_keys)
+        if entries:
+            parse_stats.record(model, ok=True, repaired=repaired)
+            if repaired:
+                logger.info("回复中的JSON格式有误，已自动修复")
+            if len(entries) < len(items):
+                logger.warning(f"回复中有 {len(items) - len(entries)} 个条目格式不完整，已丢弃")
+            return entries
+    parse_stats.record(model, ok=False)
+    if parsed:
+        logger.warning("JSON 解析成功，但缺少必要字段")
+    else:
+        logger.error("无法从API响应中提取有效的JSON")
+    return []
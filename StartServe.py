@@ -1,16 +1,24 @@
 # 训练样本生成GUI
 import flask
 from flask import Flask, render_template, request, redirect, url_for, send_from_directory
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 import webbrowser
 import os
 import shutil
 import TextDivider
 import AIWorker
+import JobJournal
+import JobScheduler
+import ProgressReporter
+import Metrics
+import Dedup
+import ReplyParser
 import Training_Test_Maker
 import threading
+import queue
 import time
 import subprocess
+import json
 
 # 获取脚本的绝对路径
 my_path = os.path.dirname(os.path.realpath(__file__))
@@ -24,7 +32,6 @@ socketio = SocketIO(app, async_mode='threading')
 UPLOAD_FOLDER = 'uploads'
 GENERATED_FOLDER = 'generated_data'
 CHUNKED_FOLDER = 'chunked_data'  # 用于存放切分后的数据
-shutil.rmtree('chunked_data')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['GENERATED_FOLDER'] = GENERATED_FOLDER
 app.config['CHUNKED_FOLDER'] = CHUNKED_FOLDER  # 配置切分数据文件夹
@@ -35,12 +42,57 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(GENERATED_FOLDER, exist_ok=True)
 os.makedirs(CHUNKED_FOLDER, exist_ok=True)  # 创建切分数据文件夹
 
-# 全局变量用于存储当前处理状态
-current_processing_status = {
-    'is_processing': False,
-    'progress': 0,
-    'message': ''
-}
+# 常驻的BERT嵌入引擎，首次切分时加载，之后在各任务之间复用；句子嵌入缓存在磁盘上，重复切分同一语料时无需重新计算
+BERT_MODEL_PATH = my_path + "/bert-base-chinese"
+EMBEDDING_CACHE_DIR = my_path + "/embedding_cache"
+# 默认的嵌入计算后端（见 TextDivider.EMBEDDING_BACKENDS），上传时可按任务选择；
+# 没有GPU的切分节点可使用 torch-int8 或 onnx-int8，切分边界与 torch 的差异可用 benchmarks/validate_embedding_backend.py 评估
+EMBEDDING_BACKEND = TextDivider.DEFAULT_EMBEDDING_BACKEND
+embedding_engine = TextDivider.get_embedding_engine(BERT_MODEL_PATH, cache_dir=EMBEDDING_CACHE_DIR, backend=EMBEDDING_BACKEND)
+# 多文件切分时的进程数，None 表示按CPU核心数自动选择
+CHUNK_WORKERS = None
+# 生成阶段同时发往Ollama的最大请求数；未配置 LLM_BACKENDS 时同时也是整个服务（所有任务合计）发往本机Ollama的上限
+GENERATION_MAX_IN_FLIGHT = 16
+AIWorker.OLLAMA_MAX_IN_FLIGHT = GENERATION_MAX_IN_FLIGHT
+# 多台推理主机（Ollama 或 vLLM、llama.cpp server 等OpenAI兼容服务），请求按最少在途请求分配，故障主机自动熔断；
+# 为空时只使用本机Ollama。例如：
+# LLM_BACKENDS = [
+#     {'type': 'ollama', 'url': 'http://192.168.1.10:11434', 'max_in_flight': 8},
+#     {'type': 'openai', 'url': 'http://192.168.1.11:8000/v1', 'model': 'Qwen/Qwen3-30B-A3B', 'max_in_flight': 32},
+# ]
+LLM_BACKENDS = []
+AIWorker.LLM_BACKENDS = LLM_BACKENDS
+# 是否每个文本块只发送一次请求、以JSON数组形式生成全部条目
+GENERATION_BATCH = True
+# 生成任务日志目录，服务重启后据此恢复中断的任务；每个任务的上传文件、中间数据和导出文件保存在其中以任务ID命名的子目录
+JOURNAL_FOLDER = 'mnt/jobs'
+# 同时运行的任务数，其余任务按优先级排队；每个任务内部仍按 CHUNK_WORKERS、GENERATION_MAX_IN_FLIGHT 并发
+JOB_WORKERS = 2
+# 生成前文本块语义去重的余弦相似度阈值，与更早的文本块相似度不低于该值视为重复，None 表示不去重
+# BERT句向量各向异性明显，内容无关的文本块之间余弦相似度也普遍偏高，阈值需要在自己的语料上核对（重复的文本块会逐个记录到日志）
+CHUNK_DEDUP_THRESHOLD = 0.95
+# 重复文本块的处理方式："drop" 丢弃；"downweight" 保留但只生成 CHUNK_DEDUP_ENTRIES 个条目
+# 默认降权而不是丢弃，阈值误判时文本块仍会生成少量条目，不会丢失内容
+CHUNK_DEDUP_MODE = 'downweight'
+CHUNK_DEDUP_ENTRIES = 1
+# 每个文本块生成的条目数
+ENTRIES_PER_CHUNK = 5
+# 生成条目在线近似去重的相似度阈值（MinHash估计的Jaccard相似度），None 表示不去重
+GENERATION_DEDUP_THRESHOLD = 0.7
+# 导出阶段读取一次Parquet数据集同时写出的格式（alpaca、jsonl、sharegpt），第一个格式的文件供页面下载
+EXPORT_FORMATS = ('alpaca', 'jsonl', 'sharegpt')
+# 导出文件的压缩算法，可选 None、'gzip'、'zstd'
+EXPORT_COMPRESSION = None
+# 切分与生成组成流水线，文本块经有界队列直接送入生成引擎；队列满时切分暂停，等待生成跟上
+PIPELINE_QUEUE_SIZE = 256
+# 进度推送间隔（秒）：工作线程只更新计数，期间的多次进度更新合并为一次SocketIO消息
+PROGRESS_INTERVAL = 0.5
+# 是否把切分后的文本块另存到任务目录的 chunked_data 子目录（文本块已登记在任务日志中，恢复任务不依赖该目录）
+SAVE_CHUNKS = False
+
+# 服务层的指标
+PIPELINE_QUEUE_DEPTH = Metrics.gauge('tdf_pipeline_queue_depth', '流水线中等待生成的文本块数', ('job',))
+JOBS = Metrics.gauge('tdf_jobs', '各状态的任务数', ('status',))
 
 # 全局变量用于存储ollama信息
 ollama_info = {
@@ -102,166 +154,453 @@ def index():
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """
-    处理单个或多个文件上传，并进行文本切分。
+    处理单个或多个文件上传，创建处理任务并加入调度队列。
     """
-    global current_processing_status
-
-    # 重置处理状态
-    current_processing_status['is_processing'] = True
-    current_processing_status['progress'] = 0
-    current_processing_status['message'] = '开始处理文件...'
-
-    uploaded_files_paths = []
-    if 'file' in request.files:  # 单文件上传
-        file = request.files['file']
-        if file.filename != '':
-            filename = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-            file.save(filename)
-            uploaded_files_paths.append(filename)
-
-    if 'files[]' in request.files:  # 多文件上传
-        files = request.files.getlist('files[]')
-        for file in files:
-            if file and file.filename != '':
-                filename = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-                file.save(filename)
-                uploaded_files_paths.append(filename)
-
-    if not uploaded_files_paths:
-        current_processing_status['is_processing'] = False
-        return render_template('index.html', message='请至少上传一个文件！')
-
     # 获取样本切分配置
     try:
         max_length = int(request.form.get('max_length', 2048))
         similarity_threshold = float(request.form.get('similarity_threshold', 0.5))
     except ValueError:
-        current_processing_status['is_processing'] = False
         return render_template('index.html', message='切分参数无效，请检查最大长度和相似度阈值！')
+    embedding_backend = request.form.get('embedding_backend') or EMBEDDING_BACKEND   # 嵌入计算后端
+    if embedding_backend not in TextDivider.EMBEDDING_BACKENDS:
+        return render_template('index.html', message=f'不支持的嵌入后端: {embedding_backend}！')
 
     # 获取大模型和Prompt配置
     model_choice = request.form.get('model_choice')         # 大模型选择
     prompt_text = request.form.get('prompt_text')           # 手动设置的提示词
-    top_k = request.form.get('top_k')
-    top_p = request.form.get('top_p')
-    temperature = request.form.get('temperature')
-    context_window = request.form.get('context_window')
-    # print(model_choice,prompt_text,top_k,top_p,temperature, context_window)
+    try:
+        # 未填写的生成参数为None，使用 AIWorker 的默认值
+        top_k = int(request.form['top_k']) if request.form.get('top_k') else None
+        top_p = float(request.form['top_p']) if request.form.get('top_p') else None
+        temperature = float(request.form['temperature']) if request.form.get('temperature') else None
+        context_window = int(request.form['context_window']) if request.form.get('context_window') else None
+        priority = int(request.form.get('priority') or 0)   # 任务优先级，数值越大越先执行
+    except ValueError:
+        return render_template('index.html', message='生成参数无效，请检查Temperature、Top-K、Top-P、上下文窗口和优先级！')
 
-    print(f"Uploaded files: {[os.path.basename(f) for f in uploaded_files_paths]}")
+    # 上传文件保存到任务自己的目录，不同任务的同名文件互不覆盖
+    job_id = JobScheduler.new_job_id()
+    work_dir = os.path.join(JOURNAL_FOLDER, job_id)
+    upload_dir = os.path.join(work_dir, 'uploads')
+    os.makedirs(upload_dir, exist_ok=True)
+    uploaded_files_paths = []
+    files = [request.files['file']] if 'file' in request.files else []   # 单文件上传
+    files += request.files.getlist('files[]')                             # 多文件上传
+    for file in files:
+        if file and file.filename != '':
+            filename = os.path.join(upload_dir, os.path.basename(file.filename))
+            file.save(filename)
+            uploaded_files_paths.append(filename)
+
+    if not uploaded_files_paths:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return render_template('index.html', message='请至少上传一个文件！')
+
+    print(f"Job {job_id} uploaded files: {[os.path.basename(f) for f in uploaded_files_paths]}")
     print(f"Max Length for chunking: {max_length}")
     print(f"Similarity Threshold for chunking: {similarity_threshold}")
+    print(f"Embedding backend for chunking: {embedding_backend}")
     print(f"Selected model: {model_choice}")
     print(f"Prompt: {prompt_text}")
 
-    # 在后台线程中处理文件
-    thread = threading.Thread(
-        target=process_files_background,
-        args=(uploaded_files_paths, max_length, similarity_threshold, model_choice, prompt_text, top_k, top_p, temperature)
-    )
-    thread.start()
+    job = JobScheduler.Job(job_id, {
+        'files': uploaded_files_paths,
+        'max_length': max_length,
+        'similarity_threshold': similarity_threshold,
+        'embedding_backend': embedding_backend,
+        'model_choice': model_choice,
+        'prompt_text': prompt_text,
+        'top_k': top_k,
+        'top_p': top_p,
+        'temperature': temperature,
+        'context_window': context_window,
+    }, work_dir, priority)
+    # 提交时即写入任务日志，服务在任务排队期间重启也能恢复
+    open_journal(job).close()
+    scheduler.submit(job)
+    position = scheduler.queue_position(job_id)
+    waiting = f'，前面还有 {position} 个任务' if position else ''
+    return render_template('index.html', message=f'文件上传成功，任务 {job_id} 已加入队列{waiting}...', job_id=job_id)
+
+
+# 切分参数扫描的路由
+@app.route('/sweep', methods=['POST'])
+def sweep_chunking_params():
+    """
+    对上传的单个文档只计算一次嵌入，返回多组切分参数下的文本块数量与长度分布。
+    表单字段 params 为 JSON 数组，例如 [[0.5, 2048], [0.6, 1024]]，每项为 (相似度阈值, 最大长度)。
+    """
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return flask.jsonify({'error': '请上传一个文件！'}), 400
+    try:
+        params = json.loads(request.form.get('params', '[]'))
+        params = [(float(threshold), int(length)) for threshold, length in params]
+        bins = int(request.form.get('bins', 10))
+    except (ValueError, TypeError):
+        return flask.jsonify({'error': '扫描参数无效，请提供 [[相似度阈值, 最大长度], ...] 格式的参数列表！'}), 400
+    if not params:
+        return flask.jsonify({'error': '请至少提供一组扫描参数！'}), 400
+    if bins < 1:
+        return flask.jsonify({'error': '直方图分箱数 bins 必须至少为1！'}), 400
 
-    return render_template('index.html', message='文件上传成功，正在处理中...')
+    try:
+        long_text = file.read().decode('utf-8')
+    except UnicodeDecodeError:
+        return flask.jsonify({'error': '文件不是UTF-8编码的文本，无法切分！'}), 400
+    start = time.perf_counter()
+    results = TextDivider.sweep_parameters(long_text, params, engine=embedding_engine, bins=bins)
+    return flask.jsonify({
+        'filename': file.filename,
+        'elapsed': round(time.perf_counter() - start, 3),
+        'results': results,
+    })
+
+
+def emit_job_event(job, event, data):
+    """向订阅了该任务的客户端发送事件"""
+    socketio.emit(event, dict(data, job_id=job.job_id), to=job.job_id)
+
+
+def progress_message(report):
+    """根据进度报告生成页面上显示的进度消息"""
+    progress = report['progress']
+    eta = ProgressReporter.format_eta(report['eta'])
+    if report['stage'] == "divider":
+        return f'正在切分文本... {progress}%（预计剩余 {eta}）'
+    if report['stage'] == "AI":
+        # 流水线任务切分尚未完成时，切分进度作为生成进度的子状态显示
+        feeder = report.get('feeder')
+        chunking = f'，切分 {feeder["progress"]}%' if feeder else ''
+        return f'正在生成训练数据... {progress}%（{report["rate"]:.1f} 条/秒{chunking}，预计剩余 {eta}）'
+    return None
+
+
+def emit_progress(job_id, report):
+    """进度汇总线程按固定节奏调用：更新任务状态并通过SocketIO发送合并后的进度"""
+    job = scheduler.get(job_id)
+    message = progress_message(report)
+    if job is None or message is None:
+        return
+    job.update(stage=report['stage'], progress=report['progress'], message=message, eta=report['eta'],
+               rate=report['rate'])
+    emit_job_event(job, 'progress_update', {
+        'progress': report['progress'],
+        'message': message,
+        'stage': report['stage'],
+        'rate': report['rate'],
+        'eta': report['eta'],
+        'stages': report['stages'],
+    })
+
+
+progress_aggregator = ProgressReporter.ProgressAggregator(emit_progress, interval=PROGRESS_INTERVAL)
 
 
 # 句子切分进度条
-def progress_callback(processed, total, process_type):
-    """进度回调函数"""
-    global current_processing_status
-    if total > 0:
-        progress = int((processed / total) * 100)
-        current_processing_status['progress'] = progress
-        if process_type == "divider":
-            current_processing_status['message'] = f'正在切分文本... {progress}%'
-            # 通过SocketIO发送进度更新
-            socketio.emit('progress_update', {
-                'progress': progress,
-                'message': f'正在切分文本... {progress}%'
-            })
-        elif process_type == "AI":
-            current_processing_status['message'] = f'正在生成训练数据... {progress}%'
-            # 通过SocketIO发送进度更新
-            socketio.emit('progress_update', {
-                'progress': progress,
-                'message': f'正在生成训练数据... {progress}%'
-            })
-        time.sleep(0.01)  # 短暂延迟以确保消息发送
-
-
-def process_files_background(uploaded_files_paths, max_length, similarity_threshold, model_choice, prompt_text, top_k, top_p, temperature):
-    """在后台线程中处理文件"""
-    global current_processing_status
-    try:
-        processed_chunk_files = []
-        all_chunks = []
-        for uploaded_file_path in uploaded_files_paths:
-            # 更新状态
-            filename = os.path.basename(uploaded_file_path)
-            current_processing_status['message'] = f'正在处理文件: {filename}'
-            socketio.emit('progress_update', {
-                'progress': current_processing_status['progress'],
-                'message': f'正在处理文件: {filename}'
-            })
-
-            # 读取文件内容
-            long_text = TextDivider.read_text_file(uploaded_file_path)
-            # 调用 TextDivider 进行文本切分，传入进度回调函数
-            text_chunks = TextDivider.split_text_by_semantic(
-                long_text,
-                max_length,
-                similarity_threshold,
-                my_path+"/bert-base-chinese",
-                progress_callback
-            )
+def make_progress_callback(job):
+    """创建任务的进度回调函数：只在调用线程中记录计数，由进度汇总线程统一发送"""
+    return progress_aggregator.track(job.job_id).callback()
 
-            # 为每个上传文件创建一个独立的切分输出目录
-            original_filename_base = os.path.splitext(os.path.basename(uploaded_file_path))[0]
-            output_chunk_dir = os.path.join(app.config['CHUNKED_FOLDER'], original_filename_base)
-            os.makedirs(output_chunk_dir, exist_ok=True)
-
-            # 保存切分后的文本块
-            all_chunks = all_chunks + text_chunks                               # 在总变量中记录切分数据
-            TextDivider.save_chunks_to_files(text_chunks, output_chunk_dir)     # 存储切分数据
-            processed_chunk_files.append(output_chunk_dir)                      # 记录切分后的目录
 
-        socketio.emit('processing_complete', {
-            'message': '文件上传、切分成功并已开始生成数据！'
-        })
+def job_output_dir(meta):
+    """任务导出文件所在的目录（早期任务日志中没有 work_dir，使用公共的 generated_data 目录）"""
+    return os.path.join(meta['work_dir'], GENERATED_FOLDER) if meta.get('work_dir') else GENERATED_FOLDER
 
-        # 调用AIWorker进行训练数据生成
-        input_folder = "./chunked_data"        # 指定输入文件夹路径
-        output_file = "mnt/instruction_dataset.parquet"
-        print("开始生成数据集...")
-        dataset = AIWorker.generate_dataset(input_folder, entries_per_file=5, progress_callback=progress_callback)
-        AIWorker.save_dataset_as_parquet(dataset, output_file)                  # 存储Q&A训练数据
 
-        # 调用 Training_Test_Maker 生成最终的数据集（包含训练数据和测试数据）
-        train_file, test_file = Training_Test_Maker.data_maker()
+def open_journal(job):
+    """
+    打开任务的日志，新任务先写入任务参数；每个条目生成后立即写入任务日志，中断后可从断点恢复
+    返回:
+        JobJournal: 任务日志
+    """
+    journal = JobJournal.JobJournal(os.path.join(JOURNAL_FOLDER, job.job_id + '.jsonl'))
+    if not journal.meta:
+        params = job.params
+        journal.start(output_file=job.path('instruction_dataset.parquet'), work_dir=job.work_dir,
+                      priority=job.priority, entries_per_file=ENTRIES_PER_CHUNK, batch=GENERATION_BATCH,
+                      model=params['model_choice'] or AIWorker.DEFAULT_MODEL,
+                      temperature=params['temperature'], top_k=params['top_k'], top_p=params['top_p'],
+                      context_window=params['context_window'], files=params['files'],
+                      max_length=params['max_length'], similarity_threshold=params['similarity_threshold'],
+                      embedding_backend=params.get('embedding_backend', EMBEDDING_BACKEND))
+    return journal
+
+
+def run_job(job):
+    """
+    调度器执行任务的入口：新任务从切分开始，恢复的任务从任务日志的中断处继续
+    返回:
+        dict: 训练集与测试集文件名及下载地址
+    """
+    try:
+        journal = open_journal(job)
+        try:
+            if journal.chunking_done or 'files' not in journal.meta:
+                train_file, test_file = run_generation_job(journal, job=job)
+            else:
+                # 切分与生成同时进行；恢复切分途中中断的任务时重新切分，已登记的文本块和已完成的条目按哈希跳过
+                train_file, test_file = run_pipeline_job(journal, job)
+            download_prefix = f'/download/{job.job_id}/' if journal.meta.get('work_dir') else '/download/'
+        finally:
+            journal.close()
+            progress_aggregator.untrack(job.job_id)
+    except Exception as e:
+        error_msg = f'处理任务 {job.job_id} 时发生错误: {str(e)}'
+        job.update(message=error_msg)
+        emit_job_event(job, 'processing_error', {'message': error_msg})
+        raise
+
+    # 处理完成
+    result = {
+        'train_file': os.path.basename(train_file),
+        'test_file': os.path.basename(test_file),
+        'train_url': download_prefix + os.path.basename(train_file),
+        'test_url': download_prefix + os.path.basename(test_file),
+    }
+    job.update(progress=100, message='处理完成！')
+    emit_job_event(job, 'processing_complete', dict(result, message='训练数据集、测试数据集生成完毕！'))
+    return result
+
+
+def produce_chunks(journal, chunk_queue, stop, job=None):
+    """
+    流水线的切分阶段：逐批切分任务日志中记录的文件，语义去重后登记到任务日志，并放入 chunk_queue 交给生成阶段
+    结束时（包括出错时）放入 None；stop 被设置时（生成阶段出错）提前结束
+    """
+    meta = journal.meta
+    progress = make_progress_callback(job) if job is not None else None
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                chunk_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
 
-        # 处理完成
-        current_processing_status['is_processing'] = False
-        current_processing_status['progress'] = 100
-        current_processing_status['message'] = '处理完成！'
+    try:
+        # 生成前丢弃（或降权）与更早的文本块语义重复的文本块，例如重复的页眉、免责声明
+        chunk_filter = Dedup.SimilarChunkFilter(CHUNK_DEDUP_THRESHOLD, CHUNK_DEDUP_MODE,
+                                                entries_per_chunk=meta['entries_per_file'],
+                                                duplicate_entries=CHUNK_DEDUP_ENTRIES) if CHUNK_DEDUP_THRESHOLD else None
+        saved_chunks = {}
+        for file_index, text_chunks, embeddings in TextDivider.iter_split_files(
+                meta['files'], meta['max_length'], meta['similarity_threshold'], BERT_MODEL_PATH, progress,
+                workers=CHUNK_WORKERS, cache_dir=EMBEDDING_CACHE_DIR, with_embeddings=chunk_filter is not None,
+                backend=meta.get('embedding_backend', EMBEDDING_BACKEND)):
+            if stop.is_set():
+                # 生成阶段已失败，不再继续切分
+                return
+            if SAVE_CHUNKS:
+                saved_chunks.setdefault(file_index, []).extend(text_chunks)
+            counts = None
+            if chunk_filter is not None:
+                text_chunks, counts = chunk_filter.filter(text_chunks, embeddings)
+            keys = journal.add_chunks(text_chunks, counts)
+            for i, (text, key) in enumerate(zip(text_chunks, keys)):
+                if not _put((text, key, counts[i] if counts is not None else meta['entries_per_file'])):
+                    return
+        journal.mark_chunked()
+        if job is not None:
+            # 全部文本块已登记，生成阶段的条目总数确定，此后才能估计剩余时间
+            progress_aggregator.track(job.job_id).finalize('AI', sum(journal.chunk_entry_counts(meta['entries_per_file'])))
+
+        chunk_root = os.path.join(meta['work_dir'], CHUNKED_FOLDER) if meta.get('work_dir') else app.config['CHUNKED_FOLDER']
+        for file_index, text_chunks in saved_chunks.items():
+            # 为每个上传文件创建一个独立的切分输出目录
+            original_filename_base = os.path.splitext(os.path.basename(meta['files'][file_index]))[0]
+            output_chunk_dir = os.path.join(chunk_root, original_filename_base)
+            os.makedirs(output_chunk_dir, exist_ok=True)
+            TextDivider.save_chunks_to_files(text_chunks, output_chunk_dir)
+        if chunk_filter is not None:
+            stats = chunk_filter.stats()
+            print(f"文本块语义去重: {stats['chunks']} 个文本块中有 {stats['duplicates']} 个重复（{CHUNK_DEDUP_MODE}）")
+        if job is not None:
+            emit_job_event(job, 'processing_complete', {'message': '文件切分完成，正在生成剩余的数据！'})
+    finally:
+        _put(None)
 
-        socketio.emit('processing_complete', {
-            'message': '训练数据集、测试数据集生成完毕！',
-            'train_file': os.path.basename(train_file),
-            'test_file': os.path.basename(test_file)
-        })
 
-    except Exception as e:
-        current_processing_status['is_processing'] = False
-        error_msg = f'处理文件时发生错误: {str(e)}'
-        current_processing_status['message'] = error_msg
-        socketio.emit('processing_error', {'message': error_msg})
+def run_pipeline_job(journal, job=None):
+    """
+    运行（或恢复）流水线任务：切分线程产出的文本块经有界队列直接进入生成引擎，生成不必等待全部文件切分完成
+    参数:
+        journal (JobJournal): 任务日志，已登记的文本块与已完成的条目不会重复处理
+        job (Job): 所属任务，用于报告进度
+    返回:
+        tuple: (训练集文件名, 测试集文件名)
+    """
+    meta = journal.meta
+    chunk_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+    errors = []
+
+    def _produce():
+        try:
+            produce_chunks(journal, chunk_queue, stop, job)
+        except Exception as e:
+            errors.append(e)
+
+    # 文本块尚未全部产生，num_ctx 按切分的最大长度计算
+    options = AIWorker.generation_options([], meta['entries_per_file'], meta['batch'],
+                                          temperature=meta.get('temperature'), top_k=meta.get('top_k'),
+                                          top_p=meta.get('top_p'), context_window=meta.get('context_window'),
+                                          max_text_tokens=meta['max_length'])
+    print(f"生成参数: 模型 {meta.get('model', AIWorker.DEFAULT_MODEL)}，{options}")
+    print("开始切分并生成数据集...")
+    dedup = Dedup.NearDuplicateFilter(GENERATION_DEDUP_THRESHOLD) if GENERATION_DEDUP_THRESHOLD else None
+    if job is not None:
+        # 切分与生成同时进行，进度以生成为准，切分作为子状态
+        progress_aggregator.track(job.job_id).combine('AI', 'divider')
+    producer = threading.Thread(target=_produce, daemon=True)
+    producer.start()
+    PIPELINE_QUEUE_DEPTH.set_function(chunk_queue.qsize, job=journal.job_id)
+    try:
+        with AIWorker.ParquetSink(meta['output_file'], metadata={'job_id': journal.job_id}) as sink:
+            AIWorker.generate_dataset_from_stream(chunk_queue,
+                                                  progress_callback=make_progress_callback(job) if job else None,
+                                                  max_in_flight=GENERATION_MAX_IN_FLIGHT, batch=meta['batch'],
+                                                  journal=journal, sink=sink, dedup=dedup,
+                                                  model=meta.get('model', AIWorker.DEFAULT_MODEL), options=options,
+                                                  stop=stop)
+    finally:
+        stop.set()
+        producer.join()
+        PIPELINE_QUEUE_DEPTH.remove(job=journal.job_id)
+    if errors:
+        raise errors[0]
+    return finish_generation_job(journal, dedup)
+
+
+def run_generation_job(journal, texts=None, entry_counts=None, job=None):
+    """
+    运行（或恢复）生成阶段：生成条目、保存为Parquet并划分训练集与测试集
+    参数:
+        journal (JobJournal): 任务日志，已完成的条目不会重复生成
+        texts (list): 文本块列表，为None时使用日志中登记的文本块及其条目数（用于恢复任务）
+        entry_counts (list): 与文本块一一对应的条目数，为None时每个文本块生成 entries_per_file 个条目
+        job (Job): 所属任务，用于报告进度
+    返回:
+        tuple: (训练集文件名, 测试集文件名)
+    """
+    meta = journal.meta
+    if texts is None:
+        texts = journal.chunk_texts()
+        entry_counts = journal.chunk_entry_counts(meta['entries_per_file'])
+    # 页面上设置的生成参数；num_ctx 按本任务最长的提示词计算，不超过页面设置的上下文窗口
+    options = AIWorker.generation_options(texts, max(entry_counts or [meta['entries_per_file']]), meta['batch'],
+                                          temperature=meta.get('temperature'), top_k=meta.get('top_k'),
+                                          top_p=meta.get('top_p'), context_window=meta.get('context_window'))
+    print(f"生成参数: 模型 {meta.get('model', AIWorker.DEFAULT_MODEL)}，{options}")
+    print("开始生成数据集...")
+    dedup = Dedup.NearDuplicateFilter(GENERATION_DEDUP_THRESHOLD) if GENERATION_DEDUP_THRESHOLD else None
+    # 条目边生成边按行组写入Parquet（存储Q&A训练数据），内存占用不随条目数增长
+    with AIWorker.ParquetSink(meta['output_file'], metadata={'job_id': journal.job_id}) as sink:
+        AIWorker.generate_dataset_from_texts(texts, entries_per_file=meta['entries_per_file'],
+                                             progress_callback=make_progress_callback(job) if job else None,
+                                             engine="async",
+                                             max_in_flight=GENERATION_MAX_IN_FLIGHT, batch=meta['batch'],
+                                             journal=journal, sink=sink, dedup=dedup, entry_counts=entry_counts,
+                                             model=meta.get('model', AIWorker.DEFAULT_MODEL), options=options)
+    return finish_generation_job(journal, dedup)
+
+
+def finish_generation_job(journal, dedup=None):
+    """
+    生成阶段结束后保存去重报告、输出解析统计，并导出最终的训练集与测试集
+    返回:
+        tuple: (训练集文件名, 测试集文件名)
+    """
+    meta = journal.meta
+    output_dir = job_output_dir(meta)
+    if dedup is not None:
+        # 保存按文本块统计的重复率
+        report = dedup.report()
+        print(f"近似去重: 检查 {report['checked']} 个条目，丢弃 {report['duplicates']} 个（重复率 {report['rate']:.1%}）")
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, 'dedup_report.json'), 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=4)
+
+    for model, counts in ReplyParser.parse_stats.snapshot().items():
+        print(f"模型 {model} 回复解析: 共 {counts['parsed']} 次，失败 {counts['failed']} 次，修复后成功 {counts['repaired']} 次")
+
+    # 调用 Training_Test_Maker 生成最终的数据集（包含训练数据和测试数据）
+    train_file, test_file = Training_Test_Maker.data_maker(meta['output_file'], output_dir,
+                                                           formats=EXPORT_FORMATS, compression=EXPORT_COMPRESSION)
+    journal.finish()
+    return train_file, test_file
+
+
+def recover_interrupted_jobs():
+    """服务启动时把上次中断的任务重新加入调度队列，只重新生成日志中缺少的条目"""
+    for path in JobJournal.list_unfinished(JOURNAL_FOLDER):
+        journal = JobJournal.JobJournal(path)
+        print(f"恢复中断的生成任务: {journal.job_id}（已完成 {len(journal.completed)} 个条目）")
+        work_dir = journal.meta.get('work_dir') or os.path.join(JOURNAL_FOLDER, journal.job_id)
+        journal.close()
+        job = JobScheduler.Job(journal.job_id, {'resume': True}, work_dir, journal.meta.get('priority', 0))
+        job.update(message=f'正在恢复中断的任务: {journal.job_id}')
+        scheduler.submit(job)
+
+
+# 任务调度器：同时运行 JOB_WORKERS 个任务，其余任务排队
+scheduler = JobScheduler.JobScheduler(run_job, workers=JOB_WORKERS)
+for _status in ('queued', 'running', 'done', 'failed', 'cancelled'):
+    JOBS.set_function(lambda status=_status: sum(job.status == status for job in scheduler.list()), status=_status)
+
+
+def job_info(job):
+    """任务状态，排队中的任务附带排队位置"""
+    info = job.to_dict()
+    info['queue_position'] = scheduler.queue_position(job.job_id)
+    return info
 
 
 # 获取当前处理状态的路由
 @app.route('/status')
 def get_status():
-    """获取当前处理状态"""
-    global current_processing_status
-    return flask.jsonify(current_processing_status)
+    """获取全部任务的处理状态"""
+    jobs = [job_info(job) for job in scheduler.list()]
+    return flask.jsonify({
+        'is_processing': any(job['status'] == 'running' for job in jobs),
+        'jobs': jobs,
+    })
+
+# 任务列表与单个任务状态的路由
+@app.route('/jobs')
+def list_jobs():
+    """返回全部任务（按提交顺序）的状态与进度"""
+    return flask.jsonify([job_info(job) for job in scheduler.list()])
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """返回单个任务的状态与进度"""
+    job = scheduler.get(job_id)
+    if job is None:
+        return flask.jsonify({'error': f'任务 {job_id} 不存在'}), 404
+    return flask.jsonify(job_info(job))
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """取消排队中的任务"""
+    if not scheduler.cancel(job_id):
+        return flask.jsonify({'error': f'任务 {job_id} 不存在或已开始运行，无法取消'}), 409
+    # 已取消的任务在日志中标记为结束，服务重启后不再恢复
+    journal = JobJournal.JobJournal(os.path.join(JOURNAL_FOLDER, job_id + '.jsonl'))
+    journal.finish()
+    journal.close()
+    return flask.jsonify(job_info(scheduler.get(job_id)))
+
+# Prometheus指标的路由
+@app.route('/metrics')
+def get_metrics():
+    """
+    以Prometheus文本格式返回切分、生成、导出各阶段的指标，以及队列长度与内存占用
+    """
+    return flask.Response(Metrics.REGISTRY.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 # 获取ollama信息的路由
 @app.route('/ollama_models')
@@ -272,6 +611,14 @@ def get_ollama_info():
     # print(ollama_info)
     return flask.jsonify(ollama_info["models"])
 
+# 获取嵌入引擎状态的路由
+@app.route('/embedding_engine')
+def get_embedding_engine_info():
+    """
+    返回BERT嵌入引擎的加载状态、加载耗时、内存占用与缓存命中情况
+    """
+    return flask.jsonify(embedding_engine.stats())
+
 # 下载生成文件的路由
 @app.route('/download/<filename>')
 def download_file(filename):
@@ -280,6 +627,14 @@ def download_file(filename):
     """
     return send_from_directory(app.config['GENERATED_FOLDER'], filename, as_attachment=True)
 
+@app.route('/download/<job_id>/<filename>')
+def download_job_file(job_id, filename):
+    """
+    下载某个任务生成的文件。
+    """
+    return send_from_directory(os.path.join(JOURNAL_FOLDER, os.path.basename(job_id), GENERATED_FOLDER), filename,
+                               as_attachment=True)
+
 
 # SocketIO事件处理
 @socketio.on('connect')
@@ -287,6 +642,17 @@ def handle_connect():
     print('客户端已连接')
 
 
+@socketio.on('join_job')
+def handle_join_job(data):
+    """客户端订阅某个任务的进度事件"""
+    job = scheduler.get((data or {}).get('job_id'))
+    if job is None:
+        return
+    join_room(job.job_id)
+    info = job.to_dict()
+    emit('progress_update', {'job_id': job.job_id, 'progress': info['progress'], 'message': info['message']})
+
+
 @socketio.on('disconnect')
 def handle_disconnect():
     print('客户端已断开连接')
@@ -295,12 +661,18 @@ def handle_disconnect():
 
 
 if __name__ == "__main__":
+    # 清理上一次运行遗留的切分数据（放在主程序中，避免切分子进程导入本模块时误删）
+    shutil.rmtree(CHUNKED_FOLDER, ignore_errors=True)
+    os.makedirs(CHUNKED_FOLDER, exist_ok=True)
     logo()
     # 检查ollama状态
     check_ollama_status()
     print(f"Ollama available: {ollama_info['available']}")
     if ollama_info['models']:
         print(f"Available models: {', '.join(ollama_info['models'])}")
+    # 启动任务调度器，并在后台恢复上次中断的生成任务
+    scheduler.start()
+    threading.Thread(target=recover_interrupted_jobs, daemon=True).start()
     # 在浏览器中打开指定的 URL
     webbrowser.open_new('http://localhost:5000')
     socketio.run(app, debug=False, allow_unsafe_werkzeug=True)
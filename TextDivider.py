@@ -1,13 +1,45 @@
 # 使用BERT对中文文本进行按语义切分
 import torch
-from transformers import BertTokenizer, BertModel
+from transformers import BertConfig, BertTokenizer, BertModel
+import numpy as np
 import re
 import os
-# 余弦相似度计算
-from scipy.spatial.distance import cosine
+import math
 # 导入 tqdm 库用于显示进度条
 from tqdm import tqdm
 import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import closing
+import hashlib
+import json
+from collections import OrderedDict
+import psutil
+from types import SimpleNamespace
+import Metrics
+
+# 可选的嵌入计算后端：
+#   torch       PyTorch fp32（默认，切分结果的基准）
+#   torch-int8  PyTorch 动态量化，全连接层权重为int8
+#   onnx        ONNX Runtime fp32（需要安装 onnxruntime）
+#   onnx-int8   ONNX Runtime 动态量化（需要安装 onnxruntime）
+# 量化后端在CPU上更快，但嵌入存在误差，切分边界可能与基准不同，可用 benchmarks/validate_embedding_backend.py 评估
+EMBEDDING_BACKENDS = ('torch', 'torch-int8', 'onnx', 'onnx-int8')
+DEFAULT_EMBEDDING_BACKEND = 'torch'
+
+# 嵌入缓存写满后每次淘汰的比例：成批淘汰并先写回索引，之后的写入使用空出的槽位，不必每次写入都重写索引
+CACHE_EVICT_FRACTION = 0.05
+# 切分过程中把新嵌入写回磁盘的最短间隔（秒），任务结束时再写回一次
+CACHE_FLUSH_INTERVAL = 30.0
+
+# 切分阶段的指标（多进程切分时由子进程统计，随切分结果合并到主进程）
+SENTENCES = Metrics.counter('tdf_sentences_total', '语义切分处理的句子数')
+EMBEDDING_CACHE = Metrics.counter('tdf_embedding_cache_lookups_total', '句子嵌入缓存的查询次数', ('result',))
+EMBEDDING_BATCH_SECONDS = Metrics.histogram('tdf_embedding_batch_seconds', 'BERT前向计算一批句子的耗时（秒）')
+EMBEDDING_BATCH_SIZE = Metrics.histogram('tdf_embedding_batch_sentences', '每批BERT前向计算的句子数',
+                                         buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+CHUNKS = Metrics.counter('tdf_chunks_total', '切分产生的文本块数')
 
 
 def get_sentence_embedding(sentence, model, tokenizer):
@@ -29,22 +61,585 @@ def get_sentence_embedding(sentence, model, tokenizer):
     return outputs.last_hidden_state.mean(dim=1).squeeze().numpy()
 
 
-def split_text_by_semantic(text, max_length, similarity_threshold=0.5, model_path='./bert-base-chinese', progress_callback=None):
+class EmbeddingCache:
     """
-    基于语义相似度对文本进行分块
+    以内容寻址、持久化到磁盘的句子嵌入缓存
+    嵌入以float16存放在内存映射矩阵中，索引记录 键 -> (槽位, token数)，键由模型标识和句子文本的哈希组成；
+    容量有上限，写满后按最近最少使用（LRU）的顺序成批淘汰（见 CACHE_EVICT_FRACTION）：
+    淘汰后先把索引写回磁盘再复用空出的槽位，磁盘上的索引不会指向已被覆盖的槽位，两次写回之间中断只会丢失新写入的条目
+    只读模式用于多进程切分的子进程：只查询不写盘，新计算的嵌入暂存在 pending 中（同一进程内可再次命中），交由主进程统一写入；
+    子进程按启动时的索引读取槽位，因此子进程运行期间（见 pin）写入只使用空闲槽位，不淘汰、不覆盖已有条目
+    """
+
+    def __init__(self, cache_dir, model_id, dim, max_entries=100000, read_only=False):
+        """
+        参数:
+            cache_dir (str): 缓存目录
+            model_id (str): 模型标识，不同模型的嵌入互不命中
+            dim (int): 嵌入维度
+            max_entries (int): 最多缓存的句子数
+            read_only (bool): 是否以只读模式打开
+        """
+        self.cache_dir = cache_dir
+        self.model_id = model_id
+        self.dim = dim
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.skipped = 0              # 有子进程在读取、且没有空闲槽位时未写入的条目数
+        self.read_only = read_only
+        self._readers = 0             # 正在读取缓存的进程池数量（可能属于不同任务）
+        self.pending = []             # 只读模式下待写入的 (句子, 嵌入, token数)
+        self._pending_index = {}      # 只读模式下待写入条目的 键 -> (嵌入, token数)
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(cache_dir, 'index.json')
+        self._matrix_path = os.path.join(cache_dir, 'embeddings.f16')
+        # 键 -> [槽位, token数]，按最近使用顺序排列（最久未使用的在最前面）
+        self._entries = OrderedDict()
+        self._free_slots = []
+        self._dirty = False           # 内存中有尚未写回磁盘的条目
+        self._flushed_at = time.monotonic()
+
+        if not read_only:
+            os.makedirs(cache_dir, exist_ok=True)
+        index = None
+        if os.path.exists(self._index_path) and os.path.exists(self._matrix_path):
+            try:
+                with open(self._index_path, 'r', encoding='utf-8') as file:
+                    index = json.load(file)
+            except (OSError, ValueError):
+                index = None
+        valid = index is not None and index.get('dim') == dim and index.get('max_entries') == max_entries
+        if read_only:
+            # 只读模式下缓存不存在或不匹配时视为空缓存
+            self._matrix = np.memmap(self._matrix_path, dtype=np.float16, mode='r', shape=(max_entries, dim)) if valid else None
+            if valid:
+                for key, slot, count in index.get('entries', []):
+                    self._entries[key] = [slot, count]
+            return
+        # 维度或容量与现有缓存不一致时，丢弃旧缓存重新建立
+        if not valid:
+            self._matrix = np.memmap(self._matrix_path, dtype=np.float16, mode='w+', shape=(max_entries, dim))
+            self._dirty = True
+        else:
+            self._matrix = np.memmap(self._matrix_path, dtype=np.float16, mode='r+', shape=(max_entries, dim))
+            for key, slot, count in index.get('entries', []):
+                self._entries[key] = [slot, count]
+        used = {slot for slot, _ in self._entries.values()}
+        self._free_slots = [slot for slot in range(max_entries - 1, -1, -1) if slot not in used]
+
+    def make_key(self, sentence):
+        """
+        计算句子在当前模型下的缓存键
+        """
+        return hashlib.blake2b((self.model_id + '\n' + sentence).encode('utf-8'), digest_size=16).hexdigest()
+
+    def lookup(self, sentences):
+        """
+        批量查询缓存
+        参数:
+            sentences (list): 句子列表
+        返回:
+            tuple: (命中的 {句子下标: (嵌入, token数)}, 未命中的句子下标列表)
+        """
+        found = {}
+        missing = []
+        with self._lock:
+            for i, sentence in enumerate(sentences):
+                key = self.make_key(sentence)
+                entry = self._entries.get(key)
+                if entry is None:
+                    if key in self._pending_index:
+                        embedding, count = self._pending_index[key]
+                        found[i] = (embedding.astype(np.float32), count)
+                    else:
+                        missing.append(i)
+                    continue
+                self._entries.move_to_end(key)
+                found[i] = (np.asarray(self._matrix[entry[0]], dtype=np.float32), entry[1])
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def store(self, sentences, embeddings, token_counts):
+        """
+        批量写入缓存，容量不足时成批淘汰最久未使用的条目（有子进程在读取时不淘汰，放不下的条目不写入）
+        参数:
+            sentences (list): 句子列表
+            embeddings (numpy.ndarray): 与句子一一对应的嵌入矩阵
+            token_counts (list): 与句子一一对应的token数
+        """
+        with self._lock:
+            if self.read_only:
+                for sentence, embedding, count in zip(sentences, embeddings, token_counts):
+                    key = self.make_key(sentence)
+                    if key in self._pending_index:
+                        continue
+                    embedding = np.asarray(embedding, dtype=np.float16)
+                    self.pending.append((sentence, embedding, int(count)))
+                    self._pending_index[key] = (embedding, int(count))
+                return
+            for sentence, embedding, count in zip(sentences, embeddings, token_counts):
+                key = self.make_key(sentence)
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    continue
+                if not self._free_slots:
+                    if self._readers:
+                        # 子进程仍按旧索引读取已有槽位，此时淘汰会让它们读到其他句子的嵌入
+                        self.skipped += 1
+                        continue
+                    self._evict()
+                slot = self._free_slots.pop()
+                self._matrix[slot] = embedding
+                self._entries[key] = [slot, int(count)]
+                self._dirty = True
+
+    def _evict(self):
+        """淘汰最久未使用的一批条目并立即写回索引，之后才复用这些槽位（调用方持有 _lock）"""
+        count = min(len(self._entries), max(1, int(self.max_entries * CACHE_EVICT_FRACTION)))
+        for _ in range(count):
+            _, (slot, _) = self._entries.popitem(last=False)
+            self._free_slots.append(slot)
+        self.evictions += count
+        self._write()
+
+    def pin(self):
+        """
+        子进程以只读方式打开缓存之前调用：先把索引写回磁盘，使子进程读到的索引与嵌入矩阵一致；
+        直到对应的 unpin 之前，本进程（包括其他任务）的写入都不会淘汰或覆盖已有槽位
+        """
+        with self._lock:
+            self._readers += 1
+        self.flush()
+
+    def unpin(self):
+        """子进程全部结束后调用，恢复按LRU淘汰"""
+        with self._lock:
+            self._readers -= 1
+
+    def drain_pending(self):
+        """
+        取出并清空只读模式下暂存的待写入条目
+        """
+        with self._lock:
+            pending, self.pending = self.pending, []
+            self._pending_index = {}
+        return pending
+
+    def flush(self, min_interval=0):
+        """
+        将嵌入矩阵和索引写回磁盘（索引先写临时文件再替换，避免中断时损坏），没有新条目时不写
+        参数:
+            min_interval (float): 距上次写回不足该秒数时跳过，用于在切分过程中定期写回
+        """
+        if self.read_only:
+            return
+        with self._lock:
+            if not self._dirty or time.monotonic() - self._flushed_at < min_interval:
+                return
+            self._write()
+
+    def _write(self):
+        """写回嵌入矩阵和索引（调用方持有 _lock）"""
+        self._matrix.flush()
+        index = {
+            'model_id': self.model_id,
+            'dim': self.dim,
+            'max_entries': self.max_entries,
+            'entries': [[key, slot, count] for key, (slot, count) in self._entries.items()],
+        }
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(index, file)
+        os.replace(tmp_path, self._index_path)
+        self._dirty = False
+        self._flushed_at = time.monotonic()
+
+    def stats(self):
+        """
+        返回缓存的命中/未命中次数与容量使用情况
+        """
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'evictions': self.evictions,
+            'skipped': self.skipped,
+        }
+
+
+def _import_onnxruntime():
+    """按需导入 onnxruntime，未安装时给出明确的提示"""
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError("使用 onnx / onnx-int8 嵌入后端需要安装 onnxruntime：pip install onnxruntime") from e
+    return onnxruntime
+
+
+# 进程内的ONNX导出互斥：多个任务同时使用ONNX后端时只导出一次
+_export_lock = threading.Lock()
+
+
+def export_onnx(model_path='./bert-base-chinese', quantize=False):
+    """
+    将本地BERT模型导出为ONNX格式（可选再做int8动态量化），保存在模型目录的 onnx 子目录中，已导出时直接返回
+    进程内的并发调用由锁串行化；不同进程各自写入以进程号和线程号区分的临时文件，再原子替换
     参数:
-        text (str): 输入的长文本
-        max_length (int): 每个文本块的最大长度（以BERT分词器的token为单位）
-        similarity_threshold (float): 语义相似度阈值，默认为0.79
-        progress_callback (function): 进度回调函数，用于报告进度
+        model_path (str): 本地BERT模型目录
+        quantize (bool): 是否导出int8动态量化的模型
     返回:
-        list: 分割后的文本块列表
+        str: ONNX模型文件路径
     """
-    # 加载BERT模型和分词器
-    tokenizer = BertTokenizer.from_pretrained('./bert-base-chinese')
-    model = BertModel.from_pretrained('./bert-base-chinese')
+    onnx_dir = os.path.join(model_path, 'onnx')
+    fp32_path = os.path.join(onnx_dir, 'model.onnx')
+    target_path = os.path.join(onnx_dir, 'model-int8.onnx') if quantize else fp32_path
+    if os.path.exists(target_path):
+        return target_path
+    onnxruntime = _import_onnxruntime()
+    # 先写临时文件再替换，避免多个进程同时导出时读到不完整的文件
+    suffix = f"{os.getpid()}.{threading.get_ident()}.tmp"
+    with _export_lock:
+        if os.path.exists(target_path):
+            return target_path
+        os.makedirs(onnx_dir, exist_ok=True)
+
+        if not os.path.exists(fp32_path):
+            model = BertModel.from_pretrained(model_path)
+            model.eval()
+            dummy = torch.ones((1, 8), dtype=torch.long)
+            input_names = ['input_ids', 'attention_mask', 'token_type_ids']
+            dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names + ['last_hidden_state']}
+            dynamic_axes['pooler_output'] = {0: 'batch'}
+            tmp_path = f"{fp32_path}.{suffix}"
+            with torch.no_grad():
+                torch.onnx.export(model, (dummy, dummy, torch.zeros_like(dummy)), tmp_path, input_names=input_names,
+                                  output_names=['last_hidden_state', 'pooler_output'], dynamic_axes=dynamic_axes,
+                                  opset_version=14)
+            os.replace(tmp_path, fp32_path)
+            print(f"BERT模型已导出为ONNX: {fp32_path}")
+
+        if quantize:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            tmp_path = f"{target_path}.{suffix}"
+            quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, target_path)
+            print(f"ONNX模型已量化为int8: {target_path}（onnxruntime {onnxruntime.__version__}）")
+    return target_path
+
+
+class OnnxBertModel:
+    """
+    以ONNX Runtime执行的BERT模型，调用方式与输出（last_hidden_state）与 BertModel 相同，可直接替换
+    """
+
+    def __init__(self, model_path, quantize=False):
+        """
+        参数:
+            model_path (str): 本地BERT模型目录
+            quantize (bool): 是否使用int8动态量化的模型
+        """
+        onnxruntime = _import_onnxruntime()
+        self.path = export_onnx(model_path, quantize)
+        self.config = BertConfig.from_pretrained(model_path)
+        options = onnxruntime.SessionOptions()
+        # 与torch使用相同的线程数（多进程切分时子进程已按进程数限制）
+        options.intra_op_num_threads = torch.get_num_threads()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(self.path, options, providers=['CPUExecutionProvider'])
+        self.param_bytes = os.path.getsize(self.path)
+
+    def __call__(self, input_ids, attention_mask, token_type_ids):
+        outputs = self.session.run(['last_hidden_state'], {
+            'input_ids': input_ids.numpy(),
+            'attention_mask': attention_mask.numpy(),
+            'token_type_ids': token_type_ids.numpy(),
+        })
+        return SimpleNamespace(last_hidden_state=torch.from_numpy(outputs[0]))
+
+
+def _model_bytes(model):
+    """
+    模型参数占用的内存（字节）；动态量化后的全连接层以打包形式保存权重，不在 parameters() 中，单独统计
+    """
+    if isinstance(model, OnnxBertModel):
+        return model.param_bytes
+    total = sum(p.numel() * p.element_size() for p in model.parameters())
+    for module in model.modules():
+        weight = getattr(module, 'weight', None)
+        if callable(weight):
+            packed = weight()
+            total += packed.numel() * packed.element_size()
+    return total
+
+
+def load_embedding_model(model_path, backend=DEFAULT_EMBEDDING_BACKEND):
+    """
+    按后端加载BERT模型
+    参数:
+        model_path (str): 本地BERT模型目录
+        backend (str): 嵌入计算后端，见 EMBEDDING_BACKENDS
+    返回:
+        BertModel 或 OnnxBertModel: 处于评估模式的模型
+    """
+    if backend in ('onnx', 'onnx-int8'):
+        return OnnxBertModel(model_path, quantize=backend == 'onnx-int8')
+    model = BertModel.from_pretrained(model_path)
     model.eval()  # 设置模型为评估模式
+    if backend == 'torch-int8':
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+class EmbeddingEngine:
+    """
+    常驻进程的BERT嵌入引擎
+    首次需要时才加载模型和分词器，之后在多次切分任务之间保持常驻，避免每个文件都重新加载模型
+    """
+
+    def __init__(self, model_path='./bert-base-chinese', cache_dir=None, cache_size=100000, cache_read_only=False,
+                 backend=DEFAULT_EMBEDDING_BACKEND):
+        """
+        参数:
+            model_path (str): 本地BERT模型目录
+            cache_dir (str): 句子嵌入磁盘缓存目录，为None时不使用缓存
+            cache_size (int): 磁盘缓存最多保存的句子数
+            cache_read_only (bool): 是否以只读模式打开磁盘缓存
+            backend (str): 嵌入计算后端，见 EMBEDDING_BACKENDS
+        """
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"不支持的嵌入后端: {backend}，可选 {', '.join(EMBEDDING_BACKENDS)}")
+        self.model_path = model_path
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.cache_read_only = cache_read_only
+        self.tokenizer = None
+        self.model = None
+        self.cache = None
+        self.load_time = 0.0          # 模型加载耗时（秒）
+        self.param_bytes = 0          # 模型参数占用的内存（字节）
+        self.rss_delta = 0            # 加载前后进程常驻内存的增量（字节）
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    def load(self):
+        """
+        懒加载模型与分词器（线程安全，只会真正加载一次）
+        返回:
+            EmbeddingEngine: 引擎自身，便于链式调用
+        """
+        if self.model is not None:
+            return self
+        with self._lock:
+            if self.model is None:
+                process = psutil.Process(os.getpid())
+                rss_before = process.memory_info().rss
+                start = time.perf_counter()
+                tokenizer = BertTokenizer.from_pretrained(self.model_path)
+                model = load_embedding_model(self.model_path, self.backend)
+                self.load_time = time.perf_counter() - start
+                self.param_bytes = _model_bytes(model)
+                self.rss_delta = process.memory_info().rss - rss_before
+                self.tokenizer = tokenizer
+                self.model = model
+                print(f"BERT模型已加载: {self.model_path}（{self.backend}），耗时 {self.load_time:.2f} 秒，"
+                      f"参数内存 {self.param_bytes / 1024 ** 2:.1f} MB，进程内存增加 {self.rss_delta / 1024 ** 2:.1f} MB")
+        self.open_cache()
+        return self
+
+    def open_cache(self):
+        """
+        打开磁盘缓存（无需加载模型，嵌入维度从模型配置文件读取）
+        返回:
+            EmbeddingCache: 磁盘缓存，未配置缓存目录时为None
+        """
+        if self.cache is not None or not self.cache_dir:
+            return self.cache
+        with self._lock:
+            if self.cache is None:
+                with open(os.path.join(self.model_path, 'config.json'), 'r', encoding='utf-8') as file:
+                    hidden_size = json.load(file)['hidden_size']
+                # 非默认后端的嵌入与基准不同，使用各自的缓存子目录，避免与默认后端的缓存互相覆盖索引
+                cache_dir = self.cache_dir if self.backend == DEFAULT_EMBEDDING_BACKEND else os.path.join(self.cache_dir, self.backend)
+                self.cache = EmbeddingCache(cache_dir, self.model_id, hidden_size, self.cache_size,
+                                            read_only=self.cache_read_only)
+        return self.cache
+
+    @property
+    def model_id(self):
+        """
+        模型标识：模型目录名 + 配置文件与权重文件的摘要（非默认后端再加后端名），模型或后端更换后缓存自动失效
+        """
+        digest = hashlib.blake2b(digest_size=8)
+        for name in ('config.json', 'vocab.txt', 'pytorch_model.bin', 'model.safetensors'):
+            file_path = os.path.join(self.model_path, name)
+            if not os.path.exists(file_path):
+                continue
+            if name.endswith('.json') or name.endswith('.txt'):
+                with open(file_path, 'rb') as file:
+                    digest.update(file.read())
+            else:
+                digest.update(f"{name}:{os.path.getsize(file_path)}".encode('utf-8'))
+        model_id = f"{os.path.basename(os.path.normpath(self.model_path))}-{digest.hexdigest()}"
+        return model_id if self.backend == DEFAULT_EMBEDDING_BACKEND else f"{model_id}-{self.backend}"
+
+    def stats(self):
+        """
+        返回引擎的加载状态、加载耗时、内存占用与缓存命中情况
+        """
+        return {
+            'model_path': self.model_path,
+            'backend': self.backend,
+            'loaded': self.loaded,
+            'load_time': round(self.load_time, 3),
+            'param_bytes': self.param_bytes,
+            'rss_delta': self.rss_delta,
+            'cache': self.cache.stats() if self.cache is not None else None,
+        }
+
+    def embed_sentences(self, sentences, batch_size=32, progress_callback=None):
+        """
+        获取句子嵌入与token数，启用磁盘缓存时只对未命中的句子做BERT计算
+        启用缓存时，新计算的嵌入同样按float16取整后返回，保证首次运行与命中缓存时的切分结果一致
+        参数:
+            sentences (list): 句子列表
+            batch_size (int): 每批句子数量
+            progress_callback (function): 进度回调函数，用于报告进度
+        返回:
+            tuple: (形状为 (句子数, 隐藏层维度) 的嵌入矩阵, 每个句子的token数列表)，顺序与输入一致
+        """
+        self.load()
+        if self.cache is None:
+            return self._compute_embeddings(sentences, batch_size, progress_callback)
+
+        found, missing = self.cache.lookup(sentences)
+        EMBEDDING_CACHE.inc(len(found), result='hit')
+        EMBEDDING_CACHE.inc(len(missing), result='miss')
+        embeddings = np.zeros((len(sentences), self.model.config.hidden_size), dtype=np.float32)
+        token_counts = [0] * len(sentences)
+        for i, (embedding, count) in found.items():
+            embeddings[i] = embedding
+            token_counts[i] = count
+
+        if missing:
+            missing_sentences = [sentences[i] for i in missing]
+            hit_count = len(found)
+
+            def _offset_progress(processed, total, process_type):
+                progress_callback(hit_count + processed, hit_count + total, process_type)
+
+            computed, counts = self._compute_embeddings(missing_sentences, batch_size,
+                                                        _offset_progress if progress_callback else None)
+            computed = computed.astype(np.float16).astype(np.float32)
+            embeddings[missing] = computed
+            for i, count in zip(missing, counts):
+                token_counts[i] = count
+            self.cache.store(missing_sentences, computed, counts)
+            # 切分途中只按间隔写回，切分结束时由调用方通过 flush_cache 再写回一次
+            self.cache.flush(min_interval=CACHE_FLUSH_INTERVAL)
+        elif progress_callback:
+            progress_callback(len(sentences), len(sentences), "divider")
+
+        return embeddings, token_counts
+
+    def flush_cache(self):
+        """将磁盘缓存中尚未写回的嵌入写回磁盘，未启用缓存时不做任何事"""
+        if self.cache is not None:
+            self.cache.flush()
+
+    def _compute_embeddings(self, sentences, batch_size=32, progress_callback=None):
+        """
+        用BERT批量计算句子嵌入，并统计每个句子的token数
+        先按token长度排序分桶，再以带padding的批次前向计算，减少填充带来的无效计算
+        参数:
+            sentences (list): 句子列表
+            batch_size (int): 每批句子数量
+            progress_callback (function): 进度回调函数，用于报告进度
+        返回:
+            tuple: (形状为 (句子数, 隐藏层维度) 的嵌入矩阵, 每个句子的token数列表)，顺序与输入一致
+        """
+        hidden_size = self.model.config.hidden_size
+        embeddings = np.zeros((len(sentences), hidden_size), dtype=np.float32)
+        if not sentences:
+            return embeddings, []
+
+        # 只分词一次：不截断的结果用于统计token数，截断后的结果用于模型输入
+        token_ids = self.tokenizer(list(sentences), add_special_tokens=False, truncation=False)['input_ids']
+        token_counts = [len(ids) for ids in token_ids]
+        # 与逐句计算保持一致：截断到512个token（含[CLS]/[SEP]）
+        cls_id = self.tokenizer.cls_token_id
+        sep_id = self.tokenizer.sep_token_id
+        input_ids = [[cls_id] + ids[:510] + [sep_id] for ids in token_ids]
+        # 按长度排序，使同一批次内的句子长度相近
+        order = sorted(range(len(sentences)), key=lambda i: len(input_ids[i]))
+        pad_id = self.tokenizer.pad_token_id
+
+        for start in tqdm(range(0, len(order), batch_size), desc="句子嵌入进度", unit="批"):
+            batch = order[start:start + batch_size]
+            width = max(len(input_ids[i]) for i in batch)
+            ids = torch.full((len(batch), width), pad_id, dtype=torch.long)
+            mask = torch.zeros((len(batch), width), dtype=torch.long)
+            for row, i in enumerate(batch):
+                ids[row, :len(input_ids[i])] = torch.tensor(input_ids[i], dtype=torch.long)
+                mask[row, :len(input_ids[i])] = 1
+            with EMBEDDING_BATCH_SECONDS.time(), torch.no_grad():
+                outputs = self.model(input_ids=ids, attention_mask=mask, token_type_ids=torch.zeros_like(ids))
+            EMBEDDING_BATCH_SIZE.observe(len(batch))
+            # 只对有效token求平均，等价于逐句计算时的 last_hidden_state.mean(dim=1)
+            weights = mask.unsqueeze(-1).to(outputs.last_hidden_state.dtype)
+            pooled = (outputs.last_hidden_state * weights).sum(dim=1) / weights.sum(dim=1)
+            embeddings[batch] = pooled.numpy()
+
+            if progress_callback:
+                progress_callback(min(start + batch_size, len(order)), len(order), "divider")
+
+        return embeddings, token_counts
+
+
+# 进程内共享的嵌入引擎，按模型目录区分
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_embedding_engine(model_path='./bert-base-chinese', cache_dir=None, cache_size=100000,
+                         backend=DEFAULT_EMBEDDING_BACKEND):
+    """
+    获取进程内共享的嵌入引擎（同一模型目录、缓存目录和后端只创建一个实例）
+    参数:
+        model_path (str): 本地BERT模型目录
+        cache_dir (str): 句子嵌入磁盘缓存目录，为None时不使用缓存
+        cache_size (int): 磁盘缓存最多保存的句子数
+        backend (str): 嵌入计算后端，见 EMBEDDING_BACKENDS
+    返回:
+        EmbeddingEngine: 共享的嵌入引擎（尚未加载模型，首次使用时加载）
+    """
+    key = (os.path.realpath(model_path), os.path.realpath(cache_dir) if cache_dir else None, backend)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = EmbeddingEngine(model_path, cache_dir, cache_size, backend=backend)
+            _engines[key] = engine
+        return engine
 
+
+def split_sentences(text):
+    """
+    按句子切分文本，并完成与语义无关的预处理：跳过单一符号，将超短句与后面的句子合并
+    参数:
+        text (str): 输入的长文本
+    返回:
+        list: 参与语义比较的句子列表（第一句作为初始chunk）
+    """
     # 按句子分割文本（使用常见的中文标点符号）
     sentences = re.split(r'(。|！|？|；|\n)', text)
     # 重新组合句子和标点
@@ -53,22 +648,10 @@ def split_text_by_semantic(text, max_length, similarity_threshold=0.5, model_pat
     if not sentences:
         return []
 
-    chunks = []
-    current_chunk = sentences[0]
-    # 获取当前chunk的嵌入表示
-    current_embedding = get_sentence_embedding(current_chunk, model, tokenizer)
-
-    total_sentences = len(sentences) - 1  # 第一句已作为初始chunk
-    processed_sentences = 0
-
+    candidates = [sentences[0]]
     # 设定对于过于短小的句子或标题，自动与后面的句子放一起
     last_sentence = ""
-
-    # 使用 tqdm 包装迭代器，显示进度条
-    for sentence in tqdm(sentences[1:], desc="文本切分进度", unit="句"):
-        # 调用进度回调函数（如果提供）
-        if progress_callback:
-            progress_callback(processed_sentences, total_sentences, "divider")
+    for sentence in sentences[1:]:
         if last_sentence != "":
             sentence = last_sentence + sentence
             last_sentence = ""
@@ -79,50 +662,476 @@ def split_text_by_semantic(text, max_length, similarity_threshold=0.5, model_pat
         elif len(sentence.replace(" ","").replace("\n","")) <= 15:
             last_sentence = sentence
             continue
+        candidates.append(sentence)
+    return candidates
 
-        # 获取当前句子的嵌入表示
-        sentence_embedding = get_sentence_embedding(sentence, model, tokenizer)
-        # 计算当前chunk和当前句子的余弦相似度
-        similarity = 1 - cosine(current_embedding, sentence_embedding)
 
-        # 如果相似度高于阈值且合并后不超过最大长度，则合并
-        if similarity > similarity_threshold and len(tokenizer.tokenize(current_chunk + sentence)) <= max_length:
-            current_chunk += sentence
-            # 更新当前chunk的嵌入表示 (简单平均)
-            current_embedding = (current_embedding + sentence_embedding) / 2
-        else:
-            # 否则，保存当前chunk并开始新的chunk
-            chunks.append(current_chunk)
-            current_chunk = sentence
-            current_embedding = sentence_embedding
-
-        processed_sentences += 1
-
-    # 添加最后一个chunk
-    if current_chunk:
-        chunks.append(current_chunk)
-
-    # 循环遍历分段，对于过于短小的分段，与后续分段一起合并
-    _last_chunk = ""
-    chunks2 = []
-    for _chunk in chunks:
-        if _last_chunk != "":
-            _chunk = _last_chunk + _chunk
-            _last_chunk = ""
-        if len(_chunk) <= 20:
-            _last_chunk = _chunk
-            continue
-        else:
-            chunks2.append(_chunk)
-    chunks = chunks2
+class SimilarityMerger:
+    """
+    按语义相似度顺序合并句子的状态机，可分多次输入句子（流式切分），结果与一次性输入全部句子相同
+    每个句子都以切分标点或换行结尾，拼接处不会产生跨句的子词，因此文本块的token数等于各句token数之和，
+    合并时只需维护一个累加的token计数，无需重新对整个文本块分词
+    with_embeddings 为 True 时同时累加按token数加权的句子嵌入之和，文本块以 (文本, 加权嵌入和, token数) 的形式返回，
+    文本块嵌入（见 chunk_items_to_arrays）直接由切分时的句子嵌入得到，无需再次查询缓存或计算BERT前向
+    """
+
+    def __init__(self, max_length, similarity_threshold, with_embeddings=False):
+        """
+        参数:
+            max_length (int): 每个文本块的最大长度（以BERT分词器的token为单位）
+            similarity_threshold (float): 语义相似度阈值
+            with_embeddings (bool): 是否同时返回文本块的加权嵌入和
+        """
+        self.max_length = max_length
+        self.similarity_threshold = similarity_threshold
+        self.with_embeddings = with_embeddings
+        self.current_chunk = None
+        self.current_embedding = None
+        self.current_sq_norm = 0.0
+        self.current_tokens = 0
+        self.current_sum = None
+
+    def _emit(self):
+        """当前文本块（with_embeddings 时附带加权嵌入和与token数）"""
+        if self.with_embeddings:
+            return self.current_chunk, self.current_sum, self.current_tokens
+        return self.current_chunk
+
+    def _start(self, sentence, embedding, sq_norm, tokens):
+        """以一个句子开始新的文本块"""
+        self.current_chunk = sentence
+        self.current_embedding = embedding
+        self.current_sq_norm = sq_norm
+        self.current_tokens = tokens
+        if self.with_embeddings:
+            self.current_sum = np.asarray(embedding, dtype=np.float64) * tokens
+
+    def feed(self, sentences, embeddings, token_counts):
+        """
+        输入一批句子及其嵌入
+        返回:
+            list: 本批次中已经确定边界的文本块
+        """
+        chunks = []
+        if not sentences:
+            return chunks
+        # 预先计算每个句子嵌入的平方范数
+        sq_norms = np.einsum('ij,ij->i', embeddings, embeddings)
+
+        start = 0
+        if self.current_chunk is None:
+            self._start(sentences[0], embeddings[0], float(sq_norms[0]), token_counts[0])
+            start = 1
+
+        for i in range(start, len(sentences)):
+            sentence = sentences[i]
+            sentence_embedding = embeddings[i]
+            # 计算当前chunk和当前句子的余弦相似度
+            denom = math.sqrt(self.current_sq_norm * float(sq_norms[i]))
+            similarity = float(np.dot(self.current_embedding, sentence_embedding)) / denom if denom > 0 else 0.0
+
+            # 如果相似度高于阈值且合并后不超过最大长度，则合并
+            if similarity > self.similarity_threshold and self.current_tokens + token_counts[i] <= self.max_length:
+                self.current_chunk += sentence
+                self.current_tokens += token_counts[i]
+                if self.with_embeddings:
+                    self.current_sum += sentence_embedding * token_counts[i]
+                # 更新当前chunk的嵌入表示 (简单平均)
+                self.current_embedding = (self.current_embedding + sentence_embedding) / 2
+                self.current_sq_norm = float(np.dot(self.current_embedding, self.current_embedding))
+            else:
+                # 否则，保存当前chunk并开始新的chunk
+                chunks.append(self._emit())
+                self._start(sentence, sentence_embedding, float(sq_norms[i]), token_counts[i])
+        return chunks
+
+    def finish(self):
+        """返回最后一个文本块"""
+        chunks = [self._emit()] if self.current_chunk else []
+        self.current_chunk = None
+        return chunks
+
+
+def merge_by_similarity(sentences, embeddings, token_counts, max_length, similarity_threshold):
+    """
+    基于预先计算好的嵌入矩阵，按语义相似度合并句子
+    参数:
+        sentences (list): split_sentences 返回的句子列表
+        embeddings (numpy.ndarray): 与句子一一对应的嵌入矩阵
+        token_counts (list): 与句子一一对应的token数
+        max_length (int): 每个文本块的最大长度（以BERT分词器的token为单位）
+        similarity_threshold (float): 语义相似度阈值
+    返回:
+        list: 合并后的文本块列表
+    """
+    merger = SimilarityMerger(max_length, similarity_threshold)
+    return merger.feed(sentences, embeddings, token_counts) + merger.finish()
+
+
+class ShortChunkMerger:
+    """
+    将过于短小的分段与后续分段合并的状态机，可分多次输入分段
+    分段也可以是 SimilarityMerger(with_embeddings=True) 返回的 (文本, 加权嵌入和, token数)，合并时一并累加
+    """
+
+    def __init__(self):
+        self._last_chunk = None
+
+    def feed(self, chunks):
+        chunks2 = []
+        for _chunk in chunks:
+            if self._last_chunk is not None:
+                if isinstance(_chunk, tuple):
+                    _chunk = (self._last_chunk[0] + _chunk[0], self._last_chunk[1] + _chunk[1],
+                              self._last_chunk[2] + _chunk[2])
+                else:
+                    _chunk = self._last_chunk + _chunk
+                self._last_chunk = None
+            text = _chunk[0] if isinstance(_chunk, tuple) else _chunk
+            if len(text) <= 20:
+                self._last_chunk = _chunk
+                continue
+            else:
+                chunks2.append(_chunk)
+        return chunks2
+
+
+def merge_short_chunks(chunks):
+    """
+    循环遍历分段，对于过于短小的分段，与后续分段一起合并
+    参数:
+        chunks (list): 文本块列表
+    返回:
+        list: 合并短分段后的文本块列表
+    """
+    return ShortChunkMerger().feed(chunks)
+
+
+def split_text_by_semantic(text, max_length, similarity_threshold=0.5, model_path='./bert-base-chinese', progress_callback=None, engine=None, batch_size=32,
+                           with_embeddings=False):
+    """
+    基于语义相似度对文本进行分块
+    分两个阶段进行：先批量计算所有候选句子的嵌入，再在嵌入矩阵上按顺序做合并/切分判断
+    参数:
+        text (str): 输入的长文本
+        max_length (int): 每个文本块的最大长度（以BERT分词器的token为单位）
+        similarity_threshold (float): 语义相似度阈值，默认为0.79
+        model_path (str): 本地BERT模型目录，未指定engine时用于获取共享引擎
+        progress_callback (function): 进度回调函数，用于报告进度
+        engine (EmbeddingEngine): 常驻的嵌入引擎，默认使用model_path对应的共享引擎
+        batch_size (int): 批量计算句子嵌入时每批的句子数量
+        with_embeddings (bool): 是否同时返回文本块嵌入（块内句子嵌入按token数加权平均）
+    返回:
+        list: 分割后的文本块列表；with_embeddings 为 True 时返回 (文本块列表, 文本块嵌入矩阵)
+    """
+    # 从常驻引擎获取BERT模型和分词器（首次使用时加载）
+    if engine is None:
+        engine = get_embedding_engine(model_path)
+    engine.load()
+
+    sentences = split_sentences(text)
+    SENTENCES.inc(len(sentences))
+    if not sentences:
+        return ([], np.zeros((0, engine.model.config.hidden_size), dtype=np.float32)) if with_embeddings else []
+
+    # 第一阶段：批量计算全部候选句子的嵌入
+    embeddings, token_counts = engine.embed_sentences(sentences, batch_size=batch_size, progress_callback=progress_callback)
+    engine.flush_cache()
+    # 第二阶段：在嵌入矩阵上按语义相似度合并
+    merger = SimilarityMerger(max_length, similarity_threshold, with_embeddings)
+    chunks = merge_short_chunks(merger.feed(sentences, embeddings, token_counts) + merger.finish())
 
     # 完成时报告100%进度
     if progress_callback:
-        progress_callback(total_sentences, total_sentences, "divider")
+        progress_callback(len(sentences), len(sentences), "divider")
 
+    if with_embeddings:
+        return chunk_items_to_arrays(chunks, embeddings.shape[1])
     return chunks
 
 
+def chunk_items_to_arrays(items, dim):
+    """
+    把 SimilarityMerger(with_embeddings=True) 产出的文本块拆成文本列表与文本块嵌入矩阵
+    文本块嵌入为块内各句子嵌入按token数加权的平均值
+    参数:
+        items (list): (文本, 加权嵌入和, token数) 列表
+        dim (int): 嵌入维度
+    返回:
+        tuple: (文本块列表, 形状为 (文本块数, dim) 的嵌入矩阵)
+    """
+    chunks = [item[0] for item in items]
+    result = np.zeros((len(items), dim), dtype=np.float32)
+    for i, (_, weighted_sum, tokens) in enumerate(items):
+        if tokens > 0:
+            result[i] = weighted_sum / tokens
+    return chunks, result
+
+
+def iter_split_text(text, max_length, similarity_threshold=0.5, model_path='./bert-base-chinese', progress_callback=None,
+                    engine=None, batch_size=32, window=1024, with_embeddings=False):
+    """
+    流式语义切分：每次只计算 window 个句子的嵌入，边界已确定的文本块立即产出，
+    下游（例如生成阶段）无需等待整个文件切分完成；切分规则与 split_text_by_semantic 相同
+    参数:
+        window (int): 每批计算嵌入的句子数，其余参数见 split_text_by_semantic
+    返回:
+        generator: 每次产出一批已确定的文本块（列表）；with_embeddings 为 True 时产出 (文本块列表, 文本块嵌入矩阵)
+    """
+    if engine is None:
+        engine = get_embedding_engine(model_path)
+    engine.load()
+
+    sentences = split_sentences(text)
+    SENTENCES.inc(len(sentences))
+    merger = SimilarityMerger(max_length, similarity_threshold, with_embeddings)
+    short_merger = ShortChunkMerger()
+
+    def _output(chunks):
+        return chunk_items_to_arrays(chunks, engine.model.config.hidden_size) if with_embeddings else chunks
+
+    try:
+        for start in range(0, len(sentences), window):
+            part = sentences[start:start + window]
+
+            def _offset_progress(processed, total, process_type):
+                progress_callback(start + processed, len(sentences), process_type)
+
+            embeddings, token_counts = engine.embed_sentences(part, batch_size=batch_size,
+                                                              progress_callback=_offset_progress if progress_callback else None)
+            chunks = short_merger.feed(merger.feed(part, embeddings, token_counts))
+            if chunks:
+                yield _output(chunks)
+    finally:
+        # 提前关闭生成器时也写回已计算的嵌入
+        engine.flush_cache()
+    chunks = short_merger.feed(merger.finish())
+    if chunks:
+        yield _output(chunks)
+
+
+def sweep_parameters(text, params, model_path='./bert-base-chinese', engine=None, batch_size=32, bins=10, progress_callback=None):
+    """
+    参数扫描：对同一文档只计算一次句子嵌入，再分别按多组 (相似度阈值, 最大长度) 切分并统计结果
+    参数:
+        text (str): 输入的长文本
+        params (list): (similarity_threshold, max_length) 参数对列表
+        model_path (str): 本地BERT模型目录，未指定engine时用于获取共享引擎
+        engine (EmbeddingEngine): 常驻的嵌入引擎，默认使用model_path对应的共享引擎
+        batch_size (int): 批量计算句子嵌入时每批的句子数量
+        bins (int): 文本块长度直方图的分箱数，至少为1
+        progress_callback (function): 进度回调函数，用于报告嵌入计算进度
+    返回:
+        list: 每组参数对应的切分统计，包含文本块数量、文本块长度（字符数）的最小/最大/平均值与直方图；
+              max_length 为请求的参数，实际最长的文本块为 max_chunk_length
+    """
+    if bins < 1:
+        raise ValueError(f"直方图分箱数必须至少为1: {bins}")
+    if engine is None:
+        engine = get_embedding_engine(model_path)
+
+    sentences = split_sentences(text)
+    embeddings, token_counts = engine.embed_sentences(sentences, batch_size=batch_size, progress_callback=progress_callback)
+    engine.flush_cache()
+
+    results = []
+    for similarity_threshold, max_length in params:
+        chunks = merge_by_similarity(sentences, embeddings, token_counts, int(max_length), float(similarity_threshold))
+        chunks = merge_short_chunks(chunks)
+        lengths = np.array([len(chunk) for chunk in chunks], dtype=np.int64)
+        if lengths.size:
+            counts, edges = np.histogram(lengths, bins=bins)
+            summary = {
+                'min_chunk_length': int(lengths.min()),
+                'max_chunk_length': int(lengths.max()),
+                'mean_chunk_length': round(float(lengths.mean()), 1),
+            }
+        else:
+            counts, edges = np.zeros(0, dtype=np.int64), np.zeros(0)
+            summary = {'min_chunk_length': 0, 'max_chunk_length': 0, 'mean_chunk_length': 0.0}
+        results.append({
+            'similarity_threshold': float(similarity_threshold),
+            'max_length': int(max_length),
+            'chunk_count': len(chunks),
+            'length_histogram': {
+                'counts': counts.tolist(),
+                'bin_edges': [round(float(edge), 1) for edge in edges],
+            },
+            **summary,
+        })
+    return results
+
+
+# 多进程切分时子进程内常驻的嵌入引擎与进度队列
+_worker_engine = None
+_worker_progress_queue = None
+
+
+def _init_chunk_worker(model_path, cache_dir, cache_size, num_threads, progress_queue, backend=DEFAULT_EMBEDDING_BACKEND):
+    """
+    切分子进程初始化：限制torch线程数避免各进程争抢CPU核心，并在进程内加载一次模型
+    """
+    global _worker_engine, _worker_progress_queue
+    torch.set_num_threads(num_threads)
+    _worker_engine = EmbeddingEngine(model_path, cache_dir, cache_size, cache_read_only=True, backend=backend)
+    _worker_engine.load()
+    _worker_progress_queue = progress_queue
+
+
+def _chunk_file_worker(file_index, file_path, max_length, similarity_threshold, batch_size, with_embeddings=False):
+    """
+    在子进程中切分单个文件
+    返回:
+        tuple: (文件下标, 文本块列表, 文本块嵌入（未请求时为None）, 待写入主进程缓存的嵌入条目, 子进程的指标增量)
+    """
+    def _report(processed, total, process_type):
+        _worker_progress_queue.put((file_index, processed, total))
+
+    long_text = read_text_file(file_path)
+    result = split_text_by_semantic(long_text, max_length, similarity_threshold, progress_callback=_report,
+                                    engine=_worker_engine, batch_size=batch_size, with_embeddings=with_embeddings)
+    chunks, embeddings = result if with_embeddings else (result, None)
+    pending = _worker_engine.cache.drain_pending() if _worker_engine.cache is not None else []
+    return file_index, chunks, embeddings, pending, Metrics.REGISTRY.drain()
+
+
+def iter_completed(executor, calls, poll_interval=0.2):
+    """
+    把任务提交到 executor，每隔 poll_interval 秒（或有任务完成时）产出这段时间内完成的结果
+    生成器被提前关闭或某个任务抛出异常时，取消全部尚未开始的任务，调用方退出 executor 时不必等待它们执行完
+    参数:
+        executor (Executor): 进程池或线程池
+        calls (list): (函数, 参数元组) 列表，按顺序提交
+        poll_interval (float): 没有任务完成时最长的等待时间（秒），调用方可借此定期处理进度
+    返回:
+        generator: 每次产出一个结果列表（可能为空）
+    """
+    pending = {executor.submit(function, *args) for function, args in calls}
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            yield [future.result() for future in done]
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def iter_split_files(file_paths, max_length, similarity_threshold=0.5, model_path='./bert-base-chinese',
+                     progress_callback=None, workers=None, batch_size=32, cache_dir=None, cache_size=100000,
+                     with_embeddings=False, backend=DEFAULT_EMBEDDING_BACKEND):
+    """
+    切分多个文件，文本块一经产生立即产出，供下游流水线边切分边处理
+    多进程时每个文件切分完成后产出该文件的全部文本块；单进程时按句子窗口流式产出（见 iter_split_text）
+    参数与 split_files_parallel 相同；with_embeddings 为 True 时同时产出文本块嵌入（块内句子嵌入按token数加权平均），
+    在切分的同时由切分时的句子嵌入累加得到
+    返回:
+        generator: (文件下标, 文本块列表, 文本块嵌入或None)，同一文件可能分多次产出，同一文件内的顺序与原文一致
+    """
+    if not file_paths:
+        return
+    cpu_count = os.cpu_count() or 1
+    if workers is None:
+        workers = max(1, min(len(file_paths), cpu_count // 4))
+    workers = max(1, min(workers, len(file_paths)))
+
+    if workers == 1:
+        engine = get_embedding_engine(model_path, cache_dir, cache_size, backend)
+        for file_index, path in enumerate(file_paths):
+            for result in iter_split_text(read_text_file(path), max_length, similarity_threshold,
+                                          progress_callback=progress_callback, engine=engine, batch_size=batch_size,
+                                          with_embeddings=with_embeddings):
+                chunks, embeddings = result if with_embeddings else (result, None)
+                CHUNKS.inc(len(chunks))
+                yield file_index, chunks, embeddings
+        return
+
+    sizes = [max(os.path.getsize(path), 1) for path in file_paths]
+    total_size = sum(sizes)
+    # 每个文件的完成比例，按文件大小加权合并为总进度
+    fractions = [0.0] * len(file_paths)
+    cache_entries = []
+
+    def _report():
+        if progress_callback:
+            done = sum(fraction * size for fraction, size in zip(fractions, sizes))
+            progress_callback(int(done), total_size, "divider")
+
+    # ONNX模型在启动子进程前导出，避免多个子进程同时导出
+    if backend in ('onnx', 'onnx-int8'):
+        export_onnx(model_path, quantize=backend == 'onnx-int8')
+    # 使用spawn启动子进程，避免fork已加载torch的父进程带来的线程死锁
+    ctx = multiprocessing.get_context('spawn')
+    progress_queue = ctx.Queue()
+    num_threads = max(1, cpu_count // workers)
+    # 缓存对象在进程内按目录共享：子进程运行期间，其他任务（以及本任务结束后）的写入不会淘汰子进程正在读取的槽位
+    cache = get_embedding_engine(model_path, cache_dir, cache_size, backend).open_cache() if cache_dir else None
+    if cache is not None:
+        cache.pin()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_chunk_worker,
+                                 initargs=(model_path, cache_dir, cache_size, num_threads, progress_queue,
+                                           backend)) as executor:
+            # 大文件优先分发，减少最后只剩一个大文件在跑的长尾
+            order = sorted(range(len(file_paths)), key=lambda i: sizes[i], reverse=True)
+            calls = [(_chunk_file_worker, (i, file_paths[i], max_length, similarity_threshold, batch_size,
+                                           with_embeddings))
+                     for i in order]
+            # 下游停止读取（生成器被关闭）或子进程出错时取消尚未开始的文件，退出进程池时只等待正在切分的文件
+            with closing(iter_completed(executor, calls)) as batches:
+                for results in batches:
+                    while not progress_queue.empty():
+                        file_index, processed, total = progress_queue.get()
+                        if total > 0:
+                            fractions[file_index] = processed / total
+                    finished = []
+                    for file_index, chunks, embeddings, entries, metrics in results:
+                        fractions[file_index] = 1.0
+                        cache_entries.extend(entries)
+                        Metrics.REGISTRY.merge(metrics)
+                        CHUNKS.inc(len(chunks))
+                        finished.append((file_index, chunks, embeddings))
+                    _report()
+                    yield from finished
+    finally:
+        if cache is not None:
+            cache.unpin()
+
+    # 所有子进程结束后再写缓存；其他任务的子进程若仍在运行，这次写入只使用空闲槽位
+    if cache_entries:
+        cache.store([entry[0] for entry in cache_entries], [entry[1] for entry in cache_entries],
+                    [entry[2] for entry in cache_entries])
+        cache.flush()
+
+
+def split_files_parallel(file_paths, max_length, similarity_threshold=0.5, model_path='./bert-base-chinese',
+                         progress_callback=None, workers=None, batch_size=32, cache_dir=None, cache_size=100000,
+                         backend=DEFAULT_EMBEDDING_BACKEND):
+    """
+    使用进程池并行切分多个文件
+    每个子进程只加载一次模型，文件按大小从大到小分发，各子进程的进度合并后通过 progress_callback 统一报告；
+    子进程以只读方式使用磁盘缓存，新计算的嵌入在全部文件切分完成后由主进程写入缓存
+    参数:
+        file_paths (list): 待切分的文件路径列表
+        max_length (int): 每个文本块的最大长度（以BERT分词器的token为单位）
+        similarity_threshold (float): 语义相似度阈值
+        model_path (str): 本地BERT模型目录
+        progress_callback (function): 进度回调函数，用于报告进度
+        workers (int): 子进程数量，默认按CPU核心数自动选择；为1时在当前进程内使用共享引擎顺序切分
+        batch_size (int): 批量计算句子嵌入时每批的句子数量
+        cache_dir (str): 句子嵌入磁盘缓存目录，为None时不使用缓存
+        cache_size (int): 磁盘缓存最多保存的句子数
+        backend (str): 嵌入计算后端，见 EMBEDDING_BACKENDS
+    返回:
+        list: 与 file_paths 一一对应的文本块列表
+    """
+    results = [[] for _ in file_paths]
+    for file_index, chunks, _ in iter_split_files(file_paths, max_length, similarity_threshold, model_path,
+                                                  progress_callback, workers, batch_size, cache_dir, cache_size,
+                                                  backend=backend):
+        results[file_index].extend(chunks)
+    return results
+
+
 def read_text_file(file_path):
     """
     读取文本文件
@@ -167,9 +1176,12 @@ if __name__ == "__main__":
     max_length = 2048                   # 可根据需要调整
     similarity_threshold = 0.5          # 可根据需要调整
 
+    # 使用常驻的嵌入引擎
+    engine = get_embedding_engine('./bert-base-chinese', cache_dir='./embedding_cache')
+
     print("开始文本切分...")
     # 分割长文本
-    text_chunks = split_text_by_semantic(long_text, max_length, similarity_threshold)
+    text_chunks = split_text_by_semantic(long_text, max_length, similarity_threshold, engine=engine)
     print(f"文本切分完成，共生成 {len(text_chunks)} 个文本块。")
 
     # 保存分割后的文本块到指定目录
@@ -1,41 +1,16 @@
 # AI输出数据转化为标准化训练集
-import json
-import pandas as pd
+import pyarrow.parquet as pq
 from rich import print
+from DatasetExporter import export_dataset
 
 
-# 加载本地Parquet数据集
 parquet_file_path = './mnt/instruction_dataset.parquet'
-dataset = pd.read_parquet(parquet_file_path)
 
-# 打印数据集的列名以验证
-print("Dataset Columns:", dataset.columns)
+# 打印数据集的列名与行数以验证（只读取文件尾部的元数据，数据只在导出时读取一次）
+metadata = pq.ParquetFile(parquet_file_path).metadata
+print("Dataset Columns:", metadata.schema.names, "Rows:", metadata.num_rows)
 
-# 将数据集转换为字典列表
-json_data = dataset.to_dict(orient='list')
+# 逐批转换为Alpaca格式并流式保存（不划分训练集和测试集，按原顺序写出）
+files = export_dataset(parquet_file_path, "./generated_data", formats=('alpaca',), splits=('all',))
 
-# 打印第一行以验证
-print("First Row:", {key: json_data[key][0] for key in json_data})
-
-# 初始化列表以存储Alpaca格式数据
-alpaca_data = []
-
-# 处理数据集中的每个条目
-for i in range(len(json_data['instruction'])):
-    instruction = json_data['instruction'][i]
-    input_text = json_data['input'][i]
-    original_output = json_data['output'][i]
-
-    # 创建Alpaca格式条目
-    alpaca_entry = {
-        "instruction": instruction,
-        "input": input_text,
-        "output": original_output
-    }
-    alpaca_data.append(alpaca_entry)
-
-# 以Alpaca格式保存
-with open("./generated_data/alpaca_dataset.json", "w") as file:
-    json.dump(alpaca_data, file, indent=4)
-
-print("Alpaca format dataset saved as 'alpaca_dataset.json'")
+print(f"Alpaca format dataset saved as '{files[('alpaca', 'all')]}'")
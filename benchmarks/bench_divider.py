@@ -0,0 +1,92 @@
+# 语义切分性能对比：逐句计算嵌入（旧实现） vs 批量计算嵌入（两阶段实现）
+import argparse
+import os
+import random
+import sys
+import time
+
+from scipy.spatial.distance import cosine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import TextDivider  # noqa: E402
+
+
+def legacy_split(text, max_length, similarity_threshold, engine):
+    """
+    旧实现：每个句子单独做一次BERT前向计算，并用scipy逐句计算余弦相似度
+    返回:
+        tuple: (文本块列表, 参与嵌入计算的句子数)
+    """
+    engine.load()
+    sentences = TextDivider.split_sentences(text)
+    if not sentences:
+        return [], 0
+
+    chunks = []
+    current_chunk = sentences[0]
+    current_embedding = TextDivider.get_sentence_embedding(current_chunk, engine.model, engine.tokenizer)
+    for sentence in sentences[1:]:
+        sentence_embedding = TextDivider.get_sentence_embedding(sentence, engine.model, engine.tokenizer)
+        similarity = 1 - cosine(current_embedding, sentence_embedding)
+        if similarity > similarity_threshold and len(engine.tokenizer.tokenize(current_chunk + sentence)) <= max_length:
+            current_chunk += sentence
+            current_embedding = (current_embedding + sentence_embedding) / 2
+        else:
+            chunks.append(current_chunk)
+            current_chunk = sentence
+            current_embedding = sentence_embedding
+    if current_chunk:
+        chunks.append(current_chunk)
+    return TextDivider.merge_short_chunks(chunks), len(sentences)
+
+
+def synthetic_text(num_sentences, seed=42):
+    """
+    生成指定句数的合成中文文本
+    """
+    rng = random.Random(seed)
+    topics = ["机器学习", "古典诗词", "城市交通", "气候变化", "中医药", "航天工程", "宋代历史", "金融市场"]
+    verbs = ["推动了", "改变了", "影响着", "促进了", "揭示了", "重塑了"]
+    objects = ["社会的发展方向", "人们的日常生活", "相关领域的研究方法", "产业结构的演变", "公众对未来的认知"]
+    puncts = ["。", "！", "？", "；", "。\n"]
+    parts = []
+    for _ in range(num_sentences):
+        topic = rng.choice(topics)
+        parts.append(f"近年来{topic}的快速进步{rng.choice(verbs)}{rng.choice(objects)}，"
+                     f"这一点在{rng.choice(topics)}的讨论中尤为明显{rng.choice(puncts)}")
+    return "".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="语义切分吞吐量对比")
+    parser.add_argument("--input", help="输入文本文件，不指定时使用合成文本")
+    parser.add_argument("--sentences", type=int, default=2000, help="合成文本的句子数")
+    parser.add_argument("--model-path", default="./bert-base-chinese")
+    parser.add_argument("--max-length", type=int, default=2048)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    text = TextDivider.read_text_file(args.input) if args.input else synthetic_text(args.sentences)
+    engine = TextDivider.get_embedding_engine(args.model_path)
+    engine.load()
+    num_sentences = len(TextDivider.split_sentences(text))
+
+    start = time.perf_counter()
+    legacy_chunks, _ = legacy_split(text, args.max_length, args.threshold, engine)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched_chunks = TextDivider.split_text_by_semantic(text, args.max_length, args.threshold,
+                                                        engine=engine, batch_size=args.batch_size)
+    batched_time = time.perf_counter() - start
+
+    print(f"句子数: {num_sentences}")
+    print(f"逐句计算: {legacy_time:.2f} 秒，{num_sentences / legacy_time:.1f} 句/秒，{len(legacy_chunks)} 个文本块")
+    print(f"批量计算: {batched_time:.2f} 秒，{num_sentences / batched_time:.1f} 句/秒，{len(batched_chunks)} 个文本块")
+    print(f"加速比: {legacy_time / batched_time:.2f}x")
+    print(f"切分边界一致: {legacy_chunks == batched_chunks}")
+
+
+if __name__ == "__main__":
+    main()
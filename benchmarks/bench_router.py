@@ -0,0 +1,66 @@
+# 多后端路由吞吐测试：在 1、2、4 台模拟推理主机上运行异步生成引擎，观察吞吐是否随主机数线性增长，
+# 并验证某台主机宕机时请求自动转移到其他主机
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+import AIWorker  # noqa: E402
+import GenerationEngine  # noqa: E402
+from fake_llm_server import start_server  # noqa: E402
+
+
+def run(specs, texts, entries_per_chunk, batch, max_in_flight):
+    """
+    使用给定的后端配置生成条目
+    返回:
+        tuple: (条目数, 耗时（秒）)
+    """
+    AIWorker.LLM_BACKENDS = specs
+    start = time.perf_counter()
+    entries = GenerationEngine.generate_texts_async(texts, entries_per_chunk, max_in_flight=max_in_flight,
+                                                    model="fake-model", batch=batch)
+    return len(entries), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多后端路由吞吐测试")
+    parser.add_argument("--hosts", type=int, nargs="+", default=[1, 2, 4], help="依次测试的主机数")
+    parser.add_argument("--chunks", type=int, default=64, help="文本块数")
+    parser.add_argument("--entries", type=int, default=5, help="每个文本块的条目数")
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟主机处理单个请求的时间（秒）")
+    parser.add_argument("--slots", type=int, default=4, help="每台模拟主机同时处理的请求数")
+    parser.add_argument("--kind", choices=["ollama", "openai"], default="ollama", help="后端接口类型")
+    parser.add_argument("--no-batch", action="store_true", help="每个条目单独请求")
+    args = parser.parse_args()
+
+    texts = [f"第{i}段测试文本。" * 20 for i in range(args.chunks)]
+    servers = [start_server(latency=args.latency, slots=args.slots) for _ in range(max(args.hosts))]
+
+    def _specs(count):
+        suffix = "/v1" if args.kind == "openai" else ""
+        return [{'type': args.kind, 'url': server.url + suffix, 'max_in_flight': args.slots}
+                for server in servers[:count]]
+
+    baseline = None
+    for count in args.hosts:
+        entries, elapsed = run(_specs(count), texts, args.entries, not args.no_batch, args.slots)
+        throughput = entries / elapsed
+        baseline = baseline or throughput / count
+        print(f"{count} 台主机: {entries} 个条目，{elapsed:.2f} 秒，{throughput:.1f} 条/秒，"
+              f"线性扩展效率 {throughput / (baseline * count):.0%}")
+
+    # 故障转移：一台主机宕机，全部条目仍应生成成功
+    if len(servers) > 1:
+        servers[0].down = True
+        entries, elapsed = run(_specs(len(servers)), texts, args.entries, not args.no_batch, args.slots)
+        print(f"1 台主机宕机: {entries}/{args.chunks * args.entries} 个条目，{elapsed:.2f} 秒")
+
+    for server in servers:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
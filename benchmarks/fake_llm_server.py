@@ -0,0 +1,178 @@
+# 模拟推理服务：同时提供Ollama（/api/chat）与OpenAI兼容（/v1/chat/completions）接口，用于在没有GPU的机器上
+# 测试多后端路由、熔断与生成吞吐；每台模拟主机只有固定数量的“GPU槽位”，吞吐受槽位数、单次请求延迟与输出速度限制
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    """
+    模拟推理主机
+    参数:
+        latency (float): 每个请求占用槽位的固定时间（秒），相当于预填充耗时
+        slots (int): 同时处理的请求数，超出的请求排队
+        token_rate (float): 每个槽位的输出速度（token/秒），请求额外占用 输出token数/token_rate 秒，为0时不模拟输出耗时
+        fail_rate (float): 以 HTTP 500 失败的请求比例
+        model (str): /api/tags 与 /v1/models 返回的模型名
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.05, slots=4, fail_rate=0.0, model='fake-model',
+                 token_rate=0.0):
+        super().__init__(address, FakeLLMHandler)
+        self.latency = latency
+        self.token_rate = token_rate
+        self.fail_rate = fail_rate
+        self.model = model
+        self.slots = threading.Semaphore(slots)
+        self.requests = 0
+        self.down = False           # 为True时所有请求返回 503，用于模拟主机宕机
+        self.error_status = None    # 不为None时对话请求都以该HTTP状态码失败，用于测试故障转移
+        self.in_flight = 0
+        self.peak_in_flight = 0     # 同时处理的对话请求数的峰值，用于检查在途上限
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_id(self):
+        with self._lock:
+            self.requests += 1
+            return next(self._counter)
+
+    def reply(self, messages, schema):
+        """按请求的JSON Schema生成回复：批量请求返回 minItems 个条目，单条请求返回一个条目"""
+        request_id = self.next_id()
+        prompt = messages[-1]['content'] if messages else ''
+        rng = random.Random(request_id)
+
+        def _entry(i):
+            words = ''.join(rng.choice('天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏') for _ in range(24))
+            return {'instruction': f"问题{request_id}-{i}：{words}？", 'input': '',
+                    'output': f"回答{request_id}-{i}：{words[::-1]}。（原文长度 {len(prompt)}）"}
+
+        entries_schema = (schema or {}).get('properties', {}).get('entries')
+        if entries_schema:
+            return json.dumps({'entries': [_entry(i) for i in range(entries_schema.get('minItems', 1))]},
+                              ensure_ascii=False)
+        return json.dumps(_entry(0), ensure_ascii=False)
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        server = self.server
+        if server.down:
+            return self._send(503, {'error': 'unavailable'})
+        if self.path == '/api/tags':
+            return self._send(200, {'models': [{'name': server.model, 'model': server.model}]})
+        if self.path == '/v1/models':
+            return self._send(200, {'object': 'list', 'data': [{'id': server.model, 'object': 'model'}]})
+        self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        server = self.server
+        request = self._read_json()
+        if server.down:
+            return self._send(503, {'error': 'unavailable'})
+        if self.path not in ('/api/chat', '/v1/chat/completions'):
+            return self._send(404, {'error': 'not found'})
+        if server.error_status is not None:
+            return self._send(server.error_status, {'error': f'injected status {server.error_status}'})
+        if self.path == '/api/chat':
+            fmt = request.get('format')
+            schema = fmt if isinstance(fmt, dict) else None
+        else:
+            schema = (request.get('response_format') or {}).get('json_schema', {}).get('schema')
+        content = server.reply(request.get('messages', []), schema)
+        # 中文回复约每字一个token
+        eval_tokens = len(content)
+        eval_seconds = eval_tokens / server.token_rate if server.token_rate else 0.0
+        start = time.monotonic()
+        with server._lock:
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+        try:
+            with server.slots:
+                time.sleep(server.latency + eval_seconds)
+        finally:
+            with server._lock:
+                server.in_flight -= 1
+        if random.random() < server.fail_rate:
+            return self._send(500, {'error': 'injected failure'})
+        duration = time.monotonic() - start
+        if self.path == '/api/chat':
+            self._send(200, {
+                'model': request.get('model'), 'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'message': {'role': 'assistant', 'content': content}, 'done': True, 'done_reason': 'stop',
+                'total_duration': int(duration * 1e9), 'eval_duration': int((eval_seconds or server.latency) * 1e9),
+                'prompt_eval_count': 100, 'eval_count': eval_tokens,
+            })
+        else:
+            self._send(200, {
+                'id': f"chatcmpl-{server.requests}", 'object': 'chat.completion', 'model': request.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 100, 'completion_tokens': eval_tokens, 'total_tokens': 100 + eval_tokens},
+            })
+
+
+def start_server(port=0, **kwargs):
+    """
+    在后台线程中启动模拟推理主机
+    返回:
+        FakeLLMServer: 已启动的服务，用完后调用 shutdown()
+    """
+    server = FakeLLMServer(('127.0.0.1', port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟推理服务（Ollama 与 OpenAI 兼容接口）")
+    parser.add_argument("--port", type=int, default=11500, help="第一台主机的端口，其余主机依次递增")
+    parser.add_argument("--hosts", type=int, default=1, help="启动的模拟主机数")
+    parser.add_argument("--latency", type=float, default=0.5, help="每个请求的处理时间（秒）")
+    parser.add_argument("--slots", type=int, default=4, help="每台主机同时处理的请求数")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="每个槽位的输出速度（token/秒），0 表示不模拟")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="以 HTTP 500 失败的请求比例")
+    args = parser.parse_args()
+
+    servers = [start_server(args.port + i, latency=args.latency, slots=args.slots, fail_rate=args.fail_rate,
+                            token_rate=args.token_rate)
+               for i in range(args.hosts)]
+    for server in servers:
+        print(f"模拟推理主机: {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
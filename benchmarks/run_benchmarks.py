@@ -0,0 +1,353 @@
+# 可复现的基准测试：语义切分、生成（模拟推理主机）与Parquet导出的吞吐量、p50/p99延迟和峰值内存，
+# 结果写成JSON（附带git提交号），用 --compare 与另一次的结果对比，判断某次改动是否带来提升
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+# 默认规模
+CHUNK_SENTENCES = (500, 2000, 8000)
+GENERATION_CHUNKS = (32, 128)
+EXPORT_ROWS = (10000, 100000, 1000000)
+# --quick 使用的规模，用于快速检查脚本本身是否可用
+QUICK_CHUNK_SENTENCES = (200,)
+QUICK_GENERATION_CHUNKS = (16,)
+QUICK_EXPORT_ROWS = (1000, 10000)
+
+
+def git_commit():
+    """当前的git提交号，工作区有未提交的修改时加 -dirty 后缀；不在git仓库中时返回None"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def peak_rss():
+    """本进程的峰值常驻内存（字节）；Linux 上 ru_maxrss 以KB为单位，macOS 上以字节为单位"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def latency_stats(latencies):
+    """
+    延迟分布（秒）
+    返回:
+        dict: 样本数、p50、p99、平均值与最大值
+    """
+    if not latencies:
+        return {'samples': 0, 'p50': None, 'p99': None, 'mean': None, 'max': None}
+    values = np.asarray(latencies, dtype=np.float64)
+    return {
+        'samples': int(values.size),
+        'p50': round(float(np.percentile(values, 50)), 6),
+        'p99': round(float(np.percentile(values, 99)), 6),
+        'mean': round(float(values.mean()), 6),
+        'max': round(float(values.max()), 6),
+    }
+
+
+def bench_chunking(name, text, model_path, max_length, threshold, batch_size, window, backend='torch'):
+    """
+    流式语义切分的吞吐量；延迟为每个窗口（window 个句子）从计算嵌入到产出文本块的耗时，
+    模型加载时间单独记录，不计入吞吐量
+    """
+    import TextDivider
+
+    engine = TextDivider.EmbeddingEngine(model_path, backend=backend)
+    engine.load()
+    num_sentences = len(TextDivider.split_sentences(text))
+    latencies = []
+    num_chunks = 0
+    start = time.perf_counter()
+    last = start
+    for chunks in TextDivider.iter_split_text(text, max_length, threshold, engine=engine, batch_size=batch_size,
+                                              window=window):
+        now = time.perf_counter()
+        latencies.append(now - last)
+        last = now
+        num_chunks += len(chunks)
+    elapsed = time.perf_counter() - start
+    return {
+        'suite': 'chunking', 'case': name,
+        'params': {'sentences': num_sentences, 'characters': len(text), 'max_length': max_length,
+                   'threshold': threshold, 'batch_size': batch_size, 'window': window, 'backend': backend},
+        'throughput': round(num_sentences / elapsed, 2) if elapsed > 0 else None, 'unit': 'sentences/s',
+        'elapsed': round(elapsed, 4), 'latency': latency_stats(latencies),
+        'chunks': num_chunks, 'model_load_seconds': round(engine.load_time, 4),
+    }
+
+
+def bench_generation(name, num_chunks, entries_per_chunk, batch, latency, token_rate, slots, max_in_flight):
+    """
+    异步生成引擎对一台模拟推理主机的吞吐量；延迟为客户端观测到的单次请求耗时（含排队）
+    """
+    import GenerationEngine
+    from fake_llm_server import start_server
+
+    server = start_server(latency=latency, slots=slots, token_rate=token_rate)
+    texts = [f"第{i}段基准测试文本。" * 40 for i in range(num_chunks)]
+    engine = GenerationEngine.AsyncGenerationEngine(max_in_flight=max_in_flight, model='fake-model', host=server.url)
+    try:
+        start = time.perf_counter()
+        entries = asyncio.run(engine.run(texts, entries_per_chunk, batch=batch))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+    tokens = sum(timing.get('eval_tokens', 0) for timing in engine.timings)
+    return {
+        'suite': 'generation', 'case': name,
+        'params': {'chunks': num_chunks, 'entries_per_chunk': entries_per_chunk, 'batch': batch,
+                   'server_latency': latency, 'token_rate': token_rate, 'slots': slots,
+                   'max_in_flight': max_in_flight},
+        'throughput': round(len(entries) / elapsed, 2) if elapsed > 0 else None, 'unit': 'entries/s',
+        'elapsed': round(elapsed, 4),
+        'latency': latency_stats([timing['latency'] for timing in engine.timings if 'latency' in timing]),
+        'entries': len(entries), 'requests': server.requests,
+        'tokens_per_second': round(tokens / elapsed, 2) if elapsed > 0 else None,
+    }
+
+
+def write_synthetic_parquet(path, num_rows, seed=42):
+    """写出 num_rows 行合成的 instruction/input/output 数据集"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rng = np.random.default_rng(seed)
+    words = np.array(list('天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏闰余成岁律吕调阳'))
+    batch_size = 100000
+    writer = None
+    try:
+        for offset in range(0, num_rows, batch_size):
+            count = min(batch_size, num_rows - offset)
+            body = [''.join(row) for row in words[rng.integers(0, len(words), size=(count, 48))]]
+            table = pa.table({
+                'instruction': [f"问题{offset + i}：{text[:16]}？" for i, text in enumerate(body)],
+                'input': [''] * count,
+                'output': [f"回答：{text}。" for text in body],
+            })
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def bench_export(name, num_rows, formats, batch_size, repeat):
+    """
+    Parquet导出为Alpaca等格式的吞吐量；延迟为每次完整导出的耗时（重复 repeat 次）
+    """
+    import DatasetExporter
+
+    with tempfile.TemporaryDirectory(prefix='tdf-bench-') as work_dir:
+        parquet_path = os.path.join(work_dir, 'dataset.parquet')
+        write_synthetic_parquet(parquet_path, num_rows)
+        latencies = []
+        output_bytes = 0
+        for i in range(repeat):
+            output_dir = os.path.join(work_dir, f'export-{i}')
+            start = time.perf_counter()
+            files = DatasetExporter.export_dataset(parquet_path, output_dir, formats=formats, batch_size=batch_size,
+                                                   write_dataset_info=False)
+            latencies.append(time.perf_counter() - start)
+            output_bytes = sum(os.path.getsize(os.path.join(output_dir, file_name)) for file_name in files.values())
+    elapsed = float(np.median(latencies))
+    return {
+        'suite': 'export', 'case': name,
+        'params': {'rows': num_rows, 'formats': list(formats), 'batch_size': batch_size, 'repeat': repeat},
+        'throughput': round(num_rows / elapsed, 2) if elapsed > 0 else None, 'unit': 'rows/s',
+        'elapsed': round(elapsed, 4), 'latency': latency_stats(latencies), 'output_bytes': output_bytes,
+    }
+
+
+def _run_case(function, kwargs):
+    """在子进程中执行一项测试，附上该进程的峰值内存"""
+    # 每个请求、每个条目一行的INFO日志会明显拖慢测试
+    logging.disable(logging.INFO)
+    result = function(**kwargs)
+    result['peak_rss_bytes'] = peak_rss()
+    return result
+
+
+def run_isolated(function, **kwargs):
+    """
+    每项测试在新启动（spawn）的子进程中执行，峰值内存互不影响，也不受前一项测试留下的缓存和线程池影响
+    返回:
+        dict: 测试结果；失败时只记录错误信息，不中断其余测试
+    """
+    try:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            return executor.submit(_run_case, function, kwargs).result()
+    except Exception as e:
+        return {'suite': function.__name__.replace('bench_', ''), 'case': kwargs.get('name'),
+                'error': f"{type(e).__name__}: {e}"}
+
+
+def chunking_cases(args):
+    """合成文本的各个规模，加上 --corpus 指定的样本文件（空文件跳过）"""
+    from bench_divider import synthetic_text
+
+    for sentences in args.chunk_sentences:
+        yield f"synthetic-{sentences}", synthetic_text(sentences), None
+    for path in args.corpus:
+        name = f"corpus-{os.path.basename(path)}"
+        if not os.path.isfile(path):
+            yield name, None, f"文件不存在: {path}"
+            continue
+        with open(path, 'r', encoding='utf-8') as file:
+            text = file.read()
+        if not text.strip():
+            yield name, None, f"空文件: {path}"
+            continue
+        yield name, text, None
+
+
+def run_suites(args):
+    results = []
+    if 'chunking' in args.suites:
+        try:
+            cases = list(chunking_cases(args))
+        except ImportError as e:
+            # 切分依赖 torch/transformers，缺少时只跳过这一组
+            cases = []
+            results.append({'suite': 'chunking', 'case': 'all', 'error': f"{type(e).__name__}: {e}"})
+            _print_result(results[-1])
+        for name, text, skipped in cases:
+            if skipped:
+                results.append({'suite': 'chunking', 'case': name, 'skipped': skipped})
+                continue
+            results.append(run_isolated(bench_chunking, name=name, text=text, model_path=args.model_path,
+                                        max_length=args.max_length, threshold=args.threshold,
+                                        batch_size=args.batch_size, window=args.window,
+                                        backend=args.embedding_backend))
+            _print_result(results[-1])
+    if 'generation' in args.suites:
+        for chunks in args.generation_chunks:
+            for batch in (False, True):
+                name = f"{'batch' if batch else 'single'}-{chunks}"
+                results.append(run_isolated(bench_generation, name=name, num_chunks=chunks,
+                                            entries_per_chunk=args.entries, batch=batch, latency=args.latency,
+                                            token_rate=args.token_rate, slots=args.slots,
+                                            max_in_flight=args.max_in_flight))
+                _print_result(results[-1])
+    if 'export' in args.suites:
+        for rows in args.export_rows:
+            results.append(run_isolated(bench_export, name=f"rows-{rows}", num_rows=rows, formats=tuple(args.formats),
+                                        batch_size=args.export_batch_size, repeat=args.repeat))
+            _print_result(results[-1])
+    return results
+
+
+def _print_result(result):
+    label = f"[{result['suite']}] {result['case']}"
+    if 'error' in result:
+        print(f"{label}: 失败 {result['error']}")
+    elif 'skipped' in result:
+        print(f"{label}: 跳过 {result['skipped']}")
+    else:
+        latency = result['latency']
+        p50 = f"{latency['p50'] * 1000:.1f}ms" if latency['p50'] is not None else '-'
+        p99 = f"{latency['p99'] * 1000:.1f}ms" if latency['p99'] is not None else '-'
+        print(f"{label}: {result['throughput']} {result['unit']}，p50 {p50}，p99 {p99}，"
+              f"峰值内存 {result['peak_rss_bytes'] / 1024 / 1024:.0f}MB")
+
+
+def compare(report, baseline):
+    """逐项打印与基线结果的吞吐量、p99延迟与峰值内存之比"""
+    print(f"对比基线 {baseline.get('commit')} -> {report.get('commit')}")
+    previous = {(r['suite'], r['case']): r for r in baseline.get('results', []) if 'throughput' in r}
+    for result in report['results']:
+        old = previous.get((result['suite'], result['case']))
+        if old is None or 'throughput' not in result:
+            continue
+        line = f"[{result['suite']}] {result['case']}:"
+        if old['throughput'] and result['throughput']:
+            line += f" 吞吐 {result['throughput'] / old['throughput']:.2f}x"
+        if old['latency']['p99'] and result['latency']['p99']:
+            line += f"，p99 {result['latency']['p99'] / old['latency']['p99']:.2f}x"
+        line += f"，峰值内存 {result['peak_rss_bytes'] / old['peak_rss_bytes']:.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="切分、生成与导出的基准测试，结果写成JSON")
+    parser.add_argument("--suites", nargs="+", choices=["chunking", "generation", "export"],
+                        default=["chunking", "generation", "export"], help="运行的测试组")
+    parser.add_argument("--quick", action="store_true", help="使用很小的规模快速检查")
+    parser.add_argument("--output", help="结果文件，默认 benchmarks/results/<提交号>.json")
+    parser.add_argument("--compare", help="与之对比的另一次结果文件")
+    # 切分
+    parser.add_argument("--chunk-sentences", type=int, nargs="+", help="合成文本的句子数")
+    parser.add_argument("--corpus", nargs="*", default=[os.path.join(ROOT_DIR, "uploads", "1.txt")],
+                        help="样本语料文件")
+    parser.add_argument("--model-path", default=os.path.join(ROOT_DIR, "bert-base-chinese"))
+    parser.add_argument("--max-length", type=int, default=2048)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--window", type=int, default=256, help="流式切分每批的句子数")
+    parser.add_argument("--embedding-backend", default="torch", help="嵌入计算后端，见 TextDivider.EMBEDDING_BACKENDS")
+    # 生成
+    parser.add_argument("--generation-chunks", type=int, nargs="+", help="文本块数")
+    parser.add_argument("--entries", type=int, default=5, help="每个文本块的条目数")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟主机每个请求的固定耗时（秒）")
+    parser.add_argument("--token-rate", type=float, default=2000.0, help="模拟主机每个槽位的输出速度（token/秒）")
+    parser.add_argument("--slots", type=int, default=8, help="模拟主机同时处理的请求数")
+    parser.add_argument("--max-in-flight", type=int, default=16, help="生成引擎的在途请求上限")
+    # 导出
+    parser.add_argument("--export-rows", type=int, nargs="+", help="导出的数据集行数")
+    parser.add_argument("--formats", nargs="+", default=["alpaca"], help="导出格式")
+    parser.add_argument("--export-batch-size", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3, help="每个导出规模重复的次数")
+    args = parser.parse_args()
+
+    args.chunk_sentences = args.chunk_sentences or (QUICK_CHUNK_SENTENCES if args.quick else CHUNK_SENTENCES)
+    args.generation_chunks = args.generation_chunks or (QUICK_GENERATION_CHUNKS if args.quick else GENERATION_CHUNKS)
+    args.export_rows = args.export_rows or (QUICK_EXPORT_ROWS if args.quick else EXPORT_ROWS)
+    if args.quick:
+        args.repeat = 1
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'quick': args.quick,
+        'results': run_suites(args),
+    }
+
+    output = args.output or os.path.join(BENCH_DIR, 'results', f"{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            compare(report, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# 嵌入后端验证：在参考语料上比较量化/ONNX后端与 torch fp32 基准的切分边界差异和句子嵌入吞吐量，
+# 用于评估用多少切分精度换取多少CPU吞吐
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+import TextDivider  # noqa: E402
+from bench_divider import synthetic_text  # noqa: E402
+
+
+def chunk_boundaries(chunks):
+    """
+    文本块在原文中的结束位置（字符偏移）；文本块由句子直接拼接而成，偏移可以直接累加
+    返回:
+        set: 除最后一个文本块外的全部切分位置
+    """
+    offsets = np.cumsum([len(chunk) for chunk in chunks])
+    return set(offsets[:-1].tolist())
+
+
+def boundary_divergence(baseline, candidate):
+    """
+    比较两组切分边界
+    返回:
+        dict: 基准与候选的边界数、一致的边界数、精确率、召回率与分歧率（1 - 交集/并集）
+    """
+    common = len(baseline & candidate)
+    union = len(baseline | candidate)
+    return {
+        'baseline_boundaries': len(baseline),
+        'candidate_boundaries': len(candidate),
+        'matched': common,
+        'precision': round(common / len(candidate), 4) if candidate else 1.0,
+        'recall': round(common / len(baseline), 4) if baseline else 1.0,
+        'divergence': round(1 - common / union, 4) if union else 0.0,
+    }
+
+
+def embed(engine, sentences, batch_size, repeat):
+    """
+    计算句子嵌入并计时（先用少量句子预热，取 repeat 次中最快的一次）
+    返回:
+        tuple: (嵌入矩阵, token数列表, 句子/秒)
+    """
+    engine.load()
+    engine.embed_sentences(sentences[:batch_size], batch_size=batch_size)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        embeddings, token_counts = engine.embed_sentences(sentences, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return embeddings, token_counts, len(sentences) / best
+
+
+def load_corpus(paths, sentences):
+    """读取参考语料，空文件跳过；未指定或全部为空时使用合成文本"""
+    texts = {}
+    for path in paths:
+        text = TextDivider.read_text_file(path)
+        if text.strip():
+            texts[os.path.basename(path)] = text
+        else:
+            print(f"跳过空文件: {path}")
+    return texts or {f"synthetic-{sentences}": synthetic_text(sentences)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="嵌入后端的切分边界差异与吞吐量验证")
+    parser.add_argument("--corpus", nargs="*", default=[], help="参考语料文件，不指定时使用合成文本")
+    parser.add_argument("--sentences", type=int, default=2000, help="合成文本的句子数")
+    parser.add_argument("--backends", nargs="+", choices=TextDivider.EMBEDDING_BACKENDS[1:],
+                        default=list(TextDivider.EMBEDDING_BACKENDS[1:]), help="与 torch fp32 对比的后端")
+    parser.add_argument("--model-path", default="./bert-base-chinese")
+    parser.add_argument("--max-length", type=int, default=2048)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.79], help="比较的相似度阈值")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=2, help="计时重复次数，取最快的一次")
+    parser.add_argument("--output", help="把结果写成JSON文件")
+    args = parser.parse_args()
+
+    texts = load_corpus(args.corpus, args.sentences)
+    sentences = {name: TextDivider.split_sentences(text) for name, text in texts.items()}
+    all_sentences = [sentence for group in sentences.values() for sentence in group]
+    print(f"参考语料: {', '.join(texts)}，共 {len(all_sentences)} 个句子")
+
+    def _chunk(embeddings, token_counts, threshold):
+        """按语料逐个切分，返回 语料名 -> 切分边界"""
+        boundaries = {}
+        start = 0
+        for name, group in sentences.items():
+            end = start + len(group)
+            chunks = TextDivider.merge_by_similarity(group, embeddings[start:end], token_counts[start:end],
+                                                     args.max_length, threshold)
+            boundaries[name] = chunk_boundaries(TextDivider.merge_short_chunks(chunks))
+            start = end
+        return boundaries
+
+    baseline_engine = TextDivider.EmbeddingEngine(args.model_path, backend='torch')
+    base_embeddings, base_counts, base_rate = embed(baseline_engine, all_sentences, args.batch_size, args.repeat)
+    print(f"torch: {base_rate:.1f} 句/秒，参数内存 {baseline_engine.param_bytes / 1024 ** 2:.1f} MB")
+    base_boundaries = {threshold: _chunk(base_embeddings, base_counts, threshold) for threshold in args.thresholds}
+
+    report = {'corpus': list(texts), 'sentences': len(all_sentences), 'max_length': args.max_length,
+              'baseline': {'backend': 'torch', 'sentences_per_second': round(base_rate, 2),
+                           'param_bytes': baseline_engine.param_bytes},
+              'backends': []}
+    for backend in args.backends:
+        engine = TextDivider.EmbeddingEngine(args.model_path, backend=backend)
+        try:
+            embeddings, counts, rate = embed(engine, all_sentences, args.batch_size, args.repeat)
+        except ImportError as e:
+            print(f"{backend}: 跳过，{e}")
+            report['backends'].append({'backend': backend, 'error': str(e)})
+            continue
+        # 句子嵌入与基准的余弦相似度
+        cosine = np.einsum('ij,ij->i', embeddings, base_embeddings) / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(base_embeddings, axis=1) + 1e-12)
+        result = {
+            'backend': backend,
+            'sentences_per_second': round(rate, 2),
+            'speedup': round(rate / base_rate, 2),
+            'param_bytes': engine.param_bytes,
+            'cosine_mean': round(float(cosine.mean()), 6),
+            'cosine_min': round(float(cosine.min()), 6),
+            'thresholds': [],
+        }
+        for threshold in args.thresholds:
+            candidate = _chunk(embeddings, counts, threshold)
+            baseline_set = {(name, offset) for name, offsets in base_boundaries[threshold].items() for offset in offsets}
+            candidate_set = {(name, offset) for name, offsets in candidate.items() for offset in offsets}
+            result['thresholds'].append(dict(boundary_divergence(baseline_set, candidate_set), threshold=threshold))
+        report['backends'].append(result)
+
+        print(f"{backend}: {rate:.1f} 句/秒（{result['speedup']:.2f}x），参数内存 {engine.param_bytes / 1024 ** 2:.1f} MB，"
+              f"嵌入余弦相似度 平均 {result['cosine_mean']:.4f} / 最低 {result['cosine_min']:.4f}")
+        for item in result['thresholds']:
+            print(f"  阈值 {item['threshold']}: 切分边界分歧率 {item['divergence']:.2%}，"
+                  f"一致 {item['matched']}/{item['baseline_boundaries']}，候选边界 {item['candidate_boundaries']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# AIWorker 同步生成路径的测试：请求出错时的重试与重试次数指标
+import json
+
+import AIWorker
+
+ENTRY = {'instruction': '问题', 'input': '', 'output': '回答'}
+
+
+def retries():
+    return AIWorker.RETRIES.value(source='generate_single_entry')
+
+
+def test_retries_request_errors(monkeypatch):
+    calls = []
+
+    def _chat_once(prompt, model, options=None):
+        calls.append(prompt)
+        if len(calls) < 3:
+            raise ConnectionError('连接被拒绝')
+        return json.dumps(ENTRY, ensure_ascii=False), {}
+
+    monkeypatch.setattr(AIWorker, 'chat_once', _chat_once)
+    monkeypatch.setattr(AIWorker.time, 'sleep', lambda seconds: None)
+    before = retries()
+    entry = AIWorker.generate_single_entry('文本')
+    assert entry['output'] == '回答' and len(calls) == 3
+    assert retries() - before == 2
+
+
+def test_gives_up_after_max_tries(monkeypatch):
+    def _chat_once(prompt, model, options=None):
+        raise ConnectionError('连接被拒绝')
+
+    monkeypatch.setattr(AIWorker, 'chat_once', _chat_once)
+    monkeypatch.setattr(AIWorker.time, 'sleep', lambda seconds: None)
+    before = retries()
+    assert not AIWorker.generate_single_entry('文本')
+    assert retries() - before == 2
+
+
+def test_parse_failure_is_not_retried(monkeypatch):
+    calls = []
+
+    def _chat_once(prompt, model, options=None):
+        calls.append(prompt)
+        return '没有JSON', {}
+
+    monkeypatch.setattr(AIWorker, 'chat_once', _chat_once)
+    before = retries()
+    assert AIWorker.generate_single_entry('文本') == {} and len(calls) == 1
+    assert retries() == before
@@ -0,0 +1,35 @@
+# DatasetExporter 的测试：一次读取写出多种格式与划分
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import DatasetExporter
+
+
+def write_parquet(path, num_rows):
+    rows = [{'instruction': f'问题{i}', 'input': '', 'output': f'回答{i}'} for i in range(num_rows)]
+    pq.write_table(pa.Table.from_pylist(rows), path)
+    return rows
+
+
+def test_all_split_keeps_source_order(tmp_path):
+    rows = write_parquet(tmp_path / 'data.parquet', 30)
+    files = DatasetExporter.export_dataset(str(tmp_path / 'data.parquet'), str(tmp_path), formats=('alpaca',),
+                                           splits=('all',))
+    with open(os.path.join(tmp_path, files[('alpaca', 'all')]), encoding='utf-8') as file:
+        assert json.load(file) == rows
+
+
+def test_train_and_test_cover_all_rows(tmp_path):
+    rows = write_parquet(tmp_path / 'data.parquet', 30)
+    files = DatasetExporter.export_dataset(str(tmp_path / 'data.parquet'), str(tmp_path), formats=('jsonl',),
+                                           test_size=0.2)
+    exported = {}
+    for split in ('train', 'test'):
+        with open(os.path.join(tmp_path, files[('jsonl', split)]), encoding='utf-8') as file:
+            exported[split] = [json.loads(line) for line in file]
+    assert (len(exported['train']), len(exported['test'])) == (24, 6)
+    assert sorted(exported['train'] + exported['test'], key=lambda row: row['instruction']) == \
+        sorted(rows, key=lambda row: row['instruction'])
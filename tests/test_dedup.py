@@ -0,0 +1,40 @@
+# Dedup 的测试：生成前的文本块语义去重
+import logging
+
+import numpy as np
+
+import Dedup
+
+
+def test_downweights_similar_chunks_and_logs_them(caplog):
+    embeddings = np.array([[1.0, 0.0], [0.0, 1.0], [1.0, 0.01]])
+    chunk_filter = Dedup.SimilarChunkFilter(0.95, 'downweight', entries_per_chunk=5, duplicate_entries=1)
+    with caplog.at_level(logging.INFO, logger='Dedup'):
+        texts, counts = chunk_filter.filter(['页眉', '正文', '页眉。'], embeddings)
+    assert texts == ['页眉', '正文', '页眉。'] and counts == [5, 5, 1]
+    assert chunk_filter.stats()['duplicates'] == 1
+    assert '已降权' in caplog.text and '页眉。' in caplog.text
+
+
+def test_drop_mode_removes_similar_chunks():
+    embeddings = np.array([[1.0, 0.0], [1.0, 0.01], [0.0, 1.0]])
+    texts, counts, stats = Dedup.filter_similar_chunks(['a', 'b', 'c'], embeddings, mode='drop', entries_per_chunk=3)
+    assert texts == ['a', 'c'] and counts == [3, 3]
+    assert stats['duplicates'] == 1
+
+
+def test_switches_to_approximate_index_past_exact_limit():
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((120, 64))
+    chunk_filter = Dedup.SimilarChunkFilter(0.95, 'drop', exact_limit=50)
+    texts, _ = chunk_filter.filter([f'文本块{i}' for i in range(60)], embeddings[:60])
+    assert len(texts) == 60
+    assert isinstance(chunk_filter.index, Dedup.HyperplaneLSHIndex)
+
+    # 转换前后登记的文本块都能被识别为重复，编号保持不变
+    noisy = embeddings[[3, 55]] + rng.standard_normal((2, 64)) * 0.01
+    texts, _ = chunk_filter.filter(['重复3', '重复55'] + [f'文本块{i}' for i in range(60, 120)],
+                                   np.vstack([noisy, embeddings[60:]]))
+    assert texts == [f'文本块{i}' for i in range(60, 120)]
+    assert chunk_filter.stats()['duplicates'] == 2 and len(chunk_filter.index) == 120
+    assert chunk_filter.index.nearest(embeddings[3])[0] == 3
@@ -0,0 +1,45 @@
+# GenerationEngine 的测试：流水线中线程队列与异步生成之间的停止
+import asyncio
+import queue
+import threading
+import time
+
+import pytest
+
+import GenerationEngine
+
+
+def test_iter_queue_yields_until_sentinel():
+    chunk_queue = queue.Queue()
+    for item in [('a', 'k1', 1), ('b', 'k2', 1), None]:
+        chunk_queue.put(item)
+
+    async def _collect():
+        return [item async for item in GenerationEngine.iter_queue(chunk_queue)]
+
+    assert asyncio.run(_collect()) == [('a', 'k1', 1), ('b', 'k2', 1)]
+
+
+def test_iter_queue_returns_when_stopped(monkeypatch):
+    monkeypatch.setattr(GenerationEngine, 'QUEUE_POLL_INTERVAL', 0.05)
+    chunk_queue = queue.Queue()
+    stop = threading.Event()
+    threading.Timer(0.1, stop.set).start()
+
+    async def _collect():
+        return [item async for item in GenerationEngine.iter_queue(chunk_queue, stop)]
+
+    start = time.monotonic()
+    assert asyncio.run(_collect()) == []
+    assert time.monotonic() - start < 1
+
+
+def test_consumer_failure_sets_stop(monkeypatch):
+    async def _fail(self, items, *args, **kwargs):
+        raise RuntimeError('生成失败')
+
+    monkeypatch.setattr(GenerationEngine.AsyncGenerationEngine, 'run_stream', _fail)
+    stop = threading.Event()
+    with pytest.raises(RuntimeError):
+        GenerationEngine.generate_stream_async(queue.Queue(), stop=stop)
+    assert stop.is_set()
@@ -0,0 +1,23 @@
+# AIWorker.generation_options 的测试：输出上限与上下文窗口
+import pytest
+
+import AIWorker
+
+
+def test_num_predict_fits_in_context_window():
+    options = AIWorker.generation_options([], 5, True, context_window=4096, max_text_tokens=2048)
+    prompt_tokens = 4096 - options['num_predict']
+    assert options['num_ctx'] == 4096
+    assert 0 < options['num_predict'] < AIWorker.NUM_PREDICT_PER_ENTRY * 5
+    assert prompt_tokens > 2048
+
+
+def test_unbounded_window_keeps_requested_num_predict():
+    options = AIWorker.generation_options(['短文本'], 2, True, num_predict=300)
+    assert options['num_predict'] == 300
+    assert options['num_ctx'] % AIWorker.NUM_CTX_STEP == 0
+
+
+def test_prompt_larger_than_window_is_rejected():
+    with pytest.raises(ValueError):
+        AIWorker.generation_options([], 5, True, context_window=2048, max_text_tokens=2048)
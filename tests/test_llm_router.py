@@ -0,0 +1,226 @@
+# LLMRouter 的测试：使用 benchmarks/fake_llm_server.py 在本机启动的模拟推理主机
+import asyncio
+import threading
+import time
+
+import ollama
+import pytest
+
+import LLMRouter
+from fake_llm_server import start_server
+
+MESSAGES = [{'role': 'user', 'content': '你好'}]
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def _start(count=1, **kwargs):
+        kwargs.setdefault('latency', 0.01)
+        for _ in range(count):
+            started.append(start_server(**kwargs))
+        return started[-count:]
+
+    yield _start
+    for server in started:
+        server.shutdown()
+
+
+def make_router(servers, kind='ollama', health_interval=None, **kwargs):
+    suffix = '/v1' if kind == 'openai' else ''
+    return LLMRouter.LLMRouter([LLMRouter.create_backend(dict({'type': kind, 'url': server.url + suffix}, **kwargs))
+                                for server in servers], health_interval=health_interval)
+
+
+def test_picks_least_outstanding_backend(servers):
+    busy, idle = servers(2)
+    router = make_router([busy, idle], max_in_flight=4)
+    router.backends[0].in_flight = 2
+    asyncio.run(router.chat('fake-model', MESSAGES))
+    assert (busy.requests, idle.requests) == (0, 1)
+
+
+def test_load_is_relative_to_backend_limit(servers):
+    large, small = servers(2)
+    router = LLMRouter.LLMRouter([LLMRouter.create_backend({'url': large.url, 'max_in_flight': 8}),
+                                  LLMRouter.create_backend({'url': small.url, 'max_in_flight': 2})],
+                                 health_interval=None)
+    router.backends[0].in_flight = 2    # 2/8
+    router.backends[1].in_flight = 1    # 1/2
+    asyncio.run(router.chat('fake-model', MESSAGES))
+    assert (large.requests, small.requests) == (1, 0)
+
+
+def test_circuit_breaker_transitions():
+    breaker = LLMRouter.CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    assert breaker.state == breaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == breaker.CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == breaker.HALF_OPEN and breaker.allow()
+    breaker.on_start()
+    # 半开状态同一时间只放行一个试探请求
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+
+    time.sleep(0.06)
+    breaker.on_start()
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED and breaker.failures == 0
+
+
+@pytest.mark.parametrize('status', [500, 503, 404, 429])
+def test_fails_over_on_backend_errors(servers, status):
+    failing, healthy = servers(2)
+    failing.error_status = status
+    router = make_router([failing, healthy])
+    response = asyncio.run(router.chat('fake-model', MESSAGES))
+    assert response['message']['content']
+    assert healthy.requests == 1
+    assert router.backends[0].failures == 1
+
+
+@pytest.mark.parametrize('status', [400, 401, 422])
+def test_does_not_fail_over_on_request_errors(servers, status):
+    failing, healthy = servers(2)
+    failing.error_status = status
+    router = make_router([failing, healthy])
+    with pytest.raises(ollama.ResponseError):
+        asyncio.run(router.chat('fake-model', MESSAGES))
+    assert healthy.requests == 0
+    # 请求本身的问题不计入后端的熔断
+    assert router.backends[0].breaker.failures == 0
+
+
+def test_opens_breaker_after_repeated_failures(servers):
+    failing, healthy = servers(2)
+    failing.error_status = 500
+    router = make_router([failing, healthy], failure_threshold=2, reset_timeout=60)
+
+    async def _run():
+        for _ in range(4):
+            await router.chat('fake-model', MESSAGES)
+
+    asyncio.run(_run())
+    assert router.backends[0].breaker.state == LLMRouter.CircuitBreaker.OPEN
+    # 熔断后不再转发到故障后端
+    assert router.backends[0].failures == 2
+    assert healthy.requests == 4
+
+
+def test_waits_for_half_open_when_all_backends_are_down(servers):
+    server, = servers(1)
+    server.down = True
+    router = make_router([server], failure_threshold=1, reset_timeout=0.3)
+
+    def _recover():
+        time.sleep(0.2)
+        server.down = False
+
+    threading.Thread(target=_recover).start()
+    start = time.monotonic()
+    response = asyncio.run(router.chat('fake-model', MESSAGES))
+    assert response['message']['content']
+    assert time.monotonic() - start >= 0.25
+    assert router.backends[0].breaker.state == LLMRouter.CircuitBreaker.CLOSED
+
+
+def test_gives_up_after_wait_timeout(servers):
+    server, = servers(1)
+    server.down = True
+    router = make_router([server], failure_threshold=1, reset_timeout=0.1)
+    router.wait_timeout = 0.3
+    start = time.monotonic()
+    with pytest.raises(LLMRouter.NoBackendAvailable):
+        asyncio.run(router.chat('fake-model', MESSAGES))
+    assert 0.3 <= time.monotonic() - start < 2
+
+
+def test_health_check_recovers_backend(servers):
+    server, = servers(1)
+    server.down = True
+    router = make_router([server], failure_threshold=1, reset_timeout=60)
+    router.wait_timeout = 0.1
+    with pytest.raises(LLMRouter.NoBackendAvailable):
+        asyncio.run(router.chat('fake-model', MESSAGES))
+    assert router.backends[0].breaker.state == LLMRouter.CircuitBreaker.OPEN
+
+    assert asyncio.run(router.check_health()) == {router.backends[0].name: False}
+    server.down = False
+    assert asyncio.run(router.check_health()) == {router.backends[0].name: True}
+    assert router.backends[0].breaker.state == LLMRouter.CircuitBreaker.CLOSED
+    assert asyncio.run(router.chat('fake-model', MESSAGES))['message']['content']
+
+
+def test_background_health_check(servers):
+    server, = servers(1)
+    router = make_router([server], health_interval=0.05, failure_threshold=1, reset_timeout=60)
+    router.backends[0].breaker.record_failure()
+
+    async def _run():
+        router._ensure_started()
+        await asyncio.sleep(0.3)
+
+    asyncio.run(_run())
+    assert router.backends[0].breaker.state == LLMRouter.CircuitBreaker.CLOSED
+
+
+def test_openai_request_body():
+    schema = {'type': 'object', 'properties': {'entries': {'type': 'array', 'minItems': 2}}}
+    body = LLMRouter.OpenAIBackend.request_body(
+        'qwen', MESSAGES, format=schema,
+        options={'temperature': 0.7, 'top_p': 0.9, 'top_k': 40, 'num_predict': 256, 'seed': 1, 'num_ctx': 4096})
+    assert body == {
+        'model': 'qwen', 'messages': MESSAGES, 'stream': False,
+        'temperature': 0.7, 'top_p': 0.9, 'top_k': 40, 'max_tokens': 256, 'seed': 1,
+        'response_format': {'type': 'json_schema', 'json_schema': {'name': 'entries', 'schema': schema}},
+    }
+    assert LLMRouter.OpenAIBackend.request_body('qwen', MESSAGES, format='json')['response_format'] == \
+        {'type': 'json_object'}
+    assert 'response_format' not in LLMRouter.OpenAIBackend.request_body('qwen', MESSAGES, options={'top_k': None})
+
+
+def test_openai_response_mapping(servers):
+    server, = servers(1)
+    router = make_router([server], kind='openai', model='served-model')
+    schema = {'type': 'object', 'properties': {'entries': {'type': 'array', 'minItems': 3}}}
+    response = asyncio.run(router.chat('fake-model', MESSAGES, format=schema))
+    assert response['model'] == 'served-model'
+    assert response['message']['role'] == 'assistant'
+    assert '"entries"' in response['message']['content']
+    assert response['prompt_eval_count'] == 100
+    assert response['eval_count'] == len(response['message']['content'])
+    assert response['total_duration'] > 0
+
+
+def test_openai_backend_fails_over(servers):
+    failing, healthy = servers(2)
+    failing.error_status = 502
+    router = make_router([failing, healthy], kind='openai')
+    assert asyncio.run(router.chat('fake-model', MESSAGES))['message']['content']
+    assert healthy.requests == 1
+
+
+def test_shared_router_limits_in_flight_across_event_loops(servers):
+    server, = servers(1, latency=0.05, slots=16)
+    spec = {'type': 'ollama', 'url': server.url, 'max_in_flight': 3}
+    router = LLMRouter.get_shared_router([spec], health_interval=None)
+    assert LLMRouter.get_shared_router([dict(spec)]) is router
+
+    async def _job():
+        await asyncio.gather(*(router.chat('fake-model', MESSAGES) for _ in range(6)))
+
+    # 两个任务各自在自己的线程与事件循环中运行
+    threads = [threading.Thread(target=asyncio.run, args=(_job(),)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert server.requests == 12
+    assert server.peak_in_flight <= 3
+    assert router.backends[0].in_flight == 0
@@ -0,0 +1,42 @@
+# ProgressReporter 的测试：流水线任务切分与生成两个阶段合并为一个进度
+import time
+
+import ProgressReporter
+
+
+def test_single_stage_reports_last_updated_stage():
+    tracker = ProgressReporter.ProgressTracker('job')
+    tracker.update(5, 10, 'divider')
+    report = tracker.report(1.0)
+    assert report['stage'] == 'divider' and report['progress'] == 50
+
+
+def test_combined_progress_stays_on_primary_stage():
+    tracker = ProgressReporter.ProgressTracker('job')
+    tracker.combine('AI', 'divider')
+    tracker.update(20, 100, 'divider')
+    report = tracker.report(1.0)
+    # 生成尚未开始时不切换到切分阶段的进度
+    assert report['stage'] == 'AI' and report['progress'] == 0
+    assert report['feeder']['progress'] == 20
+
+    tracker.update(50, 100, 'divider')
+    tracker.update(5, 10, 'AI')
+    report = tracker.report(2.0)
+    # 已登记条目完成一半、切分完成一半，合计约四分之一
+    assert report['stage'] == 'AI' and report['progress'] == 25
+    assert report['eta'] is None
+
+
+def test_eta_known_after_finalize():
+    tracker = ProgressReporter.ProgressTracker('job')
+    tracker.combine('AI', 'divider')
+    tracker.update(100, 100, 'divider')
+    tracker.update(10, 40, 'AI')
+    now = time.monotonic()
+    tracker.report(now)
+    tracker.finalize('AI', 50)
+    tracker.update(20, 45, 'AI')
+    report = tracker.report(now + 1)
+    assert report['total'] == 50 and report['progress'] == 40
+    assert report['eta'] is not None and 'feeder' not in report
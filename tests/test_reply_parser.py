@@ -0,0 +1,69 @@
+# ReplyParser 的测试：截断、夹带花括号等模型回复的条目提取
+import json
+
+import ReplyParser
+
+KEYS = ['instruction', 'input', 'output']
+
+
+def entry(i):
+    return {'instruction': f'问题{i}', 'input': '', 'output': f'回答{i}'}
+
+
+def batch(*entries):
+    return json.dumps({'entries': list(entries)}, ensure_ascii=False)
+
+
+def test_complete_batch():
+    assert ReplyParser.extract_entries(batch(entry(1), entry(2)), KEYS) == [entry(1), entry(2)]
+
+
+def test_truncated_inside_value_drops_last_entry():
+    reply = batch(entry(1), entry(2))[:-6]
+    assert ReplyParser.extract_entries(reply, KEYS) == [entry(1)]
+
+
+def test_truncated_inside_key_keeps_complete_entries():
+    reply = '{"entries": [' + json.dumps(entry(1), ensure_ascii=False) + \
+            ', {"instruction": "cc", "input": "", "outp'
+    assert ReplyParser.extract_entries(reply, KEYS) == [entry(1)]
+
+
+def test_truncated_inside_key_of_bare_array():
+    reply = '[' + json.dumps(entry(1), ensure_ascii=False) + ', ' + json.dumps(entry(2), ensure_ascii=False) + \
+            ', {"instr'
+    assert ReplyParser.extract_entries(reply, KEYS) == [entry(1), entry(2)]
+
+
+def test_truncated_after_colon_keeps_complete_entries():
+    reply = '{"entries": [' + json.dumps(entry(1), ensure_ascii=False) + ', {"instruction":'
+    assert ReplyParser.extract_entries(reply, KEYS) == [entry(1)]
+
+
+def test_stray_open_brace_before_json():
+    reply = '下面的符号 { 开始了JSON：\n' + json.dumps(entry(1), ensure_ascii=False)
+    assert ReplyParser.extract_entries(reply, KEYS) == [entry(1)]
+
+
+def test_stray_open_brace_before_truncated_batch():
+    reply = '说明 { 略\n' + batch(entry(1), entry(2))[:-6]
+    assert ReplyParser.extract_entries(reply, KEYS) == [entry(1)]
+
+
+def test_prose_braces_after_json_are_ignored():
+    reply = json.dumps(entry(1), ensure_ascii=False) + '\n以上内容 { 仅供参考'
+    assert ReplyParser.extract_entries(reply, KEYS) == [entry(1)]
+
+
+def test_reasoning_and_code_fence():
+    reply = '<think>先想一想 {"instruction": "x"}</think>```json\n' + batch(entry(1)) + '\n```'
+    assert ReplyParser.extract_entries(reply, KEYS) == [entry(1)]
+
+
+def test_smart_quotes_and_trailing_comma():
+    reply = '{“instruction”: "问题1", "input": "", "output": "回答1",}'
+    assert ReplyParser.extract_entries(reply, KEYS) == [entry(1)]
+
+
+def test_unparseable_reply():
+    assert ReplyParser.extract_entries('没有任何JSON {', KEYS) == []
@@ -0,0 +1,194 @@
+# TextDivider 的测试：不需要加载BERT模型的部分（任务池、嵌入缓存、按相似度合并）
+import json
+import os
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+import numpy as np
+import pytest
+from scipy.spatial.distance import cosine
+
+pytest.importorskip('torch')
+pytest.importorskip('transformers')
+import TextDivider  # noqa: E402
+
+
+def _recording_task(started, index, seconds):
+    started.append(index)
+    time.sleep(max(seconds, 0))
+    if seconds < 0:
+        raise RuntimeError(f'任务 {index} 失败')
+    return index
+
+
+def test_iter_completed_cancels_remaining_tasks_when_closed():
+    started = []
+    calls = [(_recording_task, (started, i, 0.1)) for i in range(10)]
+    begin = time.monotonic()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        with closing(TextDivider.iter_completed(executor, calls, poll_interval=0.05)) as batches:
+            for results in batches:
+                if results:
+                    break
+    # 只等待已经开始的任务，其余任务被取消
+    assert time.monotonic() - begin < 0.5
+    assert len(started) <= 4
+
+
+def test_iter_completed_cancels_remaining_tasks_on_error():
+    started = []
+    calls = [(_recording_task, (started, 0, -1))] + [(_recording_task, (started, i, 0.1)) for i in range(1, 10)]
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(RuntimeError):
+            for _ in TextDivider.iter_completed(executor, calls, poll_interval=0.05):
+                pass
+    assert len(started) <= 2
+
+
+def test_iter_completed_yields_every_result():
+    started = []
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = [result for batch in TextDivider.iter_completed(
+            executor, [(_recording_task, (started, i, 0.01)) for i in range(7)], poll_interval=0.05)
+            for result in batch]
+    assert sorted(results) == list(range(7)) and len(started) == 7
+
+
+def _index_keys(cache_dir):
+    with open(os.path.join(cache_dir, 'index.json'), 'r', encoding='utf-8') as file:
+        return {key for key, _, _ in json.load(file)['entries']}
+
+
+def test_embedding_cache_flushes_only_when_asked(tmp_path):
+    cache = TextDivider.EmbeddingCache(str(tmp_path), 'model', 4, max_entries=100)
+    cache.flush()
+    cache.store(['甲', '乙'], np.ones((2, 4)), [1, 2])
+    # 未到写回间隔时不重写索引
+    cache.flush(min_interval=60)
+    assert _index_keys(tmp_path) == set()
+    cache.flush()
+    assert _index_keys(tmp_path) == {cache.make_key('甲'), cache.make_key('乙')}
+
+    reopened = TextDivider.EmbeddingCache(str(tmp_path), 'model', 4, max_entries=100)
+    found, missing = reopened.lookup(['乙', '丙'])
+    assert missing == [1] and found[0][1] == 2
+
+
+def test_embedding_cache_writes_index_before_reusing_evicted_slots(tmp_path):
+    cache = TextDivider.EmbeddingCache(str(tmp_path), 'model', 4, max_entries=40)
+    cache.store([f'旧{i}' for i in range(40)], np.ones((40, 4)), [1] * 40)
+    cache.flush()
+    cache.store(['新0', '新1', '新2'], np.full((3, 4), 2.0), [1] * 3)
+    # 一次淘汰一批（40 * 0.05 = 2 条），淘汰后立即写回索引，磁盘上不再有被覆盖槽位的旧条目
+    assert cache.evictions == 4
+    on_disk = _index_keys(tmp_path)
+    assert not on_disk & {cache.make_key(f'旧{i}') for i in range(4)}
+    assert cache.make_key('旧4') in on_disk
+
+
+# 按句首字区分话题，同一话题的句子嵌入相近（“丁”与“甲”方向相反）；token数取句子字符数
+_TOPICS = np.random.default_rng(7).standard_normal((3, 16))
+_TOPICS = np.vstack([_TOPICS, -_TOPICS[0]])
+
+
+def _fake_embedding(sentence):
+    seed = int.from_bytes(sentence.encode('utf-8')[-8:].rjust(8, b'\0'), 'little')
+    noise = np.random.default_rng(seed).standard_normal(16) * 0.6
+    return _TOPICS['甲乙丙丁'.index(sentence[0])] + noise
+
+
+def _legacy_split(text, max_length, similarity_threshold):
+    """切分改为两阶段之前的逐句实现（见 benchmarks/bench_divider.py 的 legacy_split），嵌入与分词换成假实现"""
+    sentences = re.split(r'(。|！|？|；|\n)', text)
+    sentences = [s + p for s, p in zip(sentences[::2], sentences[1::2]) if s]
+    if not sentences:
+        return []
+
+    chunks = []
+    current_chunk = sentences[0]
+    current_embedding = _fake_embedding(current_chunk)
+    last_sentence = ""
+    for sentence in sentences[1:]:
+        if last_sentence != "":
+            sentence = last_sentence + sentence
+            last_sentence = ""
+        if len(sentence.replace(" ", "").replace("\n", "")) <= 2:
+            continue
+        elif len(sentence.replace(" ", "").replace("\n", "")) <= 15:
+            last_sentence = sentence
+            continue
+
+        sentence_embedding = _fake_embedding(sentence)
+        similarity = 1 - cosine(current_embedding, sentence_embedding)
+        if similarity > similarity_threshold and len(list(current_chunk + sentence)) <= max_length:
+            current_chunk += sentence
+            current_embedding = (current_embedding + sentence_embedding) / 2
+        else:
+            chunks.append(current_chunk)
+            current_chunk = sentence
+            current_embedding = sentence_embedding
+    if current_chunk:
+        chunks.append(current_chunk)
+
+    _last_chunk = ""
+    chunks2 = []
+    for _chunk in chunks:
+        if _last_chunk != "":
+            _chunk = _last_chunk + _chunk
+            _last_chunk = ""
+        if len(_chunk) <= 20:
+            _last_chunk = _chunk
+            continue
+        else:
+            chunks2.append(_chunk)
+    return chunks2
+
+
+def _sample_text(seed):
+    rng = random.Random(seed)
+    # 第一句直接作为初始文本块，不参与短句处理
+    parts = ['甲' + '开头' * 10 + '。']
+    for _ in range(300):
+        topic = rng.choice('甲乙丙')
+        kind = rng.random()
+        if kind < 0.1:
+            parts.append('」。')                                    # 单一符号，跳过
+        elif kind < 0.3:
+            parts.append(topic + '短句' * rng.randint(1, 6) + '；')   # 超短句，与下一句合并
+        else:
+            parts.append(topic + '正文内容' * rng.randint(4, 12) + rng.choice('。！？\n'))
+    # 末尾是一个与前文不相似的短分段，旧实现会丢弃它
+    parts.append('甲' + '正文内容' * 6 + '。')
+    parts.append('丁' + '结尾' * 8 + '。')
+    return ''.join(parts)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('max_length, similarity_threshold', [(120, 0.5), (400, 0.3), (60, 0.8)])
+def test_streaming_mergers_match_legacy_loop(seed, max_length, similarity_threshold):
+    text = _sample_text(seed)
+    expected = _legacy_split(text, max_length, similarity_threshold)
+    assert len(expected) > 5 and not expected[-1].endswith('结尾。')
+
+    sentences = TextDivider.split_sentences(text)
+    embeddings = np.array([_fake_embedding(sentence) for sentence in sentences])
+    token_counts = [len(sentence) for sentence in sentences]
+
+    # 一次性输入
+    chunks = TextDivider.merge_short_chunks(
+        TextDivider.merge_by_similarity(sentences, embeddings, token_counts, max_length, similarity_threshold))
+    assert chunks == expected
+
+    # 分窗口流式输入（与 iter_split_text 相同的组合方式），附带嵌入时文本不变
+    merger = TextDivider.SimilarityMerger(max_length, similarity_threshold, with_embeddings=True)
+    short_merger = TextDivider.ShortChunkMerger()
+    streamed = []
+    for start in range(0, len(sentences), 17):
+        end = start + 17
+        streamed += short_merger.feed(merger.feed(sentences[start:end], embeddings[start:end], token_counts[start:end]))
+    streamed += short_merger.feed(merger.finish())
+    assert [text for text, _, _ in streamed] == expected
+    assert [tokens for _, _, tokens in streamed] == [len(chunk) for chunk in expected]